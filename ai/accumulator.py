@@ -0,0 +1,93 @@
+"""
+Incrementally updated first layer for TinyAlphaZero (NNUE style).
+
+The network input is sparse: one bit per piece plus the black-to-move plane.
+Its first layer is therefore the sum of the W1 rows of the pieces on the
+board, and a move only changes a handful of those rows. Accumulator keeps
+that sum for both points of view (white to move: white pieces in planes 0-5;
+black to move: black pieces in planes 0-5) and on push adds and subtracts
+the rows of the squares whose piece bits changed. This covers captures,
+castling, en passant and promotions without special cases. pop restores the
+saved sums exactly, so no rounding error builds up over a search.
+
+hidden() gives the same pre-activations as x @ W1 + b1 on the dense input,
+ready for TinyAlphaZero.forward_hidden.
+"""
+import numpy as np
+import chess
+from .encoding import PIECE_PLANES, TURN_FEATURES, _unpack, piece_masks
+
+# Input row of each colour-absolute feature (white P..K, black P..K) as seen
+# by the side to move, indexed by board.turn
+_HALF = PIECE_PLANES // 2
+_ABS = np.arange(PIECE_PLANES)
+_VIEW_ROWS = ((_ABS + _HALF) % PIECE_PLANES, _ABS)
+
+_pair_cache = [None, None, None]  # [W1, net version, its rows for both views]
+
+def _view_pairs(W1, version):
+    # [768, 2, Hidden]: the W1 row of each absolute feature for both views, so
+    # one fancy index updates both accumulators. Shared by all accumulators
+    # on the same weights; training updates W1 in place, so the net's
+    # version is part of the key.
+    if _pair_cache[0] is not W1 or _pair_cache[1] != version:
+        _pair_cache[:] = [W1, version, np.stack([W1[_VIEW_ROWS[0]], W1[_VIEW_ROWS[1]]], axis=1)]
+    return _pair_cache[2]
+
+class Accumulator:
+    def __init__(self, net, board):
+        self.net = net
+        self.board = board
+        self._stack = []
+        self.refresh()
+
+    def refresh(self):
+        # Full recomputation from the current board; needed after the
+        # network's weights change
+        W1, b1 = self.net.layer1_weights()
+        self.version = self.net.version
+        self._pairs = _view_pairs(W1, self.version)
+        self._bias = (b1 + W1[TURN_FEATURES].sum(axis=0), np.array(b1))
+        self._masks = piece_masks(self.board, chess.WHITE)
+        active = np.flatnonzero(_unpack(self._masks))
+        self.acc = self._pairs[active].sum(axis=0)
+        self._stack.clear()
+
+    def sync(self):
+        # Refresh if the weights changed. Only valid with nothing pushed.
+        if self.version != self.net.version:
+            self.refresh()
+
+    def push(self, move):
+        before = self._masks
+        self.board.push(move)
+        after = piece_masks(self.board, chess.WHITE)
+        added, removed = [], []
+        for plane, (old, new) in enumerate(zip(before, after)):
+            if old == new:
+                continue
+            for bits, rows in ((new & ~old, added), (old & ~new, removed)):
+                while bits:
+                    low = bits & -bits
+                    rows.append(plane * 64 + low.bit_length() - 1)
+                    bits ^= low
+
+        self._stack.append((self.acc, before))
+        pairs = self._pairs
+        acc = self.acc
+        if added:
+            acc = acc + pairs[added].sum(axis=0)
+        if removed:
+            acc = acc - pairs[removed].sum(axis=0)
+        self.acc = acc
+        self._masks = after
+
+    def pop(self):
+        move = self.board.pop()
+        self.acc, self._masks = self._stack.pop()
+        return move
+
+    def hidden(self, out=None):
+        # First-layer pre-activations for the side to move
+        turn = int(self.board.turn)
+        return np.add(self.acc[turn], self._bias[turn], out=out)
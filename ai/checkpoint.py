@@ -0,0 +1,204 @@
+"""
+Binary checkpoint format for numpy weight arrays.
+
+Layout (little-endian):
+  8 bytes   magic b"FLAWNET\\n"
+  uint32    format version
+  uint32    header length in bytes
+  header    UTF-8 JSON: {"meta": {...}, "arrays": {name: {"dtype", "shape", "offset"}}}
+  arrays    raw C-order data, each starting at a 64-byte aligned file offset
+
+Arrays can be read through a read-only memory map, so every process that
+loads the same file shares one physical copy of the weights through the page
+cache, and loading costs about as much as parsing the header.
+
+write_checkpoint() writes a file once, to a temporary name renamed into
+place. Files that are replaced while other processes may map them (the
+network weights, int8 or float) are published instead:
+publish_checkpoint(path) writes a new, never modified file next to path,
+mcts_weights.bin -> mcts_weights.000042.bin, and then switches path, a
+small pointer file, to it. Readers resolve the pointer
+(resolve_checkpoint), so a process that maps a version keeps a consistent
+view, and no file is ever renamed over or deleted while in use. That
+matters on Windows, which refuses both for mapped files: old versions that
+are still mapped there are left in place and removed by a later publish.
+Paths holding a plain checkpoint, as written before pointers, read as
+before.
+"""
+import json
+import os
+import re
+import struct
+import time
+import numpy as np
+
+MAGIC = b"FLAWNET\n"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+_PREFIX = struct.Struct("<8sII")
+POINTER_MAGIC = b"FLAWPTR\n"
+# Published versions kept on disk, the current one included, so that a
+# reader that just resolved the pointer still finds its file
+KEEP_VERSIONS = 3
+
+MMAP_DEFAULT = True
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+def resolve_checkpoint(path):
+    # The file a pointer at path names, else path itself
+    with open(path, "rb") as f:
+        head = f.read(len(POINTER_MAGIC) + 256)
+    if not head.startswith(POINTER_MAGIC):
+        return path
+    name = head[len(POINTER_MAGIC):].decode().strip()
+    return os.path.join(os.path.dirname(path), name)
+
+def is_checkpoint(path):
+    with open(resolve_checkpoint(path), "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def remove_file(path):
+    # False when the file is still in use (mapped on Windows) and stays
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except PermissionError:
+        return False
+    return True
+
+def _layout(arrays, meta):
+    # (header bytes, {name: spec}, end of the last array)
+    layout = {}
+    # Offsets depend on the header size and vice versa; repeat until the
+    # header fits in front of the first array
+    start = 0
+    while True:
+        offset, end = start, 0
+        for name, arr in arrays.items():
+            layout[name] = {"dtype": arr.dtype.newbyteorder("<").str,
+                            "shape": list(arr.shape), "offset": offset}
+            end = offset + arr.nbytes
+            offset = _align(end)
+        header = json.dumps({"meta": meta or {}, "arrays": layout}).encode()
+        if _PREFIX.size + len(header) <= start:
+            return header, layout, end
+        start = _align(_PREFIX.size + len(header))
+
+def _write(f, arrays, meta):
+    arrays = {name: np.ascontiguousarray(arr) for name, arr in arrays.items()}
+    header, layout, _ = _layout(arrays, meta)
+    f.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header)))
+    f.write(header)
+    for name, arr in arrays.items():
+        f.seek(layout[name]["offset"])
+        f.write(arr.astype(layout[name]["dtype"], copy=False).tobytes())
+
+def write_checkpoint(path, arrays, meta=None):
+    # For files written once; see publish_checkpoint for replaced ones
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        _write(f, arrays, meta)
+    os.replace(tmp, path)
+
+def _versions(path):
+    # {version number: file name} of the published versions of path
+    folder, name = os.path.split(path)
+    stem, ext = os.path.splitext(name)
+    pattern = re.compile(re.escape(stem) + r"\.(\d+)" + re.escape(ext) + "$")
+    matches = (pattern.match(entry) for entry in os.listdir(folder or "."))
+    return {int(m.group(1)): m.group(0) for m in matches if m}
+
+def publish_checkpoint(path, arrays, meta=None, keep=KEEP_VERSIONS):
+    """Writes a new version of the checkpoint at path and points path at it."""
+    folder = os.path.dirname(path)
+    stem, ext = os.path.splitext(os.path.basename(path))
+    versions = _versions(path)
+    number = max(versions, default=0) + 1
+    while True:
+        name = f"{stem}.{number:06d}{ext}"
+        try:
+            # Exclusive create: two writers never share a version file
+            f = open(os.path.join(folder, name), "xb")
+            break
+        except FileExistsError:
+            number += 1
+    with f:
+        _write(f, arrays, meta)
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(POINTER_MAGIC + name.encode() + b"\n")
+    for attempt in range(50):
+        try:
+            os.replace(tmp, path)
+            break
+        except PermissionError:
+            # Windows: a reader has the pointer open for a moment, or path
+            # is a plain checkpoint from before pointers that is mapped
+            if attempt == 49:
+                raise
+            time.sleep(0.01)
+
+    # Old versions; a mapped one stays until a later publish
+    versions[number] = name
+    for old in sorted(versions)[:-keep]:
+        remove_file(os.path.join(folder, versions[old]))
+
+def encode_checkpoint(arrays, meta=None):
+    # The same format as bytes, e.g. to send over the network
+    arrays = {name: np.ascontiguousarray(arr) for name, arr in arrays.items()}
+    header, layout, size = _layout(arrays, meta)
+    buf = bytearray(max(size, _PREFIX.size + len(header)))
+    _PREFIX.pack_into(buf, 0, MAGIC, FORMAT_VERSION, len(header))
+    buf[_PREFIX.size:_PREFIX.size + len(header)] = header
+    for name, arr in arrays.items():
+        data = arr.astype(layout[name]["dtype"], copy=False).tobytes()
+        buf[layout[name]["offset"]:layout[name]["offset"] + len(data)] = data
+    return bytes(buf)
+
+def decode_checkpoint(data):
+    # ({name: array}, meta) from encode_checkpoint() bytes; the arrays are
+    # read-only views of data
+    magic, version, header_len = _PREFIX.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("not a weight checkpoint")
+    if version > FORMAT_VERSION:
+        raise ValueError(f"checkpoint format {version}, this code reads up to {FORMAT_VERSION}")
+    header = json.loads(bytes(data[_PREFIX.size:_PREFIX.size + header_len]))
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"]))
+        arrays[name] = np.frombuffer(data, dtype, count, spec["offset"]).reshape(spec["shape"])
+    return arrays, header["meta"]
+
+def read_checkpoint(path, mmap=MMAP_DEFAULT):
+    # Returns ({name: array}, meta). Memory-mapped arrays are read-only.
+    path = resolve_checkpoint(path)
+    with open(path, "rb") as f:
+        magic, version, header_len = _PREFIX.unpack(f.read(_PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a weight checkpoint")
+        if version > FORMAT_VERSION:
+            raise ValueError(f"{path} has checkpoint format {version}, "
+                             f"this code reads up to {FORMAT_VERSION}")
+        header = json.loads(f.read(header_len))
+        if not mmap:
+            data = f.read()
+            base = f.tell() - len(data)
+
+    arrays = {}
+    if mmap:
+        buf = np.memmap(path, dtype=np.uint8, mode="r")
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"]))
+        if mmap:
+            arr = np.frombuffer(buf, dtype, count, spec["offset"])
+        else:
+            arr = np.frombuffer(data, dtype, count, spec["offset"] - base).copy()
+        arrays[name] = arr.reshape(spec["shape"])
+    return arrays, header["meta"]
@@ -4,7 +4,7 @@ Compare untrained vs trained MCTS policy on test positions.
 import numpy as np
 import chess
 from ai.mcts import MCTSGame, mcts_search
-from ai.neural_core import TinyAlphaZero
+from ai.neural_core import TinyAlphaZero, mcts_weights_path
 
 def test_position(fen, description):
     print(f"\n{'='*60}")
@@ -26,7 +26,7 @@ def test_position(fen, description):
     
     # Trained network
     trained = TinyAlphaZero(input_size=13*8*8, hidden_size=256)
-    trained.load("ai/mcts_weights.json")
+    trained.load(mcts_weights_path())
     print("\n🎓 TRAINED Network:")
     root_trained = mcts_search(game.clone(), trained, sims=50)
     if root_trained:
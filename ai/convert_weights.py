@@ -0,0 +1,36 @@
+"""
+Convert JSON TinyAlphaZero weights to the binary checkpoint format.
+
+Usage: python -m ai.convert_weights [src.json] [dst.bin] [--force]
+
+An existing dst is only overwritten with --force.
+"""
+import argparse
+import os
+import time
+from ai.neural_core import LEGACY_MCTS_WEIGHTS_PATH, MCTS_WEIGHTS_PATH, TinyAlphaZero
+
+def convert(src=LEGACY_MCTS_WEIGHTS_PATH, dst=MCTS_WEIGHTS_PATH, force=False):
+    # TinyAlphaZero.load skips a missing file, which would save random weights
+    if not os.path.exists(src):
+        raise FileNotFoundError(f"No weights to convert at {src}")
+    if os.path.exists(dst) and not force:
+        raise FileExistsError(f"{dst} already exists (use --force to overwrite it)")
+    net = TinyAlphaZero(input_size=13*8*8, hidden_size=256)
+    net.load(src)
+    net.save(dst)
+
+    start = time.perf_counter()
+    TinyAlphaZero().load(dst)
+    print(f"✅ {src} -> {dst} (loads in {(time.perf_counter() - start) * 1000:.1f} ms)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert JSON weights to a binary checkpoint")
+    parser.add_argument("src", nargs="?", default=LEGACY_MCTS_WEIGHTS_PATH)
+    parser.add_argument("dst", nargs="?", default=MCTS_WEIGHTS_PATH)
+    parser.add_argument("--force", action="store_true", help="Overwrite an existing dst")
+    args = parser.parse_args()
+    try:
+        convert(args.src, args.dst, force=args.force)
+    except (FileNotFoundError, FileExistsError) as e:
+        parser.exit(1, f"❌ {e}\n")
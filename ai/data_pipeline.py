@@ -0,0 +1,247 @@
+"""
+Streaming training data: sources -> bounded shuffle -> dense batches.
+
+DataPipeline reads samples from any mix of
+  - JSON files holding a list of sample records or triplets (parsed
+    incrementally, never loaded whole),
+  - JSONL files with one record per line,
+  - zip archives, through their .json / .jsonl members,
+  - replay shards (.bin) and replay store directories (ai.replay_store),
+and keeps them packed (ai.replay.PackedSamples) until a batch is formed.
+Records that are not training samples, such as the game results in the
+archived logs/training-data-*.zip files, are counted and skipped.
+
+With dedup=True, samples of the same position that meet in the shuffle
+buffer are merged into one weighted sample (ai.replay.dedup) before they
+are batched; stats() reports the fraction merged away.
+
+Shuffling uses a buffer of at most 2 * shuffle_buffer packed samples: once
+it is full, a random half is emitted as batches and the rest stays, so every
+sample costs O(1) however large the dataset. Source order and shard blocks
+are shuffled per epoch as well.
+
+Batches are expanded to dense float32 tensors on a background thread and
+handed over through a queue of `prefetch` batches, so JSON parsing and
+expansion overlap with the training step. Memory use is set by the shuffle
+buffer and the queue depth, not by the dataset.
+
+Usage:
+    pipeline = DataPipeline(["logs/replay", "logs/training-data-1.zip"], batch_size=256)
+    trainer.fit_stream(pipeline, epochs=2)
+"""
+import io
+import json
+import os
+import queue
+import re
+import threading
+import time
+import zipfile
+import numpy as np
+from .encoding import INPUT_SIZE
+from .replay import PackedSamples, dedup
+from .replay_store import ReplayStore, read_shard
+
+SHUFFLE_BUFFER = 65536
+PREFETCH = 4
+# Samples per block read from a source
+BLOCK_SIZE = 4096
+_CHUNK_CHARS = 1 << 20
+_SEPARATORS = re.compile(r"[\s,]*")
+
+def _iter_json_array(f):
+    # Elements of a top-level JSON array, decoded one at a time from a text
+    # stream. Elements must be objects or arrays: a number cut at the end of
+    # the buffer would decode as a different number, an object cannot.
+    decoder = json.JSONDecoder()
+    buf = f.read(_CHUNK_CHARS).lstrip()
+    if not buf.startswith("["):
+        # Not a list: one document
+        yield json.loads(buf + f.read())
+        return
+    pos = 1
+    while True:
+        pos = _SEPARATORS.match(buf, pos).end()
+        if pos == len(buf) or buf[pos] != "]":
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                more = f.read(_CHUNK_CHARS)
+                if not more:
+                    if pos == len(buf):
+                        return
+                    raise
+                buf = buf[pos:] + more
+                pos = 0
+                continue
+            yield obj
+            pos = end
+        else:
+            return
+
+def _iter_jsonl(f):
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+def is_sample(record):
+    # Packed sample records (ai.replay) and [state, policy, result] triplets
+    if isinstance(record, dict):
+        return "pieces" in record and "moves" in record
+    return (isinstance(record, list) and len(record) == 3
+            and isinstance(record[0], list) and len(record[0]) == INPUT_SIZE)
+
+class DataPipeline:
+    def __init__(self, sources, batch_size=256, shuffle_buffer=SHUFFLE_BUFFER, prefetch=PREFETCH,
+                 seed=None, block_size=BLOCK_SIZE, dedup=False):
+        if isinstance(sources, str):
+            sources = [sources]
+        self.sources = list(sources)
+        self.batch_size = batch_size
+        self.shuffle_buffer = shuffle_buffer
+        self.prefetch = prefetch
+        self.block_size = block_size
+        self.seed = seed
+        self.dedup = dedup
+        self.epoch = 0
+        self.samples = 0
+        self.skipped = 0
+        self.wait_seconds = 0.0
+        self.dedup_in = self.dedup_merged = 0
+
+    # Sources -> PackedSamples blocks
+
+    def _parse(self, f, name):
+        # A file cut short (some archived logs are) keeps its complete records
+        try:
+            yield from _iter_jsonl(f) if name.endswith(".jsonl") else _iter_json_array(f)
+        except json.JSONDecodeError as e:
+            print(f"⚠️ Skipping the rest of {name}: {e}")
+
+    def _records(self, path):
+        if path.endswith(".zip"):
+            with zipfile.ZipFile(path) as archive:
+                for name in archive.namelist():
+                    if name.endswith((".json", ".jsonl")):
+                        with archive.open(name) as member:
+                            text = io.TextIOWrapper(member, encoding="utf-8")
+                            yield from self._parse(text, f"{path}:{name}")
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                yield from self._parse(f, path)
+
+    def _record_blocks(self, path):
+        block = []
+        for record in self._records(path):
+            if not is_sample(record):
+                self.skipped += 1
+                continue
+            block.append(record)
+            if len(block) == self.block_size:
+                yield PackedSamples.from_records(block)
+                block = []
+        if block:
+            yield PackedSamples.from_records(block)
+
+    def _chunk_blocks(self, chunks, rng):
+        # Blocks of mapped shards in random order; each block is one
+        # contiguous read
+        blocks = [(chunk, start) for chunk in chunks
+                  for start in range(0, len(chunk), self.block_size)]
+        for i in rng.permutation(len(blocks)):
+            chunk, start = blocks[i]
+            yield chunk.take(np.arange(start, min(start + self.block_size, len(chunk))))
+
+    def _blocks(self, rng):
+        for i in rng.permutation(len(self.sources)):
+            path = self.sources[i]
+            if os.path.isdir(path):
+                yield from self._chunk_blocks(ReplayStore(path).chunks(), rng)
+            elif path.endswith(".bin"):
+                yield from self._chunk_blocks([read_shard(path)], rng)
+            else:
+                yield from self._record_blocks(path)
+
+    # Bounded shuffle
+
+    def _merge(self, pool, carried):
+        # carried: samples kept back from the previous flush, already counted
+        merged = PackedSamples.concatenate(pool)
+        if self.dedup:
+            before = len(merged)
+            merged = dedup(merged)
+            self.dedup_in += before - carried
+            self.dedup_merged += before - len(merged)
+        return merged
+
+    def _batches(self, rng):
+        pool, pooled, carried = [], 0, 0
+        for block in self._blocks(rng):
+            pool.append(block)
+            pooled += len(block)
+            if pooled >= 2 * self.shuffle_buffer:
+                merged = self._merge(pool, carried)
+                order = rng.permutation(len(merged))
+                # Emit whole batches from a random part; keep the rest
+                emit = (len(merged) - self.shuffle_buffer) // self.batch_size * self.batch_size
+                for start in range(0, emit, self.batch_size):
+                    yield merged.take(np.sort(order[start:start + self.batch_size]))
+                pool = [merged.take(np.sort(order[emit:]))]
+                pooled = carried = len(pool[0])
+        merged = self._merge(pool, carried)
+        order = rng.permutation(len(merged))
+        for start in range(0, len(merged), self.batch_size):
+            yield merged.take(np.sort(order[start:start + self.batch_size]))
+
+    # Background expansion
+
+    def _produce(self, rng, out, stop):
+        # Dense batches, then None at the end (or the exception raised)
+        def put(item):
+            while not stop.is_set():
+                try:
+                    out.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            for batch in self._batches(rng):
+                if not put(batch.expand()):
+                    return
+            put(None)
+        except BaseException as e:
+            put(e)
+
+    def __iter__(self):
+        """One epoch of dense (states, policies, values, weights) batches."""
+        seed = None if self.seed is None else (self.seed, self.epoch)
+        rng = np.random.default_rng(seed)
+        self.epoch += 1
+        out = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._produce, args=(rng, out, stop), daemon=True)
+        thread.start()
+        try:
+            while True:
+                start = time.perf_counter()
+                item = out.get()
+                self.wait_seconds += time.perf_counter() - start
+                if item is None:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                self.samples += len(item[0])
+                yield item
+        finally:
+            # Also runs when the consumer stops early
+            stop.set()
+            thread.join()
+
+    def stats(self):
+        stats = {"samples": self.samples, "skipped_records": self.skipped,
+                 "wait_seconds": round(self.wait_seconds, 2)}
+        if self.dedup:
+            stats["dedup_ratio"] = round(self.dedup_merged / self.dedup_in, 4) if self.dedup_in else 0.0
+        return stats
@@ -0,0 +1,155 @@
+"""
+Board -> network input encoding for TinyAlphaZero.
+
+Layout matches MCTSGame.to_tensor: 13 planes of 8x8 flattened to 832 floats,
+planes 0-5 are the side to move's P,N,B,R,Q,K, planes 6-11 the opponent's,
+plane 12 is all ones when black is to move. Square index = rank * 8 + file.
+
+Planes are built straight from python-chess piece bitmasks by unpacking the
+12 64-bit masks with np.unpackbits instead of probing all 64 squares.
+
+Moves are packed as from | to << 6 | promotion << 12 and mapped to the 4096
+policy logits (from * 64 + to) through POLICY_INDEX.
+"""
+import numpy as np
+import chess
+
+INPUT_SIZE = 13 * 64
+PIECE_PLANES = 12 * 64
+POLICY_SIZE = 64 * 64
+
+# Plane 12: all 64 inputs are set when black is to move
+TURN_FEATURES = np.arange(PIECE_PLANES, INPUT_SIZE)
+
+def encode_move(move):
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+def decode_move(code):
+    code = int(code)
+    return chess.Move(code & 63, (code >> 6) & 63, (code >> 12) or None)
+
+def move_codes(moves):
+    return np.fromiter((m.from_square | (m.to_square << 6) | ((m.promotion or 0) << 12)
+                        for m in moves), dtype=np.int32, count=len(moves))
+
+# Packed move code -> policy index. The policy head has one logit per
+# from/to pair, so every promotion piece (queen and underpromotions) of the
+# same pawn move shares a logit.
+_codes = np.arange((chess.KING + 1) << 12, dtype=np.int32)
+POLICY_INDEX = ((_codes & 63) * 64 + ((_codes >> 6) & 63)).astype(np.int32)
+del _codes
+
+def legal_priors(policy, codes):
+    """Softmax of the policy logits over the legal moves given as packed codes."""
+    return legal_softmax(policy[POLICY_INDEX[codes]], codes)
+
+def legal_softmax(logits, codes):
+    """Priors from logits already gathered per legal move (logits[i] for codes[i])."""
+    p = np.exp(logits - logits.max())
+    if (codes >> 12).any():
+        # Moves sharing a logit (promotions) split its probability mass
+        _, inverse, counts = np.unique(POLICY_INDEX[codes], return_inverse=True,
+                                       return_counts=True)
+        p /= counts[inverse]
+    return (p / p.sum()).astype(np.float32)
+
+def policy_target(codes, visits):
+    """Dense [4096] visit distribution; promotions on one square pair add up."""
+    target = np.zeros(POLICY_SIZE)
+    total = visits.sum()
+    if total > 0:
+        np.add.at(target, POLICY_INDEX[codes], visits / total)
+    return target
+
+def piece_masks(board, us=None):
+    # 12 bitboards ordered us P..K, them P..K
+    if us is None:
+        us = board.turn
+    ours = board.occupied_co[us]
+    theirs = board.occupied_co[not us]
+    bbs = (board.pawns, board.knights, board.bishops,
+           board.rooks, board.queens, board.kings)
+    return [bb & ours for bb in bbs] + [bb & theirs for bb in bbs]
+
+def _unpack(masks):
+    # uint64 masks [..., 12] -> {0,1} uint8 [..., 768], bit k of a mask at k
+    masks = np.asarray(masks, dtype="<u8")
+    return np.unpackbits(masks.view(np.uint8), axis=-1, bitorder="little")
+
+def encode_board(board, out=None):
+    """Encode one board into an [832] float32 vector (written to out if given)."""
+    if out is None:
+        out = np.empty(INPUT_SIZE, dtype=np.float32)
+    out[:PIECE_PLANES] = _unpack(piece_masks(board))
+    out[PIECE_PLANES:] = 1.0 if board.turn == chess.BLACK else 0.0
+    return out
+
+def active_features(board):
+    """Indices of the nonzero inputs of encode_board(board), ascending."""
+    idx = np.flatnonzero(_unpack(piece_masks(board)))
+    if board.turn == chess.BLACK:
+        idx = np.concatenate((idx, TURN_FEATURES))
+    return idx
+
+def encode_boards(boards, out=None):
+    """Encode many boards into a [B, 832] float32 matrix in one unpack."""
+    if out is None:
+        out = np.empty((len(boards), INPUT_SIZE), dtype=np.float32)
+    if not len(boards):
+        return out
+    masks = np.array([piece_masks(b) for b in boards], dtype="<u8")
+    out[:, :PIECE_PLANES] = _unpack(masks)
+    out[:, PIECE_PLANES:] = np.array([b.turn == chess.BLACK for b in boards],
+                                     dtype=np.float32)[:, None]
+    return out
+
+class IncrementalEncoder:
+    """
+    Keeps colour-absolute piece planes in sync with a board across push/pop.
+
+    Only the squares whose bits changed (found by XOR-ing the piece masks
+    before and after the move) are touched, so castling, en passant and
+    promotions need no special cases. Use push/pop on the encoder instead of
+    on the board directly.
+    """
+    def __init__(self, board):
+        self.board = board
+        # Planes by colour: white P..K then black P..K
+        self.planes = _unpack(piece_masks(board, chess.WHITE)).astype(np.float32)
+        self._changes = []
+
+    def _toggle(self, changed):
+        for plane, bits in changed:
+            sl = self.planes[plane * 64:(plane + 1) * 64]
+            while bits:
+                low = bits & -bits
+                sq = low.bit_length() - 1
+                sl[sq] = 1.0 - sl[sq]
+                bits ^= low
+
+    def push(self, move):
+        before = piece_masks(self.board, chess.WHITE)
+        self.board.push(move)
+        after = piece_masks(self.board, chess.WHITE)
+        changed = [(p, a ^ b) for p, (a, b) in enumerate(zip(before, after)) if a != b]
+        self._toggle(changed)
+        self._changes.append(changed)
+
+    def pop(self):
+        move = self.board.pop()
+        # XOR is its own inverse
+        self._toggle(self._changes.pop())
+        return move
+
+    def encode(self, out=None):
+        if out is None:
+            out = np.empty(INPUT_SIZE, dtype=np.float32)
+        half = PIECE_PLANES // 2
+        if self.board.turn == chess.WHITE:
+            out[:PIECE_PLANES] = self.planes
+            out[PIECE_PLANES:] = 0.0
+        else:
+            out[:half] = self.planes[half:]
+            out[half:PIECE_PLANES] = self.planes[:half]
+            out[PIECE_PLANES:] = 1.0
+        return out
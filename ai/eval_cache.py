@@ -0,0 +1,69 @@
+"""
+LRU cache of network evaluations for MCTS, keyed by position hash.
+
+An entry holds what expansion needs: the packed legal move codes, their
+masked and normalized priors, and the value for the side to move. The cache
+is bounded by an approximate memory budget and clears itself when it is used
+with a different network or after the network's weights changed (tracked via
+TinyAlphaZero.version).
+"""
+from collections import OrderedDict
+
+# Rough per-entry cost of the dict slot, tuple and array headers
+ENTRY_OVERHEAD = 250
+
+class EvalCache:
+    def __init__(self, max_mb=64):
+        self.max_bytes = int(max_mb * 2**20)
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._owner = None
+
+    def bind(self, net):
+        # Drop everything if the weights behind the cached values changed
+        owner = (id(net), getattr(net, "version", 0))
+        if owner != self._owner:
+            self.clear()
+            self._owner = owner
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, codes, priors, value):
+        if key in self.entries:
+            return
+        size = codes.nbytes + priors.nbytes + ENTRY_OVERHEAD
+        self.entries[key] = (codes, priors, value)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes and self.entries:
+            _, (old_codes, old_priors, _) = self.entries.popitem(last=False)
+            self.nbytes -= old_codes.nbytes + old_priors.nbytes + ENTRY_OVERHEAD
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "mb": round(self.nbytes / 2**20, 2),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate, 4),
+        }
@@ -0,0 +1,216 @@
+"""
+flaw_core game backend for the MCTS pipeline.
+
+FlawCoreBoard wraps the C++ flaw_core.Board behind the small part of the
+python-chess Board interface that MCTSGame, the input encoder and the
+workers use (turn, move_stack, legal_moves, push/pop, piece bitmasks, game
+over checks). Moves go in and out as chess.Move, so packed move codes,
+policy indices and replay data are identical to the python-chess backend.
+
+Move generation and make-move run in C++. Draw rules that need history
+(75-move rule, fivefold repetition) and insufficient material are tracked
+here. The C++ board has no unmake, so pop() restores a saved copy.
+
+position_key() is the C++ Zobrist key with castling and en passant mixed
+in: fast, and only used within one process (repetitions, eval cache).
+It differs from the polyglot key of the python-chess backend; replay
+samples get polyglot keys from ai.replay either way.
+
+Needs flaw_core built from core/ (core/CMakeLists.txt) at or after the
+bindings this module uses: Board.generate_move_codes, is_square_attacked,
+castling_rights and bitboards. A flaw_core.pyd built before them must be
+rebuilt.
+"""
+import os
+try:
+    os.add_dll_directory(r"C:\Users\Administrator\Downloads\winlibs-x86_64-posix-seh-gcc-15.1.0-mingw-w64msvcrt-13.0.0-r4\mingw64\bin")
+except AttributeError:
+    pass # Python < 3.8
+
+import random
+import chess
+import flaw_core as fc
+from .mcts import MCTSGame
+from .encoding import decode_move
+
+_WHITE_PROMOTIONS = {chess.KNIGHT: fc.Piece.WN, chess.BISHOP: fc.Piece.WB,
+                     chess.ROOK: fc.Piece.WR, chess.QUEEN: fc.Piece.WQ}
+_BLACK_PROMOTIONS = {chess.KNIGHT: fc.Piece.BN, chess.BISHOP: fc.Piece.BB,
+                     chess.ROOK: fc.Piece.BR, chess.QUEEN: fc.Piece.BQ}
+# Packed move code (see ai.encoding) -> chess.Move, filled on first use
+_MOVES = [None] * ((chess.KING + 1) << 12)
+
+# The C++ Zobrist key ignores castling rights and en passant; mix them in
+_rng = random.Random(20240110)
+_CASTLING_KEYS = [_rng.getrandbits(64) for _ in range(16)]
+_EP_KEYS = [_rng.getrandbits(64) for _ in range(65)]
+del _rng
+
+_DARK_SQUARES = chess.BB_DARK_SQUARES
+
+class FlawCoreBoard:
+    def __init__(self, fen=chess.STARTING_FEN):
+        self._board = fc.Board()
+        self._board.load_fen(fen)
+        fields = fen.split()
+        self.halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+        self.move_stack = []
+        self._undo = []  # (board copy, halfmove clock) per push
+        self._keys = [self.position_key()]
+
+    @property
+    def turn(self):
+        return chess.WHITE if self._board.side_to_move == fc.Color.WHITE else chess.BLACK
+
+    # Piece bitmasks in python-chess layout, used by ai.encoding
+    @property
+    def _bbs(self):
+        return self._board.bitboards
+
+    @property
+    def occupied_co(self):
+        bbs = self._bbs
+        return [bbs[7] | bbs[8] | bbs[9] | bbs[10] | bbs[11] | bbs[12],
+                bbs[1] | bbs[2] | bbs[3] | bbs[4] | bbs[5] | bbs[6]]
+
+    @property
+    def pawns(self):
+        bbs = self._bbs
+        return bbs[1] | bbs[7]
+
+    @property
+    def knights(self):
+        bbs = self._bbs
+        return bbs[2] | bbs[8]
+
+    @property
+    def bishops(self):
+        bbs = self._bbs
+        return bbs[3] | bbs[9]
+
+    @property
+    def rooks(self):
+        bbs = self._bbs
+        return bbs[4] | bbs[10]
+
+    @property
+    def queens(self):
+        bbs = self._bbs
+        return bbs[5] | bbs[11]
+
+    @property
+    def kings(self):
+        bbs = self._bbs
+        return bbs[6] | bbs[12]
+
+    # Castling rights are K=1, Q=2, k=4, q=8 in flaw_core
+    def has_kingside_castling_rights(self, color):
+        return bool(self._board.castling_rights & (1 if color == chess.WHITE else 4))
+
+    def has_queenside_castling_rights(self, color):
+        return bool(self._board.castling_rights & (2 if color == chess.WHITE else 8))
+
+    @property
+    def ep_square(self):
+        ep = self._board.en_passant
+        return ep if ep >= 0 else None
+
+    @property
+    def legal_moves(self):
+        moves = []
+        for code in self._board.generate_move_codes():
+            move = _MOVES[code]
+            if move is None:
+                move = _MOVES[code] = decode_move(code)
+            moves.append(move)
+        return moves
+
+    def _to_fc(self, move):
+        if move.promotion:
+            table = _WHITE_PROMOTIONS if self.turn == chess.WHITE else _BLACK_PROMOTIONS
+            return fc.Move(move.from_square, move.to_square, table[move.promotion])
+        return fc.Move(move.from_square, move.to_square, fc.Piece.EMPTY)
+
+    def push(self, move):
+        moving = self._board.piece_at(move.from_square)
+        capture = self._board.piece_at(move.to_square) != fc.Piece.EMPTY
+        pawn = moving in (fc.Piece.WP, fc.Piece.BP)
+
+        self._undo.append((fc.Board(self._board), self.halfmove_clock))
+        self._board.make_move(self._to_fc(move))
+        self.halfmove_clock = 0 if pawn or capture else self.halfmove_clock + 1
+        self.move_stack.append(move)
+        self._keys.append(self.position_key())
+
+    def pop(self):
+        self._board, self.halfmove_clock = self._undo.pop()
+        self._keys.pop()
+        return self.move_stack.pop()
+
+    def copy(self):
+        new = FlawCoreBoard.__new__(FlawCoreBoard)
+        new._board = fc.Board(self._board)
+        new.halfmove_clock = self.halfmove_clock
+        new.move_stack = list(self.move_stack)
+        # pop() hands saved boards back out to be mutated, so don't share them
+        new._undo = [(fc.Board(b), clock) for b, clock in self._undo]
+        new._keys = list(self._keys)
+        return new
+
+    def position_key(self):
+        b = self._board
+        return b.hash() ^ _CASTLING_KEYS[b.castling_rights] ^ _EP_KEYS[b.en_passant + 1]
+
+    def fen(self):
+        return self._board.to_fen()
+
+    def is_check(self):
+        king = self.kings & self.occupied_co[self.turn]
+        if not king:
+            return False
+        enemy = fc.Color.BLACK if self.turn == chess.WHITE else fc.Color.WHITE
+        return self._board.is_square_attacked(king.bit_length() - 1, enemy)
+
+    def is_insufficient_material(self):
+        # Simplified: bare kings, a single minor piece, or bishops only on
+        # one square colour
+        if self.pawns or self.rooks or self.queens:
+            return False
+        minors = self.knights | self.bishops
+        if chess.popcount(minors) <= 1:
+            return True
+        bishops = self.bishops
+        return not self.knights and (not bishops & _DARK_SQUARES or not bishops & ~_DARK_SQUARES)
+
+    def is_seventyfive_moves(self):
+        return self.halfmove_clock >= 150
+
+    def is_fivefold_repetition(self):
+        return self._keys.count(self._keys[-1]) >= 5
+
+    def is_checkmate(self):
+        return not self.legal_moves and self.is_check()
+
+    def is_game_over(self):
+        return (not self.legal_moves or self.is_insufficient_material()
+                or self.is_seventyfive_moves() or self.is_fivefold_repetition())
+
+    def result(self):
+        if not self.legal_moves:
+            if self.is_check():
+                return "0-1" if self.turn == chess.WHITE else "1-0"
+            return "1/2-1/2"
+        if (self.is_insufficient_material() or self.is_seventyfive_moves()
+                or self.is_fivefold_repetition()):
+            return "1/2-1/2"
+        return "*"
+
+class FlawCoreGame(MCTSGame):
+    def __init__(self, board=None, fen=chess.STARTING_FEN):
+        self.board = board if board else FlawCoreBoard(fen)
+
+    def position_key(self):
+        return self.board.position_key()
+
+    def clone(self):
+        return FlawCoreGame(self.board.copy())
@@ -0,0 +1,168 @@
+"""
+Report ingestion for the weight server: request handlers enqueue, one
+thread writes.
+
+Handlers only validate a payload and put it on a bounded in-memory queue,
+so a report costs the same however many workers there are and however much
+has been stored. A single writer thread drains the queue in batches:
+  - game results are appended to a JSONL log, one record per line,
+  - self-play samples of the whole batch (packed and validated by the
+    handler) are appended to the replay store (ai.replay_store) in one
+    block, with repeated positions merged first if dedup=True
+    (ai.replay.dedup),
+  - the attack/defense rule of the old per-request update is accumulated and
+    applied to the tuned weights file every weight_interval seconds.
+Being the only writer, the thread needs no lock around the files. When the
+queue is full, submit() returns False and the server asks the worker to
+retry later instead of growing without bound.
+
+Usage:
+    ingest = IngestQueue("logs/distributed_results.jsonl", "ai/tuned_weights.json", store)
+    ingest.start()
+    if not ingest.submit("result", {"result": 1.0}): ...
+    ingest.stop()  # drains what is queued and applies pending updates
+"""
+import json
+import os
+import queue
+import threading
+import time
+from .replay import PackedSamples, dedup
+
+MAX_QUEUE = 10000            # reports waiting to be written
+BATCH_SIZE = 512             # reports written per batch
+WEIGHT_INTERVAL = 10.0       # seconds between tuned weight updates
+# Stable linear learning rule, per reported game
+WEIGHT_STEP = 0.001
+
+class IngestQueue:
+    def __init__(self, results_path, weights_path, replay_store, max_queue=MAX_QUEUE,
+                 batch_size=BATCH_SIZE, weight_interval=WEIGHT_INTERVAL, dedup=False):
+        self.results_path = results_path
+        self.weights_path = weights_path
+        self.replay_store = replay_store
+        self.batch_size = batch_size
+        self.weight_interval = weight_interval
+        self.dedup = dedup
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        # Games won / lost since the last weight update
+        self._wins = self._losses = 0
+        self._last_update = time.monotonic()
+        self.counts = {"results": 0, "samples": 0, "stored_samples": 0, "rejected": 0,
+                       "batches": 0, "weight_updates": 0, "errors": 0}
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def submit(self, kind, payload):
+        """Queues a "result" dict or "samples" (PackedSamples); False when full."""
+        try:
+            self._queue.put_nowait((kind, payload))
+            return True
+        except queue.Full:
+            self.counts["rejected"] += 1
+            return False
+
+    def stop(self, timeout=30.0):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        return dict(self.counts, pending=self.pending(),
+                    pending_wins=self._wins, pending_losses=self._losses)
+
+    # Writer thread
+
+    def _drain(self, timeout):
+        # Up to batch_size reports; waits for the first one at most timeout
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            stopping = self._stop.is_set()
+            batch = self._drain(0 if stopping else min(self.weight_interval, 0.5))
+            if batch:
+                self._write(batch)
+            if stopping and not batch:
+                # Queue drained after stop(): final update and exit
+                self._apply_weights()
+                return
+            if time.monotonic() - self._last_update >= self.weight_interval:
+                self._apply_weights()
+
+    def _write(self, batch):
+        results = [payload for kind, payload in batch if kind == "result"]
+        self.counts["batches"] += 1
+        if results:
+            try:
+                with open(self.results_path, "a") as f:
+                    f.write("".join(json.dumps(r) + "\n" for r in results))
+            except Exception as e:
+                self.counts["errors"] += 1
+                print(f"Error logging results: {e}")
+            for r in results:
+                if r["result"] > 0.8:
+                    self._wins += 1
+                elif r["result"] < 0.2:
+                    self._losses += 1
+            self.counts["results"] += len(results)
+        parts = [payload for kind, payload in batch if kind == "samples"]
+        if parts:
+            try:
+                received = sum(len(p) for p in parts)
+                samples = PackedSamples.concatenate(parts)
+                if self.dedup:
+                    samples = dedup(samples)
+                self.replay_store.append(samples)
+                self.counts["samples"] += received
+                self.counts["stored_samples"] += len(samples)
+                merged = ""
+                if self.dedup:
+                    ratio = 1 - len(samples) / received if received else 0.0
+                    merged = f", {ratio:.1%} merged as duplicates"
+                print(f"Stored {received} training samples from {len(parts)} reports"
+                      f"{merged} ({len(self.replay_store)} stored).")
+            except Exception as e:
+                self.counts["errors"] += 1
+                print(f"Error logging MCTS data: {e}")
+
+    def _apply_weights(self):
+        self._last_update = time.monotonic()
+        if not (self._wins or self._losses) or not os.path.exists(self.weights_path):
+            return
+        try:
+            with open(self.weights_path, "r") as f:
+                weights = json.load(f)
+            weights["attack"] += WEIGHT_STEP * self._wins
+            weights["defense"] += WEIGHT_STEP * self._losses
+            # Readers (/get_weights) see the old or the new file, never half
+            tmp = f"{self.weights_path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(weights, f, indent=2)
+            os.replace(tmp, self.weights_path)
+            self._wins = self._losses = 0
+            self.counts["weight_updates"] += 1
+        except Exception as e:
+            self.counts["errors"] += 1
+            print(f"Error updating weights: {e}")
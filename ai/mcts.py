@@ -1,16 +1,185 @@
 import numpy as np
 import math
 import random
+import time
 import chess
+import chess.polyglot
 from .neural_core import TinyAlphaZero
+from .encoding import (INPUT_SIZE, encode_board, decode_move,
+                       move_codes, legal_priors, legal_softmax, policy_target,
+                       POLICY_INDEX)
+
+DEFAULT_MAX_MEMORY_MB = 512
+
+# Cached node state, so game-over checks run once per node
+NODE_UNKNOWN, NODE_ONGOING, NODE_LOST, NODE_DRAWN = 0, 1, 2, 3
+
+class MCTSTree:
+    """
+    Struct-of-arrays node pool. The children of a node occupy the contiguous
+    slot range [first_child, first_child + num_children), so a node costs a
+    few bytes per field instead of a Python object and a dict.
+    """
+    NODE_BYTES = 4 * 6 + 2 + 1
+
+    def __init__(self, capacity=4096, max_memory_mb=DEFAULT_MAX_MEMORY_MB):
+        self.max_memory_mb = max_memory_mb
+        self.max_nodes = max(1, int(max_memory_mb * 2**20) // self.NODE_BYTES)
+        self.size = 0
+        self._allocate(max(1, min(capacity, self.max_nodes)))
+        self.root = self._alloc(1)
+        self.parent[self.root] = -1
+        self.move[self.root] = 0
+        self.prior[self.root] = 0
+
+    def _allocate(self, capacity):
+        self.capacity = capacity
+        self.parent = np.empty(capacity, dtype=np.int32)
+        self.move = np.empty(capacity, dtype=np.int32)
+        self.prior = np.empty(capacity, dtype=np.float32)
+        self.visit_count = np.zeros(capacity, dtype=np.int32)
+        self.value_sum = np.zeros(capacity, dtype=np.float32)
+        self.first_child = np.zeros(capacity, dtype=np.int32)
+        self.num_children = np.zeros(capacity, dtype=np.int16)
+        self.state = np.zeros(capacity, dtype=np.int8)
+
+    def _grow(self, needed):
+        capacity = min(max(needed, self.capacity * 2), self.max_nodes)
+        old = (self.parent, self.move, self.prior, self.visit_count,
+               self.value_sum, self.first_child, self.num_children, self.state)
+        self._allocate(capacity)
+        new = (self.parent, self.move, self.prior, self.visit_count,
+               self.value_sum, self.first_child, self.num_children, self.state)
+        for src, dst in zip(old, new):
+            dst[:self.size] = src[:self.size]
+
+    def _alloc(self, count):
+        # Returns the first slot of a contiguous block, or -1 if the memory
+        # cap would be exceeded.
+        needed = self.size + count
+        if needed > self.max_nodes:
+            return -1
+        if needed > self.capacity:
+            self._grow(needed)
+        first = self.size
+        self.size = needed
+        self.visit_count[first:needed] = 0
+        self.value_sum[first:needed] = 0
+        self.num_children[first:needed] = 0
+        self.state[first:needed] = NODE_UNKNOWN
+        return first
+
+    def is_expanded(self, node):
+        return self.num_children[node] > 0
+
+    def is_full(self):
+        return self.size >= self.max_nodes
+
+    def expand(self, node, codes, priors):
+        first = self._alloc(len(codes))
+        if first < 0:
+            return False
+        last = first + len(codes)
+        self.parent[first:last] = node
+        self.move[first:last] = codes
+        self.prior[first:last] = priors
+        self.first_child[node] = first
+        self.num_children[node] = len(codes)
+        return True
+
+    def children_range(self, node):
+        first = int(self.first_child[node])
+        return first, first + int(self.num_children[node])
+
+    def select_child(self, node, c_puct, fpu_reduction=None):
+        # PUCT over the contiguous child block in one vectorized pass:
+        #   Q + c_puct * P * sqrt(N) / (1 + n)
+        # Unvisited children get Q = 0, or with fpu_reduction the parent's Q
+        # reduced by fpu_reduction * sqrt(prior mass already visited).
+        first, last = self.children_range(node)
+        visits = self.visit_count[first:last]
+        priors = self.prior[first:last]
+        visited = visits > 0
+
+        fpu = 0.0
+        if fpu_reduction is not None:
+            parent_n = self.visit_count[node]
+            # The parent stores its value from the opponent's point of view.
+            parent_q = -self.value_sum[node] / parent_n if parent_n else 0.0
+            fpu = parent_q - fpu_reduction * math.sqrt(float(priors[visited].sum()))
+
+        q = np.where(visited, self.value_sum[first:last] / np.maximum(visits, 1), fpu)
+        u = (c_puct * math.sqrt(self.visit_count[node] + 1e-8)) * priors / (1 + visits)
+        return first + int(np.argmax(q + u))
+
+    def backup(self, path, value):
+        # path runs root -> leaf; value is from the leaf side-to-move's view.
+        # Each node stores its value from the view of the player who moved
+        # into it, so the leaf gets -value and the sign flips every ply up.
+        path = np.asarray(path)
+        signs = np.where(np.arange(len(path))[::-1] % 2 == 0, -value, value)
+        self.visit_count[path] += 1
+        self.value_sum[path] += signs
+
+    def add_virtual_loss(self, path, amount):
+        # Pretend the path was visited and lost so the next descent in the
+        # same batch prefers a different leaf. The root is left alone.
+        path = np.asarray(path[1:], dtype=np.intp)
+        self.visit_count[path] += amount
+        self.value_sum[path] -= amount
+
+    def subtree(self, node):
+        # Copy the subtree under node into a fresh, compact tree rooted at it.
+        # Only expanded nodes are walked; each child block is copied as a slice.
+        new = MCTSTree(capacity=self.size, max_memory_mb=self.max_memory_mb)
+        new.prior[new.root] = self.prior[node]
+        new.visit_count[new.root] = self.visit_count[node]
+        new.value_sum[new.root] = self.value_sum[node]
+        new.state[new.root] = self.state[node]
+
+        stack = [(node, new.root)]
+        while stack:
+            old, dst = stack.pop()
+            first, last = self.children_range(old)
+            count = last - first
+            if not count:
+                continue
+            new_first = new._alloc(count)
+            new_last = new_first + count
+            new.parent[new_first:new_last] = dst
+            new.move[new_first:new_last] = self.move[first:last]
+            new.prior[new_first:new_last] = self.prior[first:last]
+            new.visit_count[new_first:new_last] = self.visit_count[first:last]
+            new.value_sum[new_first:new_last] = self.value_sum[first:last]
+            new.state[new_first:new_last] = self.state[first:last]
+            new.first_child[dst] = new_first
+            new.num_children[dst] = count
+            for i in np.flatnonzero(self.num_children[first:last]):
+                stack.append((first + int(i), new_first + int(i)))
+        return new
+
+    def node(self, index):
+        return MCTSNode(self, index)
 
 class MCTSNode:
-    def __init__(self, prior, parent=None):
-        self.parent = parent
-        self.children = {}  # move -> MCTSNode
-        self.visit_count = 0
-        self.value_sum = 0
-        self.prior = prior
+    """Read-only view of one node in an MCTSTree."""
+    __slots__ = ("tree", "index")
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    @property
+    def visit_count(self):
+        return int(self.tree.visit_count[self.index])
+
+    @property
+    def value_sum(self):
+        return float(self.tree.value_sum[self.index])
+
+    @property
+    def prior(self):
+        return float(self.tree.prior[self.index])
 
     @property
     def value(self):
@@ -18,13 +187,42 @@ class MCTSNode:
             return 0
         return self.value_sum / self.visit_count
 
-    def select(self, c_puct):
-        return max(self.children.items(),
-                   key=lambda item: item[1].get_score(c_puct))
+    @property
+    def move(self):
+        if self.tree.parent[self.index] < 0:
+            return None
+        return decode_move(self.tree.move[self.index])
+
+    @property
+    def parent(self):
+        parent = int(self.tree.parent[self.index])
+        return MCTSNode(self.tree, parent) if parent >= 0 else None
+
+    @property
+    def children(self):
+        first, last = self.tree.children_range(self.index)
+        return {decode_move(self.tree.move[i]): MCTSNode(self.tree, i)
+                for i in range(first, last)}
+
+    def policy_target(self):
+        # Visit distribution over this node's children as a [4096] target
+        return policy_target(*self.child_visits())
 
-    def get_score(self, c_puct):
-        u_score = c_puct * self.prior * math.sqrt(self.parent.visit_count + 1e-8) / (1 + self.visit_count)
-        return self.value + u_score
+    def child_visits(self):
+        # Packed move codes and visit counts of this node's children
+        first, last = self.tree.children_range(self.index)
+        return self.tree.move[first:last], self.tree.visit_count[first:last]
+
+    def promote(self):
+        # Returns this node as the root of a standalone, compacted tree so its
+        # statistics can seed the next search after its move is played.
+        if self.index == self.tree.root:
+            return self
+        return self.tree.subtree(self.index).node(0)
+
+    def select(self, c_puct, fpu_reduction=None):
+        child = self.tree.select_child(self.index, c_puct, fpu_reduction)
+        return decode_move(self.tree.move[child]), MCTSNode(self.tree, child)
 
 class MCTSGame:
     def __init__(self, board=None):
@@ -36,6 +234,9 @@ class MCTSGame:
     def make_move(self, move):
         self.board.push(move)
 
+    def unmake_move(self):
+        return self.board.pop()
+
     def is_game_over(self):
         return self.board.is_game_over()
 
@@ -45,94 +246,368 @@ class MCTSGame:
         if res == "0-1": return -1.0
         return 0.0
 
+    def terminal_value(self, legal_moves):
+        # Value for the side to move if the game is over, else None. Takes the
+        # already generated legal moves so they are not generated twice.
+        if len(legal_moves) == 0:
+            return -1.0 if self.board.is_check() else 0.0
+        board = self.board
+        if (board.is_insufficient_material() or board.is_seventyfive_moves()
+                or board.is_fivefold_repetition()):
+            return 0.0
+        return None
+
+    def position_key(self):
+        return chess.polyglot.zobrist_hash(self.board)
+
     def clone(self):
         return MCTSGame(self.board.copy())
 
-    def to_tensor(self):
-        # 13x8x8: 6 us, 6 them, 1 side
-        planes = np.zeros((13, 8, 8), dtype=np.float32)
-        us = self.board.turn
-        
-        for sq in range(64):
-            piece = self.board.piece_at(sq)
-            if piece:
-                # 0-5 for our pieces, 6-11 for theirs
-                p_type = piece.piece_type - 1
-                if piece.color == us:
-                    p_idx = p_type
-                else:
-                    p_idx = p_type + 6
-                
-                rank, file = divmod(sq, 8)
-                planes[p_idx, rank, file] = 1.0
-        
-        if us == chess.BLACK:
-            planes[12].fill(1.0)
-            
-        return planes
+    def to_tensor(self, out=None):
+        # 13x8x8: 6 us, 6 them, 1 side (out may be a reusable [832] buffer)
+        return encode_board(self.board, out).reshape(13, 8, 8)
+
+class SearchBudget:
+    """
+    Limits a search by simulations, wall-clock seconds and/or new tree nodes,
+    whichever runs out first. remaining() estimates the simulations left from
+    the rates seen so far, which is what early termination compares against.
+    """
+    def __init__(self, sims=None, time_limit=None, max_nodes=None):
+        if sims is None and time_limit is None and max_nodes is None:
+            raise ValueError("SearchBudget needs sims, time_limit or max_nodes")
+        self.sims = sims
+        self.time_limit = time_limit
+        self.max_nodes = max_nodes
+        self.done = 0
+
+    def start(self, tree):
+        self.start_time = time.perf_counter()
+        self.start_size = tree.size
+        self.done = 0
 
-def mcts_search(game, net, sims=50, c_puct=1.4):
-    root = MCTSNode(prior=0)
-    
+    def remaining(self, tree):
+        # The time and node limits only end a search once a batch has
+        # completed, so the root always has a visited child to choose from
+        left = math.inf
+        if self.sims is not None:
+            left = self.sims - self.done
+        if self.time_limit is not None and self.done:
+            elapsed = time.perf_counter() - self.start_time
+            if elapsed >= self.time_limit:
+                return 0
+            left = min(left, (self.time_limit - elapsed) * self.done / elapsed)
+        if self.max_nodes is not None:
+            grown = tree.size - self.start_size
+            if tree.is_full() or (self.done and grown >= self.max_nodes):
+                return 0
+            if self.done and grown:
+                left = min(left, (self.max_nodes - grown) * self.done / grown)
+        return left
+
+    def split(self, workers, index):
+        # This worker's share; worker 0 also takes the remainders
+        def share(total):
+            if total is None:
+                return None
+            return total // workers + (total % workers if index == 0 else 0)
+        return SearchBudget(share(self.sims), self.time_limit, share(self.max_nodes))
+
+def _root_decided(tree, left):
+    # True once the most visited root child cannot be overtaken in the
+    # remaining simulations (always true with a single legal move)
+    first, last = tree.children_range(tree.root)
+    if last - first < 2:
+        return True
+    second, best = np.partition(tree.visit_count[first:last], -2)[-2:]
+    return best - second > left
+
+GAME_BACKENDS = ("python-chess", "flaw_core")
+
+def new_game(backend="python-chess", fen=None):
+    # "flaw_core" runs move generation on the C++ board (ai.flaw_backend);
+    # move encoding and tensors are identical for both backends.
+    if backend == "flaw_core":
+        from .flaw_backend import FlawCoreGame
+        return FlawCoreGame(fen=fen or chess.STARTING_FEN)
+    if backend != "python-chess":
+        raise ValueError(f"Unknown game backend: {backend}")
+    return MCTSGame(chess.Board(fen) if fen else None)
+
+def _move_priors(legal_moves, policy):
+    # Softmax of the policy logits restricted to the legal moves
+    codes = move_codes(legal_moves)
+    return codes, legal_priors(policy, codes)
+
+def mcts_search(game, net, sims=50, c_puct=1.4, batch_size=1, virtual_loss=1,
+                max_memory_mb=DEFAULT_MAX_MEMORY_MB, fpu_reduction=None, root=None,
+                workers=1, cache=None, time_limit=None, max_nodes=None,
+                early_stop=False, sparse=False, legal_policy=True):
+    """
+    Searches game's position with net; returns the root MCTSNode, or None
+    if there is no legal move.
+
+    Budget: the search stops at sims simulations, time_limit seconds or
+    max_nodes new tree nodes, whichever comes first (sims=None uses only the
+    others). early_stop ends it once the most visited root move can no
+    longer be overtaken within what is left.
+
+    Selection: c_puct weighs priors against values, fpu_reduction sets the
+    value of unvisited children (MCTSTree.select_child).
+
+    Batching: batch_size descents per network call, spread apart by
+    virtual_loss; workers > 1 splits sims across processes sharing root
+    statistics (ai.parallel_mcts).
+
+    Evaluation: cache is an ai.eval_cache.EvalCache reused across searches.
+    sparse computes first layers incrementally along each path
+    (ai.accumulator). legal_policy computes only the legal moves' logits
+    (net.forward_legal); pass False for networks without it.
+
+    Tree: root may be a child of a previous search's root for the move since
+    played; its subtree is kept and sims are added on top. Past
+    max_memory_mb, leaves are still evaluated and backed up but no longer
+    expanded.
+    """
     # 1. Expand root
-    policy, value = net.forward(game.to_tensor().flatten())
-    policy = policy.flatten()
-    value = float(value)
     legal_moves = game.legal_moves()
-    
     if not legal_moves:
         return None
 
-    total_p = 0
-    move_probs = []
-    for m in legal_moves:
-        idx = m.from_square * 64 + m.to_square
-        p = math.exp(policy[idx])
-        move_probs.append((m, p))
-        total_p += p
-    
-    for m, p in move_probs:
-        root.children[m] = MCTSNode(prior=p/total_p, parent=root)
-
-    for _ in range(sims):
-        node = root
-        scratch_game = game.clone()
-        
-        # Selection
-        while node.children:
-            move, node = node.select(c_puct)
-            scratch_game.make_move(move)
-        
-        # Expansion and Evaluation
-        if not scratch_game.is_game_over():
-            policy, value = net.forward(scratch_game.to_tensor().flatten())
-            policy = policy.flatten()
-            value = float(value)
-            legal_moves = scratch_game.legal_moves()
-            
-            total_p = 0
-            move_probs = []
-            for m in legal_moves:
-                idx = m.from_square * 64 + m.to_square
-                p = math.exp(policy[idx])
-                move_probs.append((m, p))
-                total_p += p
-            
-            for m, p in move_probs:
-                node.children[m] = MCTSNode(prior=p/total_p, parent=node)
+    if root is not None:
+        root = root.promote()
+        tree = root.tree
+    else:
+        tree = MCTSTree(max_memory_mb=max_memory_mb)
+
+    if cache is not None:
+        cache.bind(net)
+
+    if not tree.is_expanded(tree.root):
+        entry = cache.get(game.position_key()) if cache is not None else None
+        if entry is None:
+            if legal_policy:
+                codes = move_codes(legal_moves)
+                logits, value = net.forward_legal(game.to_tensor().reshape(1, -1),
+                                                  [POLICY_INDEX[codes]])
+                entry = (codes, legal_softmax(logits[0], codes), float(value[0, 0]))
+            else:
+                policy, value = net.forward(game.to_tensor().flatten())
+                entry = _move_priors(legal_moves, policy.flatten()) + (float(value[0, 0]),)
+            if cache is not None:
+                cache.put(game.position_key(), *entry)
+        tree.expand(tree.root, entry[0], entry[1])
+
+    tree.state[tree.root] = NODE_ONGOING
+    budget = SearchBudget(sims, time_limit, max_nodes)
+    options = dict(c_puct=c_puct, batch_size=batch_size, virtual_loss=virtual_loss,
+                   fpu_reduction=fpu_reduction, cache=cache, early_stop=early_stop,
+                   sparse=sparse, legal_policy=legal_policy)
+    if workers > 1:
+        from .parallel_mcts import parallel_simulate
+        parallel_simulate(tree, game, net, budget, workers, **options)
+    else:
+        run_simulations(tree, game, net, budget, **options)
+    return tree.node(tree.root)
+
+class MCTSSearch:
+    """
+    The simulation loop of one search, split into two steps so that a driver
+    can put the leaves of many searches into a single network batch:
+    collect_leaves() descends and writes leaf encodings into rows of an input
+    buffer, apply_evaluations() expands and backs up with the network output
+    for those rows. run_simulations() is the single-search driver,
+    ai.multiplex_selfplay the many-games one.
+
+    If tree.root is not expanded yet, the first collected leaf is the root.
+
+    With sparse_net given, leaves are written as that network's first-layer
+    pre-activations from an incrementally updated ai.accumulator.Accumulator
+    (row width net.hidden_size) and must be evaluated with
+    net.forward_hidden instead of net.forward.
+
+    With legal_policy (the default, as in mcts_search), apply_evaluations
+    expects per-leaf logits for just the legal moves (net.forward_legal with
+    legal_indices()) instead of full 4096-wide policy rows; evaluate_leaves()
+    picks the right call.
+    """
+    def __init__(self, tree, game, budget, c_puct=1.4, batch_size=1, virtual_loss=1,
+                 fpu_reduction=None, cache=None, early_stop=False, sparse_net=None,
+                 legal_policy=True):
+        if not isinstance(budget, SearchBudget):
+            budget = SearchBudget(sims=budget)
+        budget.start(tree)
+        self.tree = tree
+        self.budget = budget
+        self.c_puct = c_puct
+        self.batch_size = batch_size
+        self.virtual_loss = virtual_loss
+        self.fpu_reduction = fpu_reduction
+        self.cache = cache
+        self.early_stop = early_stop
+        self.legal_policy = legal_policy
+        # Simulations replay the selected path on this one board and unwind
+        # it again with unmake_move, instead of cloning the game per playout.
+        self.sim = game.clone()
+        self.accumulator = None
+        if sparse_net is not None:
+            from .accumulator import Accumulator
+            self.accumulator = Accumulator(sparse_net, self.sim.board)
+        self.pending = []  # [leaf, paths, legal move codes, position key]
+        self._vl = 0
+        self._left = 0
+
+    def finished(self):
+        tree = self.tree
+        left = self.budget.remaining(tree)
+        done = left < 1 or (self.early_stop and self.budget.done and _root_decided(tree, left))
+        if done and not tree.is_full():
+            # Not before a root child has a visit to pick a move from: a
+            # shared or short time budget may have gone into the root alone
+            first, last = tree.children_range(tree.root)
+            if last == first or not tree.visit_count[first:last].any():
+                left, done = max(left, 1), False
+        self._left = left
+        return done
+
+    def collect_leaves(self, inputs):
+        # Runs up to batch_size descents (call finished() first). Leaves that
+        # need the network are encoded into inputs[0], inputs[1], ...; returns
+        # how many rows were written.
+        tree, sim, cache = self.tree, self.sim, self.cache
+        c_puct, fpu_reduction = self.c_puct, self.fpu_reduction
+        acc = self.accumulator
+        if acc is not None:
+            acc.sync()
+            push, pop = acc.push, acc.pop
         else:
-            value = scratch_game.result()
-            # If it's black's turn, the result is from white's perspective,
-            # but MCTS usually wants perspective of the side-to-move.
-            # However, AZ convention is the value is relative to the current player.
-            if scratch_game.board.turn == chess.BLACK:
-                value = -value
-
-        # Backup
-        while node:
-            node.visit_count += 1
-            node.value_sum += value
-            value = -value
-            node = node.parent
+            push, pop = sim.make_move, sim.unmake_move
+        n = int(min(self.batch_size, self._left, len(inputs)))
+        self.budget.done += n
+        vl = self._vl = self.virtual_loss if n > 1 else 0
+        pending = self.pending = []
+        pending_at = {}
+
+        for _ in range(n):
+            node = tree.root
+            path = [node]
             
-    return root
+            # Selection
+            while tree.is_expanded(node):
+                node = tree.select_child(node, c_puct, fpu_reduction)
+                path.append(node)
+
+            state = tree.state[node]
+            if state == NODE_LOST or state == NODE_DRAWN:
+                tree.backup(path, -1.0 if state == NODE_LOST else 0.0)
+                continue
+
+            # The same leaf can be reached twice in one batch; evaluate it once.
+            if node in pending_at:
+                if vl:
+                    tree.add_virtual_loss(path, vl)
+                pending[pending_at[node]][1].append(path)
+                continue
+
+            for child in path[1:]:
+                push(decode_move(tree.move[child]))
+
+            key = sim.position_key() if cache is not None else None
+            entry = cache.get(key) if key is not None else None
+
+            legal_moves = None
+            if entry is not None:
+                legal_moves = entry[0]
+            elif state == NODE_UNKNOWN or not tree.is_full():
+                legal_moves = sim.legal_moves()
+            if state == NODE_UNKNOWN:
+                value = sim.terminal_value(legal_moves)
+                if value is not None:
+                    tree.state[node] = NODE_LOST if value < 0 else NODE_DRAWN
+                else:
+                    tree.state[node] = NODE_ONGOING
+
+            if tree.state[node] == NODE_ONGOING and entry is None:
+                if acc is not None:
+                    acc.hidden(out=inputs[len(pending)])
+                else:
+                    sim.to_tensor(out=inputs[len(pending)])
+
+            for _ in range(len(path) - 1):
+                pop()
+
+            if tree.state[node] != NODE_ONGOING:
+                tree.backup(path, value)
+                continue
+
+            if entry is not None:
+                # Cached evaluation: expand and back up without the network
+                tree.expand(node, entry[0], entry[1])
+                tree.backup(path, entry[2])
+                continue
+
+            if vl:
+                tree.add_virtual_loss(path, vl)
+            pending_at[node] = len(pending)
+            codes = move_codes(legal_moves) if legal_moves else None
+            pending.append((node, [path], codes, key))
+
+        return len(pending)
+
+    def apply_evaluations(self, policies, values):
+        # Expansion and backup for the rows written by the last collect_leaves
+        tree, cache, vl = self.tree, self.cache, self._vl
+        softmax = legal_softmax if self.legal_policy else legal_priors
+        for i, (node, paths, codes, key) in enumerate(self.pending):
+            value = float(values[i, 0])
+            if codes is not None:
+                priors = softmax(policies[i], codes)
+                tree.expand(node, codes, priors)
+                if key is not None:
+                    cache.put(key, codes, priors, value)
+            for path in paths:
+                if vl:
+                    tree.add_virtual_loss(path, -vl)
+                tree.backup(path, value)
+        self.pending = []
+
+    def legal_indices(self):
+        # Policy indices of the legal moves of each pending leaf, for
+        # net.forward_legal (empty when the leaf will not be expanded)
+        return [POLICY_INDEX[codes] if codes is not None else _NO_MOVES
+                for _, _, codes, _ in self.pending]
+
+_NO_MOVES = np.zeros(0, dtype=np.int32)
+
+def evaluate_leaves(net, inputs, legal=None, sparse=False):
+    # One network call for a batch of collected leaves: dense input rows, or
+    # first-layer pre-activations with sparse; with legal (see
+    # MCTSSearch.legal_indices) only the legal moves' logits are computed.
+    if legal is not None:
+        return net.forward_legal(inputs, legal, pre_activations=sparse)
+    if sparse:
+        return net.forward_hidden(inputs)
+    return net.forward(inputs)
+
+def run_simulations(tree, game, net, budget, c_puct=1.4, batch_size=1, virtual_loss=1,
+                    fpu_reduction=None, cache=None, early_stop=False, sync=None,
+                    sparse=False, legal_policy=True):
+    # Runs playouts from tree.root, which must already be expanded for game's
+    # position, until budget (a SearchBudget or a number of sims) runs out.
+    # sync, if given, is called once per batch after the descents (virtual
+    # loss applied) and before the network call.
+    search = MCTSSearch(tree, game, budget, c_puct, batch_size, virtual_loss,
+                        fpu_reduction, cache, early_stop, net if sparse else None,
+                        legal_policy)
+
+    # Leaf encodings are written straight into this reusable batch buffer
+    width = net.hidden_size if sparse else INPUT_SIZE
+    inputs = np.empty((batch_size, width), dtype=np.float32)
+    while not search.finished():
+        count = search.collect_leaves(inputs)
+        if sync:
+            sync()
+        if count:
+            # Expansion and Evaluation (one forward pass for the whole batch)
+            legal = search.legal_indices() if legal_policy else None
+            search.apply_evaluations(*evaluate_leaves(net, inputs[:count], legal, sparse))
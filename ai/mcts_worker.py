@@ -5,32 +5,90 @@ import os
 import time
 import random
 import argparse
-import numpy as np
 import chess
-from ai.mcts import MCTSGame, mcts_search
+from ai.checkpoint import decode_checkpoint
+from ai.mcts import GAME_BACKENDS, new_game, mcts_search
+from ai.eval_cache import EvalCache
+from ai.multiplex_selfplay import MultiplexedSelfPlay
 from ai.neural_core import TinyAlphaZero
+from ai.quantize import INT8_KERNELS, QuantizedAlphaZero, compare, random_positions
+from ai.replay import GameRecord, PackedSamples
+
+# Attempts per report when the server is busy (503), and samples kept for
+# the next report after that, oldest games dropped first
+REPORT_RETRIES = 3
+MAX_UNREPORTED = 50000
+
+def retry_after(res, default=5.0):
+    # Seconds the server asked us to wait (Retry-After), or default
+    try:
+        return max(0.0, float(res.headers.get("Retry-After", default)))
+    except ValueError:
+        return default
 
 class MCTSWorker:
-    def __init__(self, master_url, sims=25):
+    def __init__(self, master_url, sims=25, batch_size=8, backend="python-chess",
+                 movetime=None, games=1, int8=False):
         self.master_url = master_url.rstrip('/') if master_url else None
         self.sims = sims
+        # Optional per-move time cap in seconds, on top of the sims budget
+        self.movetime = movetime
+        self.batch_size = batch_size
+        self.backend = backend
+        # Concurrent games sharing each network call (see run_multiplexed)
+        self.games = games
         self.net = TinyAlphaZero(input_size=13*8*8, hidden_size=256)
+        self.net.enable_inference()
+        # With int8, searches run on a quantized copy (ai.quantize) that is
+        # rebuilt from every fetched float checkpoint, calibrated on random
+        # positions since a worker holds no replay data
+        self.int8 = int8
+        self.search_net = self.net
+        if int8:
+            self.calibration = random_positions(512)
+            self.search_net = QuantizedAlphaZero().quantize_from(self.net, self.calibration)
+        # Shared across games; cleared automatically when new weights load
+        self.cache = EvalCache()
+        # Version of the loaded weights, sent back to the server so that
+        # unchanged weights are not downloaded again
+        self.weights_version = None
+        # Games the server could not take yet, sent with the next report
+        self.unreported = []
         self.worker_id = f"mcts_worker_{random.randint(1000, 9999)}"
 
     def fetch_weights(self):
+        # True when new weights were loaded; unchanged weights cost one
+        # round trip (304) and keep the loaded net and its eval cache
         if not self.master_url:
             return False
         try:
             print(f"DEBUG: Connecting to {self.master_url}/get_mcts_weights", flush=True)
             # Add header to bypass ngrok browser warning page
             headers = {"ngrok-skip-browser-warning": "true"}
-            res = requests.get(f"{self.master_url}/get_mcts_weights", headers=headers, timeout=15)
+            if self.weights_version:
+                headers["If-None-Match"] = f'"{self.weights_version}"'
+            # requests asks for gzip and decompresses it transparently
+            res = requests.get(f"{self.master_url}/get_mcts_weights", params={"delta": 1},
+                               headers=headers, timeout=15)
             
             print(f"DEBUG: Response status {res.status_code}", flush=True)
+            if res.status_code == 304:
+                print("Weights unchanged.", flush=True)
+                return False
             if res.status_code == 200:
-                with open("temp_weights.json", "w") as f:
-                    f.write(res.text)
-                self.net.load("temp_weights.json")
+                # Loaded straight from the response, without a disk copy.
+                # A delta holds only the arrays changed since our version.
+                delta_from = res.headers.get("X-Delta-From")
+                if delta_from and delta_from == self.weights_version:
+                    arrays, _ = decode_checkpoint(res.content)
+                    self.net.load_arrays(arrays)
+                    print(f"Applied weight delta ({len(res.content)} bytes, {len(arrays)} arrays).", flush=True)
+                else:
+                    self.net.load_bytes(res.content)
+                self.weights_version = res.headers.get("X-Weights-Version")
+                if self.int8:
+                    self.search_net.quantize_from(self.net, self.calibration)
+                    print(f"Quantized weights: {compare(self.net, self.search_net, self.calibration)}", flush=True)
                 return True
             else:
                 print(f"Server returned status {res.status_code}: {res.text[:100]}", flush=True)
@@ -41,48 +99,67 @@ class MCTSWorker:
         return False
 
     def run_game(self):
-        game = MCTSGame()
-        history = []
+        game = new_game(self.backend)
+        record = GameRecord()
+        root = None
         
         while not game.is_game_over() and len(game.board.move_stack) < 200:
-            root = mcts_search(game, self.net, sims=self.sims)
+            root = mcts_search(game, self.search_net, sims=self.sims, batch_size=self.batch_size,
+                               root=root, cache=self.cache, time_limit=self.movetime,
+                               early_stop=True)
             if not root: break
             
-            # Policy target
-            policy_target = np.zeros(4096)
+            # Position and visit counts, packed (ai.replay)
+            record.add(game, root)
             total_visits = sum(child.visit_count for child in root.children.values())
-            if total_visits > 0:
-                for move, child in root.children.items():
-                    idx = move.from_square * 64 + move.to_square
-                    policy_target[idx] = child.visit_count / total_visits
-            
-            history.append((game.to_tensor().flatten().tolist(), policy_target.tolist()))
             
             # Proportional move selection for exploration
             moves = list(root.children.keys())
             probs = [child.visit_count / total_visits for child in root.children.values()]
             move = random.choices(moves, weights=probs)[0]
             game.make_move(move)
+            # Keep the played move's subtree for the next search
+            root = root.children[move]
 
-        result = game.result()
-        # Prepare triplets
-        triplets = []
-        for i, (state, pi) in enumerate(history):
-            turn_result = result if i % 2 == 0 else -result
-            triplets.append((state, pi, turn_result))
-        
-        return triplets
+        return record.finish(game.result())
 
-    def report_data(self, triplets):
+    def report_data(self, samples):
+        # Packed records; the server also still accepts dense triplets.
+        # A busy server (503) is retried after Retry-After; samples it still
+        # refuses, or that fail to send, go out with the next report.
         if not self.master_url:
             return
-        try:
-            requests.post(f"{self.master_url}/report_mcts_data", json=triplets, timeout=30)
-            print(f"Reported {len(triplets)} triplets.")
-        except Exception as e:
-            print(f"Failed to report data: {e}")
+        self.unreported.append(samples)
+        batch = PackedSamples.concatenate(self.unreported)
+        for attempt in range(REPORT_RETRIES):
+            try:
+                res = requests.post(f"{self.master_url}/report_mcts_data",
+                                    json=batch.to_records(), timeout=30)
+            except Exception as e:
+                print(f"Failed to report data: {e}")
+                break
+            if res.status_code in (200, 202):
+                self.unreported = []
+                print(f"Reported {len(batch)} samples.")
+                return
+            if 400 <= res.status_code < 500:
+                # Sending the same samples again cannot succeed
+                self.unreported = []
+                print(f"Server rejected {len(batch)} samples ({res.status_code}): {res.text[:100]}")
+                return
+            print(f"Server returned status {res.status_code}: {res.text[:100]}")
+            if res.status_code != 503 or attempt == REPORT_RETRIES - 1:
+                break
+            delay = retry_after(res)
+            print(f"Server busy, retrying in {delay:g}s...", flush=True)
+            time.sleep(delay)
+        while len(self.unreported) > 1 and sum(len(s) for s in self.unreported) > MAX_UNREPORTED:
+            self.unreported.pop(0)
+        print(f"Keeping {sum(len(s) for s in self.unreported)} samples for the next report.")
 
     def run(self, duration_mins=10):
+        if self.games > 1:
+            return self.run_multiplexed(duration_mins)
         start_time = time.time()
         print(f"Worker {self.worker_id} starting for {duration_mins} minutes...", flush=True)
         
@@ -90,17 +167,43 @@ class MCTSWorker:
             print("Fetching weights...", flush=True)
             self.fetch_weights()
             print("Weights fetched (or skipped). Starting game...", flush=True)
-            triplets = self.run_game()
-            print(f"Game finished with {len(triplets)} positions. Reporting...", flush=True)
-            self.report_data(triplets)
+            samples = self.run_game()
+            print(f"Game finished with {len(samples)} positions. Reporting...", flush=True)
+            print(f"Eval cache: {self.cache.stats()}", flush=True)
+            self.report_data(samples)
             print(f"Time left: {int((duration_mins * 60 - (time.time() - start_time)) / 60)} mins", flush=True)
 
+    def run_multiplexed(self, duration_mins=10):
+        # Plays self.games games at once; each finished game is reported and
+        # followed by a weight refresh while the others keep going.
+        start_time = time.time()
+        print(f"Worker {self.worker_id} starting {self.games} concurrent games for {duration_mins} minutes...", flush=True)
+        self.fetch_weights()
+        selfplay = MultiplexedSelfPlay(self.search_net, num_games=self.games, sims=self.sims,
+                                       batch_size=self.batch_size, backend=self.backend,
+                                       movetime=self.movetime, cache=self.cache)
+        
+        while (time.time() - start_time) < (duration_mins * 60):
+            for samples in selfplay.step():
+                print(f"Game finished with {len(samples)} positions. Reporting...", flush=True)
+                print(f"Eval cache: {self.cache.stats()}, batching: {selfplay.stats()}", flush=True)
+                self.report_data(samples)
+                self.fetch_weights()
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--master", type=str, required=True)
     parser.add_argument("--sims", type=int, default=25)
     parser.add_argument("--duration", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=8, help="Leaves evaluated per network call")
+    parser.add_argument("--backend", choices=GAME_BACKENDS, default="python-chess")
+    parser.add_argument("--movetime", type=float, default=None, help="Max seconds per move")
+    parser.add_argument("--games", type=int, default=1, help="Concurrent games sharing one network batch")
+    parser.add_argument("--int8", action="store_true", help="Search with the int8 quantized network (needs flaw_core)")
     args = parser.parse_args()
+    if args.int8 and not INT8_KERNELS:
+        parser.error("--int8 needs flaw_core built with the int8 kernels (core/int8.cpp)")
 
-    worker = MCTSWorker(args.master, sims=args.sims)
+    worker = MCTSWorker(args.master, sims=args.sims, batch_size=args.batch, backend=args.backend,
+                        movetime=args.movetime, games=args.games, int8=args.int8)
     worker.run(duration_mins=args.duration)
@@ -0,0 +1,134 @@
+"""
+Self-play of many concurrent games in one process.
+
+Every game slot owns an MCTSSearch. One step() asks each active search for
+its next batch of leaves, stacks all of them into one input matrix, runs a
+single net.forward over it and hands every search its slice of the output.
+With dozens of games in flight the network sees batches of hundreds of
+positions instead of a handful, so the time goes into the matrix products
+rather than into per-call Python overhead.
+
+Games that finish are returned from step() as the same packed samples
+(ai.replay.PackedSamples) MCTSWorker.run_game produces.
+"""
+import random
+import numpy as np
+from .mcts import (DEFAULT_MAX_MEMORY_MB, MCTSTree, MCTSSearch, SearchBudget, evaluate_leaves,
+                   new_game)
+from .encoding import INPUT_SIZE
+from .replay import GameRecord
+
+MAX_PLIES = 200
+
+class _GameSlot:
+    def __init__(self, backend):
+        self.game = new_game(backend)
+        self.record = GameRecord()  # searched positions of the moves played
+        self.root = None   # root MCTSNode of the current or previous search
+        self.search = None
+
+    def samples(self):
+        return self.record.finish(self.game.result())
+
+class MultiplexedSelfPlay:
+    def __init__(self, net, num_games=32, sims=25, batch_size=8, backend="python-chess",
+                 movetime=None, cache=None, max_plies=MAX_PLIES,
+                 max_memory_mb=DEFAULT_MAX_MEMORY_MB, sparse=False, legal_policy=True):
+        # batch_size is per game, so one network call sees up to
+        # num_games * batch_size positions. movetime is wall-clock time per
+        # move, which here is shared with all the other games.
+        self.net = net
+        self.sims = sims
+        self.batch_size = batch_size
+        self.backend = backend
+        self.movetime = movetime
+        self.cache = cache
+        self.max_plies = max_plies
+        # Memory cap per game tree
+        self.max_memory_mb = max_memory_mb
+        # sparse: leaves arrive as first-layer pre-activations (ai.accumulator)
+        self.sparse = sparse
+        # legal_policy: only the legal moves' policy logits are computed
+        self.legal_policy = legal_policy
+        width = net.hidden_size if sparse else INPUT_SIZE
+        self.inputs = np.empty((num_games * batch_size, width), dtype=np.float32)
+        self.slots = [_GameSlot(backend) for _ in range(num_games)]
+        self.forward_calls = 0
+        self.positions = 0
+
+    def _start_search(self, slot):
+        if slot.root is not None:
+            tree = slot.root.promote().tree
+        else:
+            tree = MCTSTree(max_memory_mb=self.max_memory_mb)
+        # mcts_search expands the root outside of the sims budget; here the
+        # root is just the first leaf, so give it one extra simulation
+        sims = self.sims
+        if sims is not None and not tree.is_expanded(tree.root):
+            sims += 1
+        budget = SearchBudget(sims, self.movetime)
+        slot.search = MCTSSearch(tree, slot.game, budget, batch_size=self.batch_size,
+                                 cache=self.cache, early_stop=True,
+                                 sparse_net=self.net if self.sparse else None,
+                                 legal_policy=self.legal_policy)
+
+    def _play_move(self, slot):
+        tree = slot.search.tree
+        root = tree.node(tree.root)
+        slot.search = None
+        slot.record.add(slot.game, root)
+
+        # Proportional move selection for exploration
+        children = root.children
+        moves = list(children.keys())
+        weights = [child.visit_count for child in children.values()]
+        move = random.choices(moves, weights=weights)[0]
+        slot.game.make_move(move)
+        # Keep the played move's subtree for the next search
+        slot.root = children[move]
+
+    def _game_over(self, slot):
+        return (slot.game.is_game_over()
+                or len(slot.game.board.move_stack) >= self.max_plies)
+
+    def step(self):
+        # Advances every game by one batch of simulations; returns the
+        # samples of each game that finished during this step.
+        if self.cache is not None:
+            self.cache.bind(self.net)
+        finished = []
+        active = []  # (slot, first input row, row count)
+        rows = 0
+        for i, slot in enumerate(self.slots):
+            if slot.search is not None and slot.search.finished():
+                self._play_move(slot)
+            if slot.search is None:
+                if self._game_over(slot):
+                    finished.append(slot.samples())
+                    slot = self.slots[i] = _GameSlot(self.backend)
+                self._start_search(slot)
+                if slot.search.finished():
+                    continue
+            count = slot.search.collect_leaves(self.inputs[rows:rows + self.batch_size])
+            if count:
+                active.append((slot, rows, count))
+                rows += count
+
+        if rows:
+            legal = None
+            if self.legal_policy:
+                legal = [idx for slot, _, _ in active for idx in slot.search.legal_indices()]
+            policies, values = evaluate_leaves(self.net, self.inputs[:rows], legal, self.sparse)
+            self.forward_calls += 1
+            self.positions += rows
+            for slot, start, count in active:
+                slot.search.apply_evaluations(policies[start:start + count],
+                                              values[start:start + count])
+        return finished
+
+    def stats(self):
+        return {
+            "games": len(self.slots),
+            "forward_calls": self.forward_calls,
+            "avg_batch": round(self.positions / self.forward_calls, 1) if self.forward_calls else 0.0,
+        }
@@ -1,6 +1,20 @@
 import numpy as np
 import os
 import json
+from .checkpoint import MAGIC, MMAP_DEFAULT, decode_checkpoint, is_checkpoint, publish_checkpoint, read_checkpoint
+
+# Default checkpoint locations; the JSON file is the pre-binary format
+MCTS_WEIGHTS_PATH = "ai/mcts_weights.bin"
+LEGACY_MCTS_WEIGHTS_PATH = "ai/mcts_weights.json"
+
+def mcts_weights_path():
+    # The binary checkpoint if there is one, else the legacy JSON file
+    if os.path.exists(MCTS_WEIGHTS_PATH) or not os.path.exists(LEGACY_MCTS_WEIGHTS_PATH):
+        return MCTS_WEIGHTS_PATH
+    return LEGACY_MCTS_WEIGHTS_PATH
+
+# Rows preallocated for the float32 inference buffers (grown on demand)
+DEFAULT_MAX_BATCH = 256
 
 class TinyAlphaZero:
     """
@@ -25,9 +39,65 @@ class TinyAlphaZero:
         
         self.Wv = np.random.randn(hidden_size, 1) * np.sqrt(2/hidden_size)
         self.bv = np.zeros(1)
+
+        # Bumped whenever the weights change, so caches of outputs can expire
+        self.version = 0
+        self._fast = None
+        self._WpT = None
         
+    def enable_inference(self, max_batch=DEFAULT_MAX_BATCH):
+        # float32 inference: forward() runs on contiguous float32 copies of the
+        # weights (refreshed whenever version changes) and writes into reused
+        # output buffers, so the returned arrays are only valid until the
+        # next forward() call. The float64 weights stay the ones that train.
+        self._fast = {"version": None, "rows": 0, "max_batch": max_batch}
+
+    def disable_inference(self):
+        self._fast = None
+
+    def _refresh_fast(self):
+        fast = self._fast
+        for name in self.WEIGHT_NAMES:
+            fast[name] = np.ascontiguousarray(getattr(self, name), dtype=np.float32)
+        fast["WpT"] = None
+        fast["version"] = self.version
+
+    def _fast_buffers(self, n):
+        fast = self._fast
+        if n > fast["rows"]:
+            rows = max(n, fast["max_batch"])
+            fast["h1"] = np.empty((rows, fast["W1"].shape[1]), dtype=np.float32)
+            fast["policy"] = np.empty((rows, fast["Wp"].shape[1]), dtype=np.float32)
+            fast["value"] = np.empty((rows, 1), dtype=np.float32)
+            fast["rows"] = rows
+        return fast["h1"][:n], fast["policy"][:n], fast["value"][:n]
+
+    def _forward_fast(self, x, pre_activations=False):
+        fast = self._fast
+        if fast["version"] != self.version:
+            self._refresh_fast()
+        h1, policy, val = self._fast_buffers(x.shape[0])
+
+        # Layer 1, bias and ReLU applied in place
+        if pre_activations:
+            np.maximum(x, 0, out=h1)
+        else:
+            np.dot(np.asarray(x, dtype=np.float32), fast["W1"], out=h1)
+            h1 += fast["b1"]
+            np.maximum(h1, 0, out=h1)
+
+        np.dot(h1, fast["Wp"], out=policy)
+        policy += fast["bp"]
+
+        np.dot(h1, fast["Wv"], out=val)
+        val += fast["bv"]
+        np.tanh(val, out=val)
+        return policy, val
+
     def forward(self, x):
         # x can be [InputSize] or [Batch, InputSize]
+        if self._fast is not None:
+            return self._forward_fast(x.reshape(1 if x.ndim == 1 else x.shape[0], -1))
         if x.ndim == 1:
             x_flat = x.reshape(1, -1)
         else:
@@ -44,30 +114,126 @@ class TinyAlphaZero:
         
         return policy, val
 
-    def save(self, path):
-         # simple dict save
-         data = {
-             "W1": self.W1.tolist(), "b1": self.b1.tolist(),
-             "Wp": self.Wp.tolist(), "bp": self.bp.tolist(),
-             "Wv": self.Wv.tolist(), "bv": self.bv.tolist()
-         }
-         with open(path, "w") as f:
-             json.dump(data, f)
+    def layer1_weights(self):
+        # (W1, b1) as forward() uses them: the float32 copies in inference mode
+        if self._fast is not None:
+            if self._fast["version"] != self.version:
+                self._refresh_fast()
+            return self._fast["W1"], self._fast["b1"]
+        return self.W1, self.b1
+
+    def forward_sparse(self, features):
+        # features holds one array of active input indices per position (see
+        # ai.encoding.active_features). The first layer is the sum of the W1
+        # rows of those inputs instead of a dense [Batch, 832] matmul.
+        W1, b1 = self.layer1_weights()
+        lengths = np.array([len(f) for f in features])
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        z1 = np.add.reduceat(W1[np.concatenate(features)], starts, axis=0)
+        z1 += b1
+        return self.forward_hidden(z1)
+
+    def _policy_rows(self):
+        # Wp transposed to [4096, Hidden] so one legal move's weights are a
+        # contiguous row; built once per weight version
+        if self._fast is not None:
+            fast = self._fast
+            if fast["version"] != self.version:
+                self._refresh_fast()
+            if fast["WpT"] is None:
+                fast["WpT"] = np.ascontiguousarray(fast["Wp"].T)
+            return fast["WpT"], fast["bp"], fast["Wv"], fast["bv"]
+        if self._WpT is None or self._WpT[0] != self.version:
+            self._WpT = (self.version, np.ascontiguousarray(self.Wp.T))
+        return self._WpT[1], self.bp, self.Wv, self.bv
+
+    def forward_legal(self, x, legal, pre_activations=False):
+        # Policy logits only at the given policy indices: legal holds one index
+        # array per row of x (any lengths). Only those Wp columns are
+        # gathered, instead of computing all 4096 logits. Returns
+        # ([logits per row], values [Batch, 1]). With pre_activations, x is
+        # z1 as for forward_hidden.
+        if pre_activations:
+            h1 = np.maximum(0, x)
+        else:
+            W1, b1 = self.layer1_weights()
+            h1 = np.dot(np.asarray(x, dtype=W1.dtype), W1)
+            h1 += b1
+            np.maximum(h1, 0, out=h1)
+        WpT, bp, Wv, bv = self._policy_rows()
+        h1 = h1.astype(WpT.dtype, copy=False)
+
+        lengths = np.fromiter((len(i) for i in legal), dtype=np.intp, count=len(legal))
+        idx = np.concatenate(legal) if len(legal) else np.zeros(0, dtype=np.intp)
+        rows = np.repeat(np.arange(len(legal)), lengths)
+        logits = np.einsum("ij,ij->i", h1[rows], WpT[idx])
+        logits += bp[idx]
+        val = np.tanh(np.dot(h1, Wv) + bv)
+        return np.split(logits, np.cumsum(lengths)[:-1]), val
+
+    def forward_hidden(self, z1):
+        # Heads on first-layer pre-activations z1 = x @ W1 + b1, [Batch, Hidden]
+        # (from forward_sparse or an ai.accumulator.Accumulator)
+        if self._fast is not None:
+            return self._forward_fast(z1, pre_activations=True)
+        h1 = np.maximum(0, z1)
+        policy = np.dot(h1, self.Wp) + self.bp
+        val = np.tanh(np.dot(h1, self.Wv) + self.bv)
+        return policy, val
+
+    WEIGHT_NAMES = ("W1", "b1", "Wp", "bp", "Wv", "bv")
+
+    def save(self, path, dtype=np.float32):
+        # Binary checkpoint (ai.checkpoint) unless path ends in .json, published
+        # as a new version so that processes mapping the old one are unaffected
+        if path.endswith(".json"):
+            data = {name: getattr(self, name).tolist() for name in self.WEIGHT_NAMES}
+            with open(path, "w") as f:
+                json.dump(data, f)
+            return
+        publish_checkpoint(path, {name: getattr(self, name).astype(dtype, copy=False)
+                                  for name in self.WEIGHT_NAMES},
+                           {"input_size": self.input_size, "hidden_size": self.hidden_size})
              
-    def load(self, path):
+    def load(self, path, mmap=MMAP_DEFAULT):
+        # Reads either format. Binary weights are memory-mapped read-only by
+        # default; train_step copies them before the first update.
         if not os.path.exists(path): return
-        with open(path, "r") as f:
-            data = json.load(f)
-        self.W1 = np.array(data["W1"])
-        self.b1 = np.array(data["b1"])
-        self.Wp = np.array(data["Wp"])
-        self.bp = np.array(data["bp"])
-        self.Wv = np.array(data["Wv"])
-        self.bv = np.array(data["bv"])
+        if is_checkpoint(path):
+            data, _ = read_checkpoint(path, mmap=mmap)
+        else:
+            with open(path, "r") as f:
+                data = {name: np.array(arr) for name, arr in json.load(f).items()}
+        self.load_arrays({name: data[name] for name in self.WEIGHT_NAMES})
+
+    def load_bytes(self, data):
+        # A downloaded checkpoint or legacy JSON file, without a disk copy;
+        # binary weights stay read-only views of data
+        if data[:len(MAGIC)] == MAGIC:
+            arrays, _ = decode_checkpoint(data)
+        else:
+            arrays = {name: np.array(arr) for name, arr in json.loads(data).items()}
+        self.load_arrays({name: arrays[name] for name in self.WEIGHT_NAMES})
+
+    def load_arrays(self, data):
+        # Replaces the named weights; a delta update may hold only some
+        for name in self.WEIGHT_NAMES:
+            if name in data:
+                setattr(self, name, data[name])
+        self.input_size, self.hidden_size = self.W1.shape
+        self.version += 1
+
+    def _ensure_trainable(self):
+        # Training updates float64 weights in place
+        for name in self.WEIGHT_NAMES:
+            arr = getattr(self, name)
+            if not arr.flags.writeable or arr.dtype != np.float64:
+                setattr(self, name, np.array(arr, dtype=np.float64))
 
     def train_step(self, states, policies, values, lr=1e-3):
-        # Very simple SGD
+        # Very simple SGD (ai.trainer.Trainer is the fast float32 path)
         # Backward Pass
+        self._ensure_trainable()
         
         x_flat = states.reshape(states.shape[0], -1)
         
@@ -109,6 +275,7 @@ class TinyAlphaZero:
         
         self.W1 -= lr * np.dot(x_flat.T, d_z1)
         self.b1 -= lr * np.sum(d_z1, axis=0)
+        self.version += 1
         
         loss = np.mean((v_pred - values)**2) - np.mean(np.sum(policies * np.log(probs + 1e-8), axis=1))
         return loss
@@ -0,0 +1,128 @@
+"""
+Multi-process MCTS for a single position.
+
+Every worker process searches its own copy of the tree. Root child
+statistics (visits, value sums, including in-flight virtual loss) are
+published once per batch into a multiprocessing.shared_memory block laid out
+as [workers, 2, num_root_children]. Each worker folds the other rows into
+its root before selecting, so workers spread over different root moves
+instead of repeating each other's work. When all workers finish, the rows are
+merged into the caller's tree, which is the one mcts_search returns.
+
+The calling process acts as worker 0, so its deeper subtree stays available
+for subtree reuse.
+"""
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+from .mcts import run_simulations
+
+# Root prior noise for helper workers so they do not start in lockstep
+ROOT_NOISE_ALPHA = 0.3
+ROOT_NOISE_FRACTION = 0.25
+
+def _attach(name):
+    # Only the creating process should own (and unlink) the block. Helpers
+    # share the parent's resource tracker, so on older Pythons a plain attach
+    # just re-registers the same name.
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+class RootSync:
+    """Publishes this worker's root statistics and applies everyone else's."""
+    def __init__(self, tree, stats, worker):
+        self.tree = tree
+        self.stats = stats
+        self.worker = worker
+        self.first, self.last = tree.children_range(tree.root)
+        self.base_n = tree.visit_count[self.first:self.last].astype(np.float64)
+        self.base_w = tree.value_sum[self.first:self.last].astype(np.float64)
+        self.ext_n = np.zeros_like(self.base_n)
+        self.ext_w = np.zeros_like(self.base_w)
+
+    def _own(self):
+        n = self.tree.visit_count[self.first:self.last] - self.ext_n
+        w = self.tree.value_sum[self.first:self.last] - self.ext_w
+        return n, w
+
+    def _set(self, n, w, ext_n, ext_w):
+        tree = self.tree
+        tree.visit_count[tree.root] += int(ext_n.sum() - self.ext_n.sum())
+        tree.visit_count[self.first:self.last] = np.rint(n + ext_n)
+        tree.value_sum[self.first:self.last] = w + ext_w
+        self.ext_n, self.ext_w = ext_n, ext_w
+
+    def __call__(self):
+        n, w = self._own()
+        row = self.stats[self.worker]
+        row[0] = n - self.base_n
+        row[1] = w - self.base_w
+        total = self.stats.sum(axis=0)
+        self._set(n, w, total[0] - row[0], total[1] - row[1])
+
+    def finish(self):
+        # Publish the final counts and drop the foreign ones again
+        n, w = self._own()
+        self.stats[self.worker, 0] = n - self.base_n
+        self.stats[self.worker, 1] = w - self.base_w
+        self._set(n, w, np.zeros_like(n), np.zeros_like(w))
+
+def _add_root_noise(tree, seed):
+    first, last = tree.children_range(tree.root)
+    rng = np.random.default_rng(seed)
+    noise = rng.dirichlet([ROOT_NOISE_ALPHA] * (last - first))
+    priors = tree.prior[first:last]
+    tree.prior[first:last] = (1 - ROOT_NOISE_FRACTION) * priors + ROOT_NOISE_FRACTION * noise
+
+def _worker_main(shm_name, shape, worker, tree, game, net, budget, options):
+    shm = _attach(shm_name)
+    try:
+        stats = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        _add_root_noise(tree, worker)
+        sync = RootSync(tree, stats, worker)
+        run_simulations(tree, game, net, budget, sync=sync, **options)
+        sync.finish()
+        del stats
+    finally:
+        shm.close()
+
+def parallel_simulate(tree, game, net, budget, workers, **options):
+    # tree.root must already be expanded. The budget's sims and nodes are
+    # split evenly (each worker gets the full time limit); the caller's share
+    # runs in this process.
+    first, last = tree.children_range(tree.root)
+    shape = (workers, 2, last - first)
+    nbytes = int(np.prod(shape)) * np.dtype(np.float64).itemsize
+    shm = shared_memory.SharedMemory(create=True, size=nbytes)
+    try:
+        stats = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        stats[:] = 0
+
+        methods = mp.get_all_start_methods()
+        ctx = mp.get_context("fork" if "fork" in methods else "spawn")
+        procs = []
+        for w in range(1, workers):
+            proc = ctx.Process(target=_worker_main,
+                               args=(shm.name, shape, w, tree, game, net,
+                                     budget.split(workers, w), options),
+                               daemon=True)
+            proc.start()
+            procs.append(proc)
+
+        sync = RootSync(tree, stats, 0)
+        run_simulations(tree, game, net, budget.split(workers, 0), sync=sync, **options)
+        for proc in procs:
+            proc.join()
+        sync.finish()
+
+        # Merge the helpers' final root statistics into our tree
+        others = stats[1:].sum(axis=0)
+        tree.visit_count[first:last] += np.rint(others[0]).astype(np.int32)
+        tree.value_sum[first:last] += others[1].astype(np.float32)
+        tree.visit_count[tree.root] += int(np.rint(others[0]).sum())
+        del stats
+    finally:
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,169 @@
+"""
+Data-parallel training for TinyAlphaZero on local processes.
+
+ParallelTrainer is a Trainer whose weights and batch buffers live in
+multiprocessing.shared_memory. For every step the calling process fills the
+shared batch (with sample weights normalized over the whole batch) and tells
+the helper processes how many rows it holds. Each process, the caller
+included as worker 0, computes the gradient of its contiguous shard into its
+own row of a shared [workers, num_params] block. The caller then sums the
+rows in worker order and applies the optimizer in place on the shared
+weights, which the helpers read directly on the next step.
+
+Shards and the reduction order depend only on the batch size and worker
+count, and every process runs single-threaded BLAS (when threadpoolctl is
+available), so a run is deterministic for a fixed seed and worker count.
+"""
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+from .neural_core import TinyAlphaZero
+from .parallel_mcts import _attach
+from .trainer import Trainer, threadpool_limits
+
+def _layout(shapes):
+    # name -> (offset, shape) in a flat float32 block, and the total size
+    layout, offset = {}, 0
+    for name, shape in shapes.items():
+        layout[name] = (offset, shape)
+        offset += int(np.prod(shape))
+    return layout, offset
+
+def _views(buf, layout, base=0):
+    return {name: np.ndarray(shape, dtype=np.float32, buffer=buf,
+                             offset=(base + offset) * 4)
+            for name, (offset, shape) in layout.items()}
+
+def _shard(n, workers, worker):
+    bounds = np.linspace(0, n, workers + 1).astype(int)
+    return bounds[worker], bounds[worker + 1]
+
+def _worker_main(names, param_layout, batch_layout, num_params, worker, workers, conn):
+    if threadpool_limits is not None:
+        threadpool_limits(limits=1, user_api="blas")
+    blocks = [_attach(name) for name in names]
+    try:
+        params = _views(blocks[0].buf, param_layout)
+        grads = _views(blocks[1].buf, param_layout, base=worker * num_params)
+        batch = _views(blocks[2].buf, batch_layout)
+        input_size, hidden_size = params["W1"].shape
+        net = TinyAlphaZero(input_size=input_size, hidden_size=hidden_size)
+        trainer = Trainer(net, optimizer="sgd", batch_size=1)
+        trainer.params = params
+
+        b = None
+        while True:
+            msg = conn.recv()
+            if msg is None:
+                break
+            start, end = _shard(msg, workers, worker)
+            b = trainer._buffers(end - start)
+            b.update({key: batch[key][start:end] for key in batch})
+            conn.send(trainer._gradients(b, grads))
+        del params, grads, batch, b, trainer
+    finally:
+        for block in blocks:
+            block.close()
+
+class ParallelTrainer(Trainer):
+    """Trainer that splits every batch across workers processes."""
+    def __init__(self, net, workers=2, **kwargs):
+        kwargs.setdefault("batch_size", 256)
+        self.workers = workers
+        self._blocks = []
+        super().__init__(net, **kwargs)
+        if kwargs.get("threads") is None and threadpool_limits is not None:
+            self._limits = threadpool_limits(limits=1, user_api="blas")
+
+        # Weights and one gradient row per worker
+        param_layout, self.num_params = _layout({name: p.shape for name, p in self.params.items()})
+        params_shm = self._create(self.num_params)
+        grads_shm = self._create(workers * self.num_params)
+        for name, view in _views(params_shm.buf, param_layout).items():
+            view[:] = self.params[name]
+            self.params[name] = view
+            setattr(net, name, view)
+        self._grad_rows = [_views(grads_shm.buf, param_layout, base=w * self.num_params)
+                           for w in range(workers)]
+
+        # The batch inputs, sized for batch_size rows
+        rows = self.batch_size
+        batch_layout, batch_size = _layout({
+            "x": (rows, self.params["W1"].shape[0]), "pi": (rows, self.params["Wp"].shape[1]),
+            "z": (rows, 1), "w": (rows,)})
+        batch_shm = self._create(batch_size)
+        self._batch = _views(batch_shm.buf, batch_layout)
+
+        methods = mp.get_all_start_methods()
+        ctx = mp.get_context("fork" if "fork" in methods else "spawn")
+        names = [block.name for block in self._blocks]
+        self._procs, self._conns = [], []
+        for w in range(1, workers):
+            parent, child = ctx.Pipe()
+            proc = ctx.Process(target=_worker_main,
+                               args=(names, param_layout, batch_layout, self.num_params,
+                                     w, workers, child),
+                               daemon=True)
+            proc.start()
+            self._procs.append(proc)
+            self._conns.append(parent)
+
+    def _create(self, count):
+        block = shared_memory.SharedMemory(create=True, size=max(count, 1) * 4)
+        self._blocks.append(block)
+        return block
+
+    def _input_buffers(self, rows):
+        if rows > self.batch_size:
+            raise ValueError(f"batch of {rows} rows exceeds batch_size={self.batch_size}")
+        return self._batch
+
+    def _step(self, b):
+        n = len(b["x"])
+        for conn in self._conns:
+            conn.send(n)
+        start, end = _shard(n, self.workers, 0)
+        own = {key: buf[start:end] for key, buf in b.items()}
+        losses = [self._gradients(own, self._grad_rows[0])]
+        losses += [conn.recv() for conn in self._conns]
+
+        # Ordered reduction, so the sum does not depend on arrival order
+        for name, grad in self.grads.items():
+            grad[:] = self._grad_rows[0][name]
+            for row in self._grad_rows[1:]:
+                grad += row[name]
+        self._apply()
+        return sum(l[0] for l in losses), sum(l[1] for l in losses)
+
+    def close(self):
+        # Stops the helpers; the net keeps a private copy of the weights
+        if not self._blocks:
+            return
+        for conn in self._conns:
+            conn.send(None)
+        for proc in self._procs:
+            proc.join()
+        for name, view in self.params.items():
+            copy = np.array(view)
+            self.params[name] = copy
+            setattr(self.net, name, copy)
+        fast = getattr(self.net, "_fast", None)
+        if fast is not None:
+            # Drop inference copies that may alias the shared weights
+            self.net.enable_inference(fast["max_batch"])
+        self._grad_rows = self._batch = self._buf = None
+        self._rows = 0
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+        if self._limits is not None:
+            # The rest of the process gets its BLAS threads back
+            self._limits.restore_original_limits()
+            self._limits = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,240 @@
+"""
+Int8 post-training quantization of TinyAlphaZero.
+
+W1 and Wp are stored as int8 with one float scale per output channel. The
+network inputs are already 0/1, and the hidden activations are quantized to
+0..255 with one scale found by calibration on replay positions, so both large
+layers multiply integers and accumulate in int32 before a single rescale per
+output. The value head (hidden x 1) and the biases stay float32.
+
+The integer products run in the int8 kernels of flaw_core (core/int8.cpp),
+on the int8 weights themselves: Wp is read at a quarter of the float32
+bytes, and forward_legal reads only the rows of the legal moves. This is
+the inference mode of MCTSWorker --int8. Without a flaw_core built with the
+kernels, the products fall back to float32 BLAS on integer-valued copies of
+the weights (numpy has no int8 GEMM). Every partial sum stays below 2**24,
+so the result is the same, but those copies are as large as the float32
+weights: good for accuracy checks, not for faster inference.
+
+Usage: python -m ai.quantize [--weights W] [--data samples.json] [--out OUT]
+
+Calibration positions come from --data, else the replay store, else random
+games.
+"""
+import argparse
+import os
+import random
+import numpy as np
+import chess
+from .checkpoint import MMAP_DEFAULT, publish_checkpoint, read_checkpoint
+from .encoding import encode_board
+from .neural_core import TinyAlphaZero, mcts_weights_path
+from .replay import load_samples
+from .replay_store import REPLAY_DIR, ReplayStore
+
+try:
+    import flaw_core as fc
+    INT8_KERNELS = hasattr(fc, "int8_matmul")
+except ImportError:
+    fc = None
+    INT8_KERNELS = False
+
+INT8_WEIGHTS_PATH = "ai/mcts_weights_int8.bin"
+WEIGHT_LEVELS = 127
+ACT_LEVELS = 255
+# Activation range: this percentile of the positive calibration activations,
+# so a few outliers do not eat the resolution of everything else
+CALIBRATION_PERCENTILE = 99.99
+EXACT_LIMIT = 2**24
+
+def _quantize_columns(W):
+    scale = np.abs(W).max(axis=0) / WEIGHT_LEVELS
+    scale[scale == 0] = 1.0
+    q = np.clip(np.rint(W / scale), -WEIGHT_LEVELS, WEIGHT_LEVELS).astype(np.int8)
+    return q, scale.astype(np.float32)
+
+class QuantizedAlphaZero:
+    """Drop-in replacement for TinyAlphaZero inference (forward, forward_hidden)."""
+    ARRAY_NAMES = ("W1_q", "W1_scale", "b1", "Wp_q", "Wp_scale", "bp", "Wv", "bv", "act_scale")
+
+    def __init__(self):
+        self.version = 0
+        self.input_size = 0
+        self.hidden_size = 0
+
+    def quantize_from(self, net, positions):
+        # positions: [N, 832] network inputs used to calibrate the activation scale
+        input_size, hidden_size = net.W1.shape
+        if hidden_size * ACT_LEVELS * WEIGHT_LEVELS >= EXACT_LIMIT:
+            raise ValueError(f"hidden_size {hidden_size} too large for exact float32 accumulation")
+        self.W1_q, self.W1_scale = _quantize_columns(net.W1)
+        self.Wp_q, self.Wp_scale = _quantize_columns(net.Wp)
+        self.b1 = np.asarray(net.b1, dtype=np.float32)
+        self.bp = np.asarray(net.bp, dtype=np.float32)
+        self.Wv = np.asarray(net.Wv, dtype=np.float32)
+        self.bv = np.asarray(net.bv, dtype=np.float32)
+        self.act_scale = np.ones(1, dtype=np.float32)
+        self._prepare()
+
+        # Calibrate on the quantized first layer's activations
+        positions = np.asarray(positions, dtype=np.float32).reshape(len(positions), -1)
+        h1 = np.maximum(0, self._layer1(positions))
+        active = h1[h1 > 0]
+        top = np.percentile(active, CALIBRATION_PERCENTILE) if active.size else 1.0
+        self.act_scale[0] = top / ACT_LEVELS
+        self._prepare()
+        return self
+
+    def _prepare(self):
+        self.input_size, self.hidden_size = self.W1_q.shape
+        # Wp is kept transposed only, one row per move, for forward_legal
+        self._WpT_q = np.ascontiguousarray(self.Wp_q.T)
+        if INT8_KERNELS:
+            self._W1_int = self._WpT_int = None
+        else:
+            # Integer-valued float32 copies for BLAS (see module docstring);
+            # np.dot multiplies by the transposed view of WpT without a copy
+            self._W1_int = self.W1_q.astype(np.float32)
+            self._WpT_int = self._WpT_q.astype(np.float32)
+        self._W1 = None
+        self._policy_scale = self.act_scale[0] * self.Wp_scale
+        self.version += 1
+
+    def _layer1(self, x):
+        # x is 0/1, so x @ W1_q is an integer sum of int8 weights
+        if INT8_KERNELS:
+            z1 = fc.int8_matmul(np.asarray(x, dtype=np.uint8), self.W1_q).astype(np.float32)
+        else:
+            z1 = np.dot(np.asarray(x, dtype=np.float32), self._W1_int)
+        z1 *= self.W1_scale
+        z1 += self.b1
+        return z1
+
+    def layer1_weights(self):
+        # Dequantized, for ai.accumulator; built on first use
+        if self._W1 is None:
+            self._W1 = self.W1_q * self.W1_scale
+        return self._W1, self.b1
+
+    def forward(self, x):
+        x = x.reshape(1 if x.ndim == 1 else x.shape[0], -1)
+        return self.forward_hidden(self._layer1(x))
+
+    def _quantize_hidden(self, z1):
+        # Activations as integers 0..255: uint8 for the kernels, float32 for BLAS
+        h_q = np.multiply(z1, 1.0 / self.act_scale[0], dtype=np.float32)
+        np.clip(h_q, 0, ACT_LEVELS, out=h_q)
+        np.rint(h_q, out=h_q)
+        return h_q.astype(np.uint8) if INT8_KERNELS else h_q
+
+    def _value(self, h_q):
+        return np.tanh(np.dot(h_q * self.act_scale[0], self.Wv) + self.bv)
+
+    def forward_legal(self, x, legal, pre_activations=False):
+        # As TinyAlphaZero.forward_legal
+        if not pre_activations:
+            x = self._layer1(x)
+        h_q = self._quantize_hidden(x)
+        lengths = np.fromiter((len(i) for i in legal), dtype=np.intp, count=len(legal))
+        idx = np.concatenate(legal) if len(legal) else np.zeros(0, dtype=np.intp)
+        rows = np.repeat(np.arange(len(legal)), lengths)
+        if INT8_KERNELS:
+            logits = fc.int8_gather_dot(h_q, self._WpT_q, rows, idx).astype(np.float32)
+        else:
+            logits = np.einsum("ij,ij->i", h_q[rows], self._WpT_int[idx])
+        logits *= self._policy_scale[idx]
+        logits += self.bp[idx]
+        return np.split(logits, np.cumsum(lengths)[:-1]), self._value(h_q)
+
+    def forward_hidden(self, z1):
+        h_q = self._quantize_hidden(z1)
+        if INT8_KERNELS:
+            policy = fc.int8_matmul_t(h_q, self._WpT_q).astype(np.float32)
+        else:
+            policy = np.dot(h_q, self._WpT_int.T)
+        policy *= self._policy_scale
+        policy += self.bp
+        return policy, self._value(h_q)
+
+    def save(self, path=INT8_WEIGHTS_PATH):
+        publish_checkpoint(path, {name: getattr(self, name) for name in self.ARRAY_NAMES},
+                           {"quantized": "int8"})
+
+    def load(self, path=INT8_WEIGHTS_PATH, mmap=MMAP_DEFAULT):
+        if not os.path.exists(path): return
+        data, meta = read_checkpoint(path, mmap=mmap)
+        if meta.get("quantized") != "int8":
+            raise ValueError(f"{path} is not an int8 checkpoint")
+        for name in self.ARRAY_NAMES:
+            setattr(self, name, data[name])
+        self._prepare()
+
+def load_positions(path, limit=None):
+    # Input tensors from a replay file (packed records and/or triplets)
+    samples = load_samples(path)
+    idx = None
+    if limit is not None and len(samples) > limit:
+        idx = random.sample(range(len(samples)), limit)
+    return samples.inputs(idx)
+
+def random_positions(count, seed=0, max_plies=120):
+    # Positions from random games, for calibration without replay data
+    rng = random.Random(seed)
+    out = np.empty((count, 13 * 64), dtype=np.float32)
+    board = chess.Board()
+    for i in range(count):
+        moves = list(board.legal_moves)
+        if not moves or board.ply() >= max_plies:
+            board = chess.Board()
+            moves = list(board.legal_moves)
+        board.push(rng.choice(moves))
+        encode_board(board, out=out[i])
+    return out
+
+def compare(net, qnet, positions):
+    """Accuracy of qnet against the float net on the given input tensors."""
+    positions = np.asarray(positions, dtype=np.float32)
+    p_ref, v_ref = (np.array(a, dtype=np.float64) for a in net.forward(positions))
+    p_q, v_q = (np.array(a, dtype=np.float64) for a in qnet.forward(positions))
+
+    def log_softmax(logits):
+        shifted = logits - logits.max(axis=1, keepdims=True)
+        return shifted - np.log(np.exp(shifted).sum(axis=1, keepdims=True))
+
+    log_ref, log_q = log_softmax(p_ref), log_softmax(p_q)
+    kl = (np.exp(log_ref) * (log_ref - log_q)).sum(axis=1)
+    return {
+        "positions": len(positions),
+        "policy_kl": float(kl.mean()),
+        "value_mse": float(np.mean((v_ref - v_q) ** 2)),
+        "top1_agreement": float(np.mean(p_ref.argmax(axis=1) == p_q.argmax(axis=1))),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--weights", type=str, default=None, help="Float checkpoint (default: current MCTS weights)")
+    parser.add_argument("--data", type=str, default=None, help="JSON samples file for calibration")
+    parser.add_argument("--replay-dir", type=str, default=REPLAY_DIR)
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--out", type=str, default=INT8_WEIGHTS_PATH)
+    args = parser.parse_args()
+
+    net = TinyAlphaZero(input_size=13*8*8, hidden_size=256)
+    net.load(args.weights or mcts_weights_path())
+    replay = ReplayStore(args.replay_dir).buffer() if not args.data else None
+    if args.data:
+        positions = load_positions(args.data, args.samples)
+        print(f"📊 Calibrating on {len(positions)} replay positions from {args.data}")
+    elif len(replay):
+        positions = replay.sample(args.samples)[0]
+        print(f"📊 Calibrating on {len(positions)} positions from {args.replay_dir}")
+    else:
+        positions = random_positions(args.samples)
+        print(f"📊 No replay data in {args.replay_dir}, calibrating on {len(positions)} random positions")
+
+    # Hold out a quarter of the positions for the accuracy report
+    split = len(positions) * 3 // 4
+    qnet = QuantizedAlphaZero().quantize_from(net, positions[:split])
+    qnet.save(args.out)
+    print(f"✅ Saved {args.out}")
+    print(f"   Accuracy vs float: {compare(net, qnet, positions[split:] if split < len(positions) else positions)}")
@@ -0,0 +1,512 @@
+"""
+Compact replay samples and an in-memory replay buffer.
+
+A dense training triplet is an 832-float input plus a 4096-float policy,
+about 20 KB as float32 and several times that as a JSON list. A packed
+sample keeps only what those are built from:
+
+- the 12 piece bitboards relative to the side to move (as in encode_board),
+- flags: bit 0 black to move, bits 1-4 castling rights K, Q, k, q,
+- the en passant square (NO_EP if none) and the position key,
+- the result for the side to move and a sample weight,
+- sparse (policy index, visit count) pairs for the visited moves,
+
+which is 122 bytes (offset included) plus 6 per visited move. PackedSamples
+holds many of them as columns (a structured position array plus CSR-style
+move arrays) and expands any subset into dense float32 tensors in one
+batched pass, so ReplayBuffer can keep millions of positions and only
+materializes the minibatch being trained on.
+
+dedup() merges samples of the same position into one: visit counts are
+summed, results averaged and the weight is the number of samples merged,
+so training on the merged sample costs one row instead of many. Self-play
+from the start position repeats its opening positions in every game;
+ReplayBuffer(dedup=True) merges them across the whole buffer.
+
+Position keys are polyglot Zobrist keys (as chess.polyglot.zobrist_hash),
+computed from the packed fields by position_keys() when a game is recorded
+and again when records are read, so keys agree whichever game backend
+played the game and whatever key a worker sent.
+
+Samples travel between workers and the server as JSON records (to_records /
+from_records). Legacy [state, policy, result] triplets are accepted wherever
+records are; they convert without castling, en passant or key information.
+"""
+import json
+import numpy as np
+import chess
+import chess.polyglot
+from .encoding import INPUT_SIZE, PIECE_PLANES, POLICY_INDEX, POLICY_SIZE, _unpack, piece_masks
+
+NO_EP = 255
+FLAG_BLACK = 1
+# Castling flag bits as (shift, colour, kingside)
+_CASTLING = ((1, chess.WHITE, True), (2, chess.WHITE, False),
+             (3, chess.BLACK, True), (4, chess.BLACK, False))
+
+# Polyglot piece-square keys in piece plane order (us P..K, them P..K),
+# white to move and black to move; polyglot numbers pieces 2 * (type - 1) + white
+_POLYGLOT = np.array(chess.polyglot.POLYGLOT_RANDOM_ARRAY, dtype=np.uint64)
+_PLANE_KEYS = np.stack([
+    _POLYGLOT[[64 * (2 * (plane % 6) + ((plane < 6) != black)) + sq
+               for plane in range(12) for sq in range(64)]]
+    for black in (False, True)])
+_KEY_CHUNK = 4096  # positions hashed per pass, bounds the temporary arrays
+
+# Version 1 (replay store format 1) had no weight
+POSITION_DTYPE_V1 = np.dtype([
+    ("pieces", "<u8", (12,)),
+    ("key", "<u8"),
+    ("flags", "u1"),
+    ("ep", "u1"),
+    ("result", "<f4"),
+])
+POSITION_DTYPE = np.dtype(POSITION_DTYPE_V1.descr + [("weight", "<f4")])
+MOVE_DTYPE = np.uint16    # policy index, from * 64 + to
+VISIT_DTYPE = np.float32  # visit counts (fractions for converted triplets)
+
+def upgrade_positions(positions):
+    # Version 1 positions -> current dtype, with weight 1
+    out = np.empty(len(positions), POSITION_DTYPE)
+    for name in POSITION_DTYPE_V1.names:
+        out[name] = positions[name]
+    out["weight"] = 1.0
+    return out
+
+def _ranges(starts, counts):
+    # Row number and flat index of every element of the ranges
+    # [starts[i], starts[i] + counts[i]), concatenated
+    rows = np.repeat(np.arange(len(counts)), counts)
+    before = np.cumsum(counts) - counts
+    flat = np.arange(counts.sum()) + np.repeat(starts - before, counts)
+    return rows, flat
+
+def _check_moves(i, moves, visits):
+    # Records come from workers over the network; a move index past the
+    # policy would make every later expand() over the sample fail
+    moves = np.asarray(moves)
+    visits = np.asarray(visits, dtype=VISIT_DTYPE)
+    if moves.ndim != 1 or moves.shape != visits.shape:
+        raise ValueError(f"record {i}: moves and visits differ in length")
+    if len(moves) and (moves.dtype.kind not in "iu" or moves.min() < 0
+                       or moves.max() >= POLICY_SIZE):
+        raise ValueError(f"record {i}: move indices must be integers below {POLICY_SIZE}")
+    return moves, visits
+
+class PackedSamples:
+    """
+    Columns of packed samples: positions[i] and the moves / visits in
+    offsets[i]:offsets[i + 1]. offsets[0] is always 0.
+    """
+    def __init__(self, positions=None, offsets=None, moves=None, visits=None):
+        self.positions = np.zeros(0, POSITION_DTYPE) if positions is None else positions
+        self.offsets = np.zeros(1, np.int64) if offsets is None else offsets
+        self.moves = np.zeros(0, MOVE_DTYPE) if moves is None else moves
+        self.visits = np.zeros(0, VISIT_DTYPE) if visits is None else visits
+
+    def __len__(self):
+        return len(self.positions)
+
+    @property
+    def nbytes(self):
+        return (self.positions.nbytes + self.offsets.nbytes
+                + self.moves.nbytes + self.visits.nbytes)
+
+    @classmethod
+    def concatenate(cls, parts):
+        parts = [p for p in parts if len(p)]
+        if not parts:
+            return cls()
+        if len(parts) == 1:
+            return parts[0]
+        bases = np.cumsum([0] + [len(p.moves) for p in parts[:-1]])
+        offsets = np.concatenate([parts[0].offsets[:1]]
+                                 + [p.offsets[1:] + base for p, base in zip(parts, bases)])
+        return cls(np.concatenate([p.positions for p in parts]), offsets,
+                   np.concatenate([p.moves for p in parts]),
+                   np.concatenate([p.visits for p in parts]))
+
+    def take(self, idx):
+        idx = np.asarray(idx, dtype=np.intp)
+        starts = self.offsets[idx]
+        counts = self.offsets[idx + 1] - starts
+        _, flat = _ranges(starts, counts)
+        offsets = np.zeros(len(idx) + 1, np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return PackedSamples(self.positions[idx], offsets, self.moves[flat], self.visits[flat])
+
+    def inputs(self, idx=None, out=None):
+        """Network inputs [n, 832] of the samples idx (all if None)."""
+        pos = self.positions if idx is None else self.positions[idx]
+        if out is None:
+            out = np.empty((len(pos), INPUT_SIZE), dtype=np.float32)
+        out[:, :PIECE_PLANES] = _unpack(np.ascontiguousarray(pos["pieces"]))
+        out[:, PIECE_PLANES:] = (pos["flags"] & FLAG_BLACK)[:, None]
+        return out
+
+    def expand(self, idx=None, x=None, pi=None, z=None, w=None):
+        """
+        Dense (inputs [n, 832], policy targets [n, 4096], results [n],
+        weights [n]) of the samples idx, written into x / pi / z / w when
+        given.
+        """
+        if idx is None:
+            idx = np.arange(len(self))
+        idx = np.asarray(idx, dtype=np.intp)
+        n = len(idx)
+        if pi is None:
+            pi = np.empty((n, POLICY_SIZE), dtype=np.float32)
+        if z is None:
+            z = np.empty(n, dtype=np.float32)
+        if w is None:
+            w = np.empty(n, dtype=np.float32)
+        x = self.inputs(idx, x)
+
+        # Visit distributions, scattered into zeroed rows
+        starts = self.offsets[idx]
+        rows, flat = _ranges(starts, self.offsets[idx + 1] - starts)
+        visits = self.visits[flat]
+        totals = np.bincount(rows, weights=visits, minlength=n)
+        totals[totals == 0] = 1.0
+        pi[:] = 0.0
+        pi[rows, self.moves[flat]] = visits / totals[rows]
+        z[:] = self.positions["result"][idx]
+        w[:] = self.positions["weight"][idx]
+        return x, pi, z, w
+
+    def to_records(self):
+        # JSON-serializable dicts, one per sample
+        records = []
+        for i, p in enumerate(self.positions):
+            start, end = self.offsets[i], self.offsets[i + 1]
+            records.append({
+                "pieces": p["pieces"].tolist(), "key": int(p["key"]),
+                "flags": int(p["flags"]), "ep": int(p["ep"]), "result": float(p["result"]),
+                "weight": float(p["weight"]), "moves": self.moves[start:end].tolist(), "visits": self.visits[start:end].tolist(),
+            })
+        return records
+
+    @classmethod
+    def from_records(cls, records):
+        # Packed records or legacy [state, policy, result] triplets, mixed freely
+        n = len(records)
+        positions = np.zeros(n, POSITION_DTYPE)
+        counts = np.zeros(n, np.int64)
+        moves, visits = [], []
+        for i, record in enumerate(records):
+            if isinstance(record, dict):
+                if len(record["pieces"]) != 12:
+                    raise ValueError(f"record {i}: expected 12 piece bitboards")
+                if not (0 <= record["ep"] < 64 or record["ep"] == NO_EP):
+                    raise ValueError(f"record {i}: bad en passant square {record['ep']}")
+                positions[i] = (record["pieces"], record["key"], record["flags"],
+                                record["ep"], record["result"], record.get("weight", 1.0))
+                m, v = _check_moves(i, record["moves"], record["visits"])
+            else:
+                state, pi, result = record
+                state = np.asarray(state, dtype=np.float32)
+                if state.shape != (INPUT_SIZE,) or np.shape(pi) != (POLICY_SIZE,):
+                    raise ValueError(f"record {i}: expected {INPUT_SIZE} inputs and "
+                                     f"{POLICY_SIZE} policy entries")
+                pieces = np.packbits(state[:PIECE_PLANES] > 0, bitorder="little").view("<u8")
+                flags = FLAG_BLACK if state[PIECE_PLANES] > 0 else 0
+                positions[i] = (pieces, 0, flags, NO_EP, result, 1.0)
+                pi = np.asarray(pi, dtype=np.float32)
+                m = np.flatnonzero(pi)
+                v = pi[m]
+            counts[i] = len(m)
+            moves.append(np.asarray(m, dtype=MOVE_DTYPE))
+            visits.append(np.asarray(v, dtype=VISIT_DTYPE))
+        offsets = np.zeros(n + 1, np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        if not n:
+            return cls()
+        # Keys are recomputed rather than trusted; triplets keep none (0)
+        packed = np.array([isinstance(record, dict) for record in records])
+        positions["key"][packed] = position_keys(positions[packed])
+        return cls(positions, offsets, np.concatenate(moves), np.concatenate(visits))
+
+def position_keys(positions):
+    """
+    Polyglot Zobrist keys of a POSITION_DTYPE array, equal to
+    chess.polyglot.zobrist_hash of the boards they were packed from.
+    """
+    n = len(positions)
+    keys = np.zeros(n, np.uint64)
+    for start in range(0, n, _KEY_CHUNK):
+        pos = positions[start:start + _KEY_CHUNK]
+        black = (pos["flags"] & FLAG_BLACK) != 0
+        bits = _unpack(pos["pieces"]).astype(bool)
+        h = np.bitwise_xor.reduce(np.where(bits, _PLANE_KEYS[black.astype(np.intp)], 0), axis=1)
+        for bit in range(4):
+            h ^= np.where(pos["flags"] & (2 << bit), _POLYGLOT[768 + bit], 0)
+        h ^= np.where(black, 0, _POLYGLOT[780])
+        # The en passant file counts only if a pawn of the side to move
+        # stands next to the pushed pawn
+        ep = pos["ep"].astype(np.int64)
+        has_ep = ep != NO_EP
+        pushed = np.where(black, ep + 8, ep - 8)
+        for side in (-1, 1):
+            beside = np.where(has_ep, pushed + side, 0)
+            on_board = has_ep & (0 <= beside) & (beside < 64) & (0 <= ep % 8 + side) & (ep % 8 + side < 8)
+            shift = np.clip(beside, 0, 63).astype(np.uint64)
+            pawn = ((pos["pieces"][:, 0] >> shift) & np.uint64(1)).astype(bool)
+            h ^= np.where(on_board & pawn, _POLYGLOT[772 + ep % 8], 0)
+            has_ep &= ~(on_board & pawn)
+        keys[start:start + len(pos)] = h
+    return keys
+
+def sample_keys(samples):
+    """
+    Position keys of the samples. Samples converted from triplets have no
+    key (0); theirs is a hash of the bitboards, flags and en passant square.
+    """
+    positions = samples.positions
+    keys = positions["key"].copy()
+    missing = keys == 0
+    if missing.any():
+        pos = positions[missing]
+        h = np.full(len(pos), 0x9E3779B97F4A7C15, dtype=np.uint64)
+        words = [pos["pieces"][:, j] for j in range(12)]
+        words.append(pos["flags"].astype(np.uint64) | (pos["ep"].astype(np.uint64) << np.uint64(8)))
+        for word in words:
+            # splitmix64-style mixing; uint64 arithmetic wraps
+            h ^= word
+            h *= np.uint64(0xBF58476D1CE4E5B9)
+            h ^= h >> np.uint64(31)
+        keys[missing] = h
+    return keys
+
+def dedup(samples):
+    """
+    Merges samples with the same position key into one, in order of first
+    appearance: visit counts summed per move, results averaged by weight,
+    weights summed. Always returns a new PackedSamples.
+    """
+    n = len(samples)
+    if not n:
+        return PackedSamples()
+    keys = sample_keys(samples)
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    k = len(first)
+    # Renumber groups by first appearance
+    order = np.argsort(first, kind="stable")
+    rank = np.empty(k, dtype=np.intp)
+    rank[order] = np.arange(k)
+    group = rank[inverse.reshape(-1)]
+
+    positions = samples.positions[first[order]].copy()
+    weight = samples.positions["weight"].astype(np.float64)
+    total = np.bincount(group, weights=weight, minlength=k)
+    value = np.bincount(group, weights=weight * samples.positions["result"], minlength=k)
+    positions["weight"] = total
+    positions["result"] = value / np.where(total > 0, total, 1.0)
+
+    # Visits summed per (group, move); the combined code sorts by group first
+    counts = np.diff(samples.offsets)
+    combined = np.repeat(group, counts).astype(np.int64) * POLICY_SIZE + samples.moves
+    codes, slot = np.unique(combined, return_inverse=True)
+    visits = np.bincount(slot.reshape(-1), weights=samples.visits, minlength=len(codes))
+    offsets = np.zeros(k + 1, np.int64)
+    np.cumsum(np.bincount(codes // POLICY_SIZE, minlength=k), out=offsets[1:])
+    return PackedSamples(positions, offsets, (codes % POLICY_SIZE).astype(MOVE_DTYPE),
+                         visits.astype(VISIT_DTYPE))
+
+def load_samples(path):
+    # A JSON list of records and/or triplets, as logs/mcts_data.json
+    with open(path, "r") as f:
+        return PackedSamples.from_records(json.load(f))
+
+class GameRecord:
+    """Collects one game's searched positions; finish() packs them."""
+    def __init__(self):
+        self.positions = []
+        self.moves = []
+        self.visits = []
+
+    def __len__(self):
+        return len(self.positions)
+
+    def add(self, game, root):
+        # The position in game before root's move is played; root is the
+        # searched MCTSNode whose child visits form the policy target
+        board = game.board
+        flags = FLAG_BLACK if board.turn == chess.BLACK else 0
+        for shift, color, kingside in _CASTLING:
+            if kingside:
+                allowed = board.has_kingside_castling_rights(color)
+            else:
+                allowed = board.has_queenside_castling_rights(color)
+            flags |= allowed << shift
+        ep = board.ep_square
+        # The key is filled in by finish(), from the packed fields
+        self.positions.append((piece_masks(board), 0, flags,
+                               NO_EP if ep is None else ep, 0.0, 1.0))
+
+        # Promotions to different pieces share a policy index; merge them
+        codes, counts = root.child_visits()
+        visited = counts > 0
+        idx, inverse = np.unique(POLICY_INDEX[codes[visited]], return_inverse=True)
+        self.moves.append(idx.astype(MOVE_DTYPE))
+        self.visits.append(np.bincount(inverse, weights=counts[visited]).astype(VISIT_DTYPE))
+
+    def finish(self, result):
+        # result is from white's point of view, as MCTSGame.result()
+        n = len(self.positions)
+        positions = np.array(self.positions, dtype=POSITION_DTYPE)
+        if n:
+            black = (positions["flags"] & FLAG_BLACK) != 0
+            positions["result"] = np.where(black, -result, result)
+            positions["key"] = position_keys(positions)
+        offsets = np.zeros(n + 1, np.int64)
+        np.cumsum([len(m) for m in self.moves], out=offsets[1:])
+        if not n:
+            return PackedSamples()
+        return PackedSamples(positions, offsets, np.concatenate(self.moves),
+                             np.concatenate(self.visits))
+
+class ReplayBuffer:
+    """
+    The most recent `capacity` samples, kept packed in chunks of up to
+    chunk_size positions. sample() expands a random minibatch into dense
+    float32 tensors.
+
+    With dedup=True a sample whose position is already in the buffer is
+    merged with it (see dedup). The merged sample is appended as new and the
+    old row is left in place with weight 0, so rows are never rewritten;
+    sample() skips such rows and they count towards capacity until evicted.
+    A dict from position key to row keeps the lookups O(1).
+    """
+    def __init__(self, capacity=1_000_000, chunk_size=16384, dedup=False):
+        self.capacity = capacity
+        self.chunk_size = chunk_size
+        self.dedup = dedup
+        self._chunks = []
+        self._head = 0  # samples of the first chunk that have been evicted
+        self._size = 0
+        self._added = 0  # rows ever added; row i of the buffer was number
+                         # _added - _size + i
+        self._rows = {}  # position key -> row number, with dedup
+
+    @classmethod
+    def from_chunks(cls, chunks):
+        # A buffer over existing PackedSamples (e.g. memory-mapped shards),
+        # without copying them
+        buf = cls(capacity=sum(len(chunk) for chunk in chunks))
+        buf._chunks = [chunk for chunk in chunks if len(chunk)]
+        buf._size = buf._added = buf.capacity
+        return buf
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def nbytes(self):
+        return sum(chunk.nbytes for chunk in self._chunks)
+
+    def add(self, samples):
+        """Adds samples; returns the fraction merged away by dedup (0.0 without)."""
+        incoming = len(samples)
+        if not incoming:
+            return 0.0
+        ratio = 0.0
+        if self.dedup:
+            samples, ratio = self._merge(samples)
+        # Small additions are merged into the last chunk to bound the number
+        # of chunks; larger ones become their own
+        if self._chunks and len(self._chunks[-1]) + len(samples) <= self.chunk_size:
+            self._chunks[-1] = PackedSamples.concatenate([self._chunks[-1], samples])
+        else:
+            self._chunks.append(samples)
+        if self.dedup:
+            first = self._added
+            for i, key in enumerate(sample_keys(samples).tolist()):
+                self._rows[key] = first + i
+        self._size += len(samples)
+        self._added += len(samples)
+        excess = self._size - self.capacity
+        if excess > 0:
+            self._head += excess
+            self._size -= excess
+            while self._head >= len(self._chunks[0]):
+                self._head -= len(self._chunks.pop(0))
+        if len(self._rows) > 2 * max(self._size, 1):
+            # Forget positions that were evicted
+            oldest = self._added - self._size
+            self._rows = {key: row for key, row in self._rows.items() if row >= oldest}
+        return ratio
+
+    def _merge(self, samples):
+        # Merges samples among themselves and with rows already held;
+        # returns the samples to append and the dedup ratio
+        incoming = len(samples)
+        samples = dedup(samples)
+        oldest = self._added - self._size
+        held = []
+        for key in sample_keys(samples).tolist():
+            row = self._rows.get(key)
+            if row is not None and row >= oldest:
+                held.append(row - oldest)
+        ratio = 1.0 - (len(samples) - len(held)) / incoming
+        if held:
+            held = np.sort(np.array(held, dtype=np.intp))
+            old = self.take(held)
+            for chunk, _, _, local in self._locate(held):
+                chunk.positions["weight"][local] = 0.0
+            samples = dedup(PackedSamples.concatenate([old, samples]))
+        return samples, ratio
+
+    def _locate(self, idx):
+        # Sorted buffer indices -> (chunk, local indices) groups
+        ends = np.cumsum([len(chunk) for chunk in self._chunks])
+        idx = idx + self._head
+        which = np.searchsorted(ends, idx, side="right")
+        bounds = np.searchsorted(which, np.arange(len(self._chunks) + 1))
+        for c, chunk in enumerate(self._chunks):
+            lo, hi = bounds[c], bounds[c + 1]
+            if lo < hi:
+                yield chunk, lo, hi, idx[lo:hi] - (ends[c] - len(chunk))
+
+    def sample(self, n, rng=None, x=None, pi=None, z=None):
+        """Dense (x, pi, z, w) of n distinct random samples (see PackedSamples.expand)."""
+        rng = np.random.default_rng() if rng is None else rng
+        idx = np.sort(rng.choice(self._size, size=min(n, self._size), replace=False))
+        if self.dedup:
+            # Rows merged into a newer one; the batch comes out smaller
+            idx = idx[self._weights(idx) > 0]
+        return self.expand(idx, x, pi, z)
+
+    def _weights(self, idx):
+        w = np.empty(len(idx), dtype=np.float32)
+        for chunk, lo, hi, local in self._locate(idx):
+            w[lo:hi] = chunk.positions["weight"][local]
+        return w
+
+    def take(self, idx):
+        """Samples at ascending buffer indices idx, as PackedSamples."""
+        return PackedSamples.concatenate([chunk.take(local)
+                                          for chunk, _, _, local in self._locate(idx)])
+
+    def expand(self, idx, x=None, pi=None, z=None, w=None):
+        """As PackedSamples.expand, for ascending buffer indices idx."""
+        idx = np.asarray(idx, dtype=np.intp)
+        n = len(idx)
+        if x is None:
+            x = np.empty((n, INPUT_SIZE), dtype=np.float32)
+        if pi is None:
+            pi = np.empty((n, POLICY_SIZE), dtype=np.float32)
+        if z is None:
+            z = np.empty(n, dtype=np.float32)
+        if w is None:
+            w = np.empty(n, dtype=np.float32)
+        # Sorted indices keep each chunk's rows contiguous in the output
+        for chunk, lo, hi, local in self._locate(idx):
+            chunk.expand(local, x[lo:hi], pi[lo:hi], z[lo:hi], w[lo:hi])
+        return x, pi, z, w
+
+    def samples(self):
+        # Everything in the buffer as one PackedSamples
+        parts = list(self._chunks)
+        if parts and self._head:
+            parts[0] = parts[0].take(np.arange(self._head, len(parts[0])))
+        return PackedSamples.concatenate(parts)
@@ -0,0 +1,234 @@
+"""
+On-disk replay store: fixed-size binary shards plus an index.
+
+Layout of a store directory:
+  index.json         {"version", "shard_size", "next", "shards": [{"file", "count"}]}
+  shard_000042.bin   a sealed shard, ai.checkpoint format, shard_size samples
+  active_000043.log  append-only log of the samples not yet in a shard
+
+append() writes one block to the end of the active log, so a report costs
+the same however much data the store holds. Once the log reaches shard_size
+samples it is cut into shards of exactly shard_size samples and the
+remainder is carried into the next log (amortized constant cost per
+sample), the index is replaced atomically and, past the retention window,
+the oldest shards are deleted. Sealed shards never change, so readers map
+them and sample from them at random without loading them. Windows refuses
+to delete a file that is mapped or open; such a shard or log stays until a
+later seal removes it.
+
+Store format 2 added the sample weight to every position (ai.replay.dedup);
+format 1 shards and logs are read as weight 1, and a writer converts a
+format 1 active log when it opens the store.
+
+There must be only one writer (the weight server); any number of processes
+may read. A block cut short by a crash is ignored by readers and truncated
+by the next writer.
+"""
+import json
+import os
+import struct
+import numpy as np
+from .checkpoint import MMAP_DEFAULT, read_checkpoint, remove_file, write_checkpoint
+from .replay import (MOVE_DTYPE, POSITION_DTYPE, POSITION_DTYPE_V1, VISIT_DTYPE, PackedSamples,
+                     ReplayBuffer, upgrade_positions)
+
+REPLAY_DIR = "logs/replay"
+SHARD_SIZE = 65536           # samples per shard, about 15 MB
+RETENTION = 2_000_000        # samples kept (rounded up to whole shards)
+STORE_VERSION = 2
+
+# Log block: sample count, move count, then positions, per-sample move
+# counts, moves and visits
+_BLOCK = struct.Struct("<II")
+
+def _position_dtype(version):
+    return POSITION_DTYPE_V1 if version < 2 else POSITION_DTYPE
+
+def _read_log(path, version=STORE_VERSION):
+    # (samples of all complete blocks, byte length of those blocks)
+    dtype = _position_dtype(version)
+    if not os.path.exists(path):
+        return PackedSamples(), 0
+    with open(path, "rb") as f:
+        data = f.read()
+    parts, pos = [], 0
+    while pos + _BLOCK.size <= len(data):
+        n, m = _BLOCK.unpack_from(data, pos)
+        sizes = (n * dtype.itemsize, n * 4, m * 2, m * 4)
+        if pos + _BLOCK.size + sum(sizes) > len(data):
+            break
+        start = pos + _BLOCK.size
+        positions = np.frombuffer(data, dtype, n, start)
+        if version < 2:
+            positions = upgrade_positions(positions)
+        start += sizes[0]
+        counts = np.frombuffer(data, "<u4", n, start)
+        start += sizes[1]
+        moves = np.frombuffer(data, MOVE_DTYPE, m, start)
+        start += sizes[2]
+        visits = np.frombuffer(data, VISIT_DTYPE, m, start)
+        offsets = np.zeros(n + 1, np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        parts.append(PackedSamples(positions, offsets, moves, visits))
+        pos = start + sizes[3]
+    return PackedSamples.concatenate(parts), pos
+
+def read_shard(path, mmap=MMAP_DEFAULT):
+    # One sealed shard as PackedSamples (read-only if memory-mapped)
+    arrays, meta = read_checkpoint(path, mmap=mmap)
+    version = meta.get("replay_shard", 1)
+    positions = arrays["positions"].view(_position_dtype(version)).reshape(-1)
+    if version < 2:
+        # Converted in memory, so a format 1 shard is not memory-mapped
+        positions = upgrade_positions(positions)
+    return PackedSamples(positions, arrays["offsets"], arrays["moves"], arrays["visits"])
+
+def _block(samples):
+    counts = np.diff(samples.offsets).astype("<u4")
+    return b"".join((
+        _BLOCK.pack(len(samples), len(samples.moves)),
+        np.asarray(samples.positions, POSITION_DTYPE).tobytes(), counts.tobytes(),
+        np.asarray(samples.moves, MOVE_DTYPE).tobytes(),
+        np.asarray(samples.visits, VISIT_DTYPE).tobytes(),
+    ))
+
+class ReplayStore:
+    def __init__(self, path=REPLAY_DIR, shard_size=SHARD_SIZE, retention=RETENTION):
+        self.path = path
+        self.shard_size = shard_size
+        self.retention = retention
+        self._index_path = os.path.join(path, "index.json")
+        self._log = None  # writer state: open log file and its sample count
+        self._active = 0
+        self._load_index()
+
+    def _load_index(self):
+        self.index = {"version": STORE_VERSION, "shard_size": self.shard_size, "next": 0, "shards": []}
+        if os.path.exists(self._index_path):
+            with open(self._index_path, "r") as f:
+                self.index = json.load(f)
+        elif os.path.exists(self._log_path()):
+            # Format 1 wrote no index until the first shard was sealed
+            self.index["version"] = 1
+
+    def _log_path(self):
+        return os.path.join(self.path, f"active_{self.index['next']:06d}.log")
+
+    def __len__(self):
+        active = (self._active if self._log
+                  else len(_read_log(self._log_path(), self.index["version"])[0]))
+        return sum(s["count"] for s in self.index["shards"]) + active
+
+    def _open_log(self):
+        # Writer start-up: drop logs already sealed into shards, and a block
+        # left incomplete by a crash
+        os.makedirs(self.path, exist_ok=True)
+        current = self._log_path()
+        for name in os.listdir(self.path):
+            if name.startswith("active_") and os.path.join(self.path, name) != current:
+                remove_file(os.path.join(self.path, name))
+        samples, valid = _read_log(current, self.index["version"])
+        if self.index["version"] < STORE_VERSION:
+            # Rewrite the active log in the current format; sealed shards
+            # keep theirs
+            tmp = f"{current}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                if len(samples):
+                    f.write(_block(samples))
+            os.replace(tmp, current)
+            self.index["version"] = STORE_VERSION
+            valid = os.path.getsize(current)
+        self._write_index()
+        self._log = open(current, "ab")
+        self._log.truncate(valid)
+        self._active = len(samples)
+
+    def _write_index(self):
+        tmp = f"{self._index_path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self._index_path)
+
+    def append(self, samples):
+        """Appends ai.replay.PackedSamples; seals a shard when the log is full."""
+        if not len(samples):
+            return
+        if self._log is None:
+            self._open_log()
+        self._log.write(_block(samples))
+        self._log.flush()
+        self._active += len(samples)
+        if self._active >= self.shard_size:
+            self._seal()
+
+    def _seal(self):
+        # Active log -> as many full shards as it holds; the rest starts the
+        # next active log. The old log is only removed once the index that
+        # lists the new shards is in place.
+        self._log.close()
+        log_path = self._log_path()
+        samples, _ = _read_log(log_path, self.index["version"])
+        seq = self.index["next"]
+        shards = list(self.index["shards"])
+        start = 0
+        while len(samples) - start >= self.shard_size:
+            part = samples.take(np.arange(start, start + self.shard_size))
+            name = f"shard_{seq:06d}.bin"
+            write_checkpoint(os.path.join(self.path, name), {
+                "positions": part.positions.view(np.uint8).reshape(len(part), -1),
+                "offsets": part.offsets, "moves": part.moves, "visits": part.visits,
+            }, {"replay_shard": STORE_VERSION})
+            shards.append({"file": name, "count": len(part)})
+            seq += 1
+            start += self.shard_size
+        rest = samples.take(np.arange(start, len(samples)))
+        next_log = os.path.join(self.path, f"active_{seq:06d}.log")
+        tmp = f"{next_log}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            if len(rest):
+                f.write(_block(rest))
+        os.replace(tmp, next_log)
+
+        # Retention: drop the oldest shards while the rest still cover it
+        total = sum(s["count"] for s in shards)
+        while len(shards) > 1 and total - shards[0]["count"] >= self.retention:
+            total -= shards[0]["count"]
+            shards.pop(0)
+
+        self.index = dict(self.index, next=seq, shards=shards)
+        self._write_index()
+        # The old log and expired shards, with any left behind by an earlier
+        # seal because a reader still had them open or mapped (Windows).
+        # Readers that already mapped an expired shard keep their mapping.
+        for name in os.listdir(self.path):
+            old_shard = name.startswith("shard_") and name.endswith(".bin") and name < shards[0]["file"]
+            old_log = (name.startswith("active_") and name.endswith(".log")
+                       and os.path.join(self.path, name) != next_log)
+            if old_shard or old_log:
+                remove_file(os.path.join(self.path, name))
+        self._log = open(next_log, "ab")
+        self._active = len(rest)
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def chunks(self, mmap=MMAP_DEFAULT):
+        """Every shard (memory-mapped) and the active log, as PackedSamples."""
+        if self._log is None:
+            # Readers pick up shards sealed since the last call
+            self._load_index()
+        chunks = []
+        for shard in self.index["shards"]:
+            try:
+                chunks.append(read_shard(os.path.join(self.path, shard["file"]), mmap))
+            except FileNotFoundError:
+                # Expired by the writer after we read the index
+                continue
+        chunks.append(_read_log(self._log_path(), self.index["version"])[0])
+        return chunks
+
+    def buffer(self, mmap=MMAP_DEFAULT):
+        """Everything in the store as a read-only ReplayBuffer."""
+        return ReplayBuffer.from_chunks(self.chunks(mmap))
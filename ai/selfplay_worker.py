@@ -13,19 +13,33 @@ class DistributedWorker:
         self.worker_id = f"worker_{random.randint(1000, 9999)}"
         self.offline_file = f"results_{self.worker_id}.json"
         self.results_cache = []
+        # Results the master could not take yet (busy or unreachable)
+        self.unreported = []
+        # Last weights from the master and their version (ETag)
+        self.weights = None
+        self.weights_version = None
 
     def fetch_weights(self):
         if self.is_offline:
             return {"attack": 1.0, "defense": 1.0, "control": 1.0, "tempo": 1.0, "risk": 1.0}
         try:
-            res = requests.get(f"{self.master_url}/get_weights", timeout=10)
+            # Conditional request: 304 means the cached weights are current
+            headers = {"If-None-Match": f'"{self.weights_version}"'} if self.weights_version else {}
+            res = requests.get(f"{self.master_url}/get_weights", headers=headers, timeout=10)
+            if res.status_code == 304 and self.weights is not None:
+                return self.weights
             if res.status_code == 200:
-                return res.json()
+                self.weights = res.json()
+                self.weights_version = res.headers.get("X-Weights-Version")
+                return self.weights
             else:
                 print(f"Server returned status {res.status_code}")
         except Exception as e:
             print(f"Failed to fetch weights from {self.master_url}: {e}")
-            print("Using defaults.")
+        if self.weights is not None:
+            print("Using the last weights received.")
+            return self.weights
+        print("Using defaults.")
         return {"attack": 1.0, "defense": 1.0, "control": 1.0, "tempo": 1.0, "risk": 1.0}
 
     def run(self):
@@ -56,19 +70,47 @@ class DistributedWorker:
                     json.dump(self.results_cache, f, indent=2)
                 print(f"Result saved locally to {self.offline_file}")
             else:
-                try:
-                    res = requests.post(f"{self.master_url}/report_result", json={
-                        "worker_id": self.worker_id,
-                        "result": norm_res,
-                        "timestamp": time.time()
-                    }, timeout=10)
-                    if res.status_code != 200:
-                        print(f"Master alert: Server returned {res.status_code}")
-                except Exception as e:
-                    print(f"Failed to report result to {self.master_url}: {e}")
+                self.unreported.append({
+                    "worker_id": self.worker_id,
+                    "result": norm_res,
+                    "timestamp": time.time()
+                })
+                self.report_results()
             
             time.sleep(1) # Small gap
 
+    def report_results(self):
+        # Sends unreported results oldest first. A busy master (503) is
+        # retried once after its Retry-After; whatever is still unsent
+        # waits for the next game instead of being dropped.
+        retried = False
+        while self.unreported:
+            try:
+                res = requests.post(f"{self.master_url}/report_result", json=self.unreported[0], timeout=10)
+            except Exception as e:
+                print(f"Failed to report result to {self.master_url}: {e}")
+                break
+            if res.status_code == 503 and not retried:
+                try:
+                    delay = max(0.0, float(res.headers.get("Retry-After", 5)))
+                except ValueError:
+                    delay = 5.0
+                print(f"Master busy, retrying in {delay:g}s...")
+                time.sleep(delay)
+                retried = True
+                continue
+            if res.status_code in (200, 202):
+                self.unreported.pop(0)
+            elif 400 <= res.status_code < 500:
+                # Sending the same result again cannot succeed
+                print(f"Master rejected result ({res.status_code}): {res.text[:100]}")
+                self.unreported.pop(0)
+            else:
+                print(f"Master alert: Server returned {res.status_code}")
+                break
+        if self.unreported:
+            print(f"{len(self.unreported)} results kept for the next report.")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Flaw Distributed Worker")
     parser.add_argument("--master", type=str, default=None, help="URL of the local weight server (or leave empty for offline mode)")
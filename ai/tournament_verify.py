@@ -3,35 +3,51 @@ Run a tournament between trained and untrained MCTS agents.
 """
 import chess
 from ai.mcts import MCTSGame, mcts_search
-from ai.neural_core import TinyAlphaZero
+from ai.eval_cache import EvalCache
+from ai.neural_core import TinyAlphaZero, mcts_weights_path
 
-def play_game(white_net, black_net, max_moves=100, sims=25):
+def play_game(white_net, black_net, max_moves=100, sims=25, workers=1, caches=None,
+              movetime=None):
     """Play one game between two networks."""
     game = MCTSGame()
+    # Each side keeps its own tree, advanced by both players' moves
+    roots = {chess.WHITE: None, chess.BLACK: None}
+    # ...and its own evaluation cache, since the nets differ
+    if caches is None:
+        caches = {chess.WHITE: EvalCache(), chess.BLACK: EvalCache()}
     
     while not game.is_game_over() and len(game.board.move_stack) < max_moves:
-        current_net = white_net if game.board.turn == chess.WHITE else black_net
-        root = mcts_search(game, current_net, sims=sims)
+        turn = game.board.turn
+        current_net = white_net if turn == chess.WHITE else black_net
+        root = mcts_search(game, current_net, sims=sims, root=roots[turn], workers=workers,
+                           cache=caches[turn], time_limit=movetime, early_stop=True)
         
         if not root or not root.children:
             break
+        roots[turn] = root
         
         # Pick best move by visit count
         move = max(root.children.items(), key=lambda x: x[1].visit_count)[0]
         game.make_move(move)
+        for color, tree_root in roots.items():
+            roots[color] = tree_root.children.get(move) if tree_root else None
     
     return game.result()
 
-def run_tournament(num_games=10, sims=25):
+def run_tournament(num_games=10, sims=25, workers=1, movetime=None):
     """Run a tournament to measure improvement."""
     print(f"🏆 Running {num_games}-game tournament (Trained vs Untrained)")
     print(f"   Simulations per move: {sims}\n")
     
     trained = TinyAlphaZero(input_size=13*8*8, hidden_size=256)
-    trained.load("ai/mcts_weights.json")
+    trained.load(mcts_weights_path())
     print("✅ Loaded trained weights\n")
     
     untrained = TinyAlphaZero(input_size=13*8*8, hidden_size=256)
+    trained.enable_inference()
+    untrained.enable_inference()
+    # One cache per net, kept for the whole tournament
+    net_caches = {id(trained): EvalCache(), id(untrained): EvalCache()}
     
     results = {"trained_wins": 0, "untrained_wins": 0, "draws": 0}
     
@@ -45,7 +61,9 @@ def run_tournament(num_games=10, sims=25):
             colors = ("Untrained", "Trained")
         
         print(f"Game {i+1}/{num_games}: {colors[0]} (White) vs {colors[1]} (Black)...", end=" ", flush=True)
-        result = play_game(white, black, sims=sims)
+        caches = {chess.WHITE: net_caches[id(white)], chess.BLACK: net_caches[id(black)]}
+        result = play_game(white, black, sims=sims, workers=workers, caches=caches,
+                           movetime=movetime)
         
         # Track results from trained's perspective
         if result == 1.0:  # White won
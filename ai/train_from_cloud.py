@@ -1,54 +1,76 @@
 """
 Train the MCTS network using collected cloud data.
 """
-import json
-import numpy as np
-from ai.neural_core import TinyAlphaZero
+import argparse
+from ai.neural_core import MCTS_WEIGHTS_PATH, TinyAlphaZero, mcts_weights_path
+from ai.data_pipeline import DataPipeline
+from ai.parallel_trainer import ParallelTrainer
+from ai.replay_store import REPLAY_DIR
+from ai.trainer import TRAINER_STATE_PATH, Trainer, state_is_current
 
-def train_from_cloud_data(data_file="logs/mcts_data.json", epochs=10, batch_size=64):
-    print(f"📊 Loading cloud training data from {data_file}...")
-    
-    with open(data_file, "r") as f:
-        triplets = json.load(f)
-    
-    print(f"✅ Loaded {len(triplets)} training examples\n")
-    
-    # Load existing weights
+def train_from_cloud_data(sources=None, epochs=10, batch_size=64, optimizer="adam", lr=1e-3,
+                          threads=None, workers=1, seed=None, replay_dir=REPLAY_DIR, dedup=False):
+    # Trains on the replay store the weight server fills, or on the given
+    # sources (JSON / JSONL files, zip archives, shards, store directories;
+    # see ai.data_pipeline). workers > 1 splits every batch across that many
+    # processes (ai.parallel_trainer); a fixed seed makes the run
+    # reproducible. dedup merges repeated positions into weighted samples.
+    if isinstance(sources, str):
+        sources = [sources]
+    sources = sources or [replay_dir]
+    print(f"📊 Streaming cloud training data from {', '.join(sources)}...")
+
+    # Samples are streamed and shuffled through a bounded buffer, so the
+    # dataset only has to fit on disk
+    pipeline = DataPipeline(sources, batch_size=batch_size, seed=seed, dedup=dedup)
+
+    # Load existing weights; resume the optimizer too if its checkpoint is
+    # at least as new as the published weights
     net = TinyAlphaZero(input_size=13*8*8, hidden_size=256)
-    net.load("ai/mcts_weights.json")
-    print("✅ Loaded existing weights\n")
-    
-    # Convert to numpy arrays
-    states = np.array([t[0] for t in triplets])
-    policies = np.array([t[1] for t in triplets])
-    values = np.array([t[2] for t in triplets]).reshape(-1, 1)
-    
-    print(f"🎯 Training for {epochs} epochs...\n")
-    
-    for epoch in range(epochs):
-        # Shuffle data
-        indices = np.random.permutation(len(triplets))
-        
-        epoch_loss = 0
-        num_batches = 0
-        
-        for i in range(0, len(triplets), batch_size):
-            batch_indices = indices[i:i+batch_size]
-            batch_states = states[batch_indices]
-            batch_policies = policies[batch_indices]
-            batch_values = values[batch_indices]
-            
-            loss = net.train_step(batch_states, batch_policies, batch_values, lr=1e-3)
-            epoch_loss += loss
-            num_batches += 1
-        
-        avg_loss = epoch_loss / num_batches
-        print(f"Epoch {epoch+1}/{epochs}: Loss = {avg_loss:.4f}")
-    
-    # Save updated weights
-    net.save("ai/mcts_weights.json")
-    print(f"\n✅ Updated weights saved to ai/mcts_weights.json")
-    print(f"📊 Total training examples processed: {len(triplets)}")
+    weights_path = mcts_weights_path()
+    net.load(weights_path)
+    if workers > 1:
+        trainer = ParallelTrainer(net, workers=workers, optimizer=optimizer, lr=lr,
+                                  batch_size=batch_size, threads=threads)
+    else:
+        trainer = Trainer(net, optimizer=optimizer, lr=lr, batch_size=batch_size, threads=threads)
+    if state_is_current(weights_path):
+        trainer.load(TRAINER_STATE_PATH)
+        print(f"✅ Resumed weights and optimizer state (step {trainer.step_count})\n")
+    else:
+        print("✅ Loaded existing weights\n")
+
+    print(f"🎯 Training for {epochs} epochs on {workers} process(es)...\n")
+    try:
+        stats = trainer.fit_stream(pipeline, epochs=epochs)
+    finally:
+        if workers > 1:
+            trainer.close()
+
+    # Save the weights the workers fetch, then the (newer) training state
+    net.save(MCTS_WEIGHTS_PATH)
+    trainer.save(TRAINER_STATE_PATH)
+    print(f"\n✅ Updated weights saved to {MCTS_WEIGHTS_PATH}")
+    data = pipeline.stats()
+    print(f"📊 Total training examples processed: {data['samples']} "
+          f"({stats.get('samples_per_sec', 0):.0f} samples/sec, "
+          f"{data['skipped_records']} non-sample records skipped, "
+          f"{data['wait_seconds']}s waiting for data)")
+    if dedup:
+        print(f"📊 Dedup: {data['dedup_ratio']:.1%} of the samples merged into repeated positions")
 
 if __name__ == "__main__":
-    train_from_cloud_data(epochs=10, batch_size=64)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", type=str, nargs="*", default=None,
+                        help="Sources instead of the replay store: .json/.jsonl/.zip/.bin files or store directories")
+    parser.add_argument("--replay-dir", type=str, default=REPLAY_DIR)
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=1, help="Training processes")
+    parser.add_argument("--threads", type=int, default=None, help="BLAS threads per process")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--dedup", action="store_true", help="Merge repeated positions into weighted samples")
+    args = parser.parse_args()
+    train_from_cloud_data(args.data, epochs=args.epochs, batch_size=args.batch_size,
+                          threads=args.threads, workers=args.workers, seed=args.seed,
+                          replay_dir=args.replay_dir, dedup=args.dedup)
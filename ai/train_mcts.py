@@ -1,35 +1,46 @@
 import os
 import random
-import numpy as np
 import chess
-import json
-from .mcts import MCTSGame, mcts_search
-from .neural_core import TinyAlphaZero
+from .mcts import new_game, mcts_search
+from .eval_cache import EvalCache
+from .neural_core import MCTS_WEIGHTS_PATH, TinyAlphaZero, mcts_weights_path
+from .replay import GameRecord, ReplayBuffer
+from .trainer import TRAINER_STATE_PATH, Trainer, state_is_current
 
-def run_self_play(net, num_games=100, sims_per_move=10):
-    replay_buffer = []
+def run_self_play(net, num_games=100, sims_per_move=10, backend="python-chess",
+                  replay_capacity=2000, dedup=False, state_path=TRAINER_STATE_PATH):
+    # Samples are kept packed, so replay_capacity can be in the millions.
+    # dedup merges repeated positions (the openings) into weighted samples.
+    # The optimizer state is saved to state_path with every checkpoint and
+    # resumed from it (weights included) unless the published weights are
+    # newer; state_path=None keeps it in memory only.
+    replay_buffer = ReplayBuffer(capacity=replay_capacity, dedup=dedup)
+    cache = EvalCache()
+    trainer = Trainer(net, batch_size=64)
+    if state_path and state_is_current(MCTS_WEIGHTS_PATH, state_path):
+        trainer.load(state_path)
+        print(f"✅ Resumed weights and optimizer state (step {trainer.step_count})")
+
+    def save():
+        net.save(MCTS_WEIGHTS_PATH)
+        if state_path:
+            trainer.save(state_path)
 
     for game_idx in range(num_games):
-        game = MCTSGame()
-        history = [] # (state, policy_target)
+        game = new_game(backend)
+        record = GameRecord()
+        root = None
         
         print(f"Starting game {game_idx+1}/{num_games}...", end="", flush=True)
         
         while not game.is_game_over() and len(game.board.move_stack) < 200:
-            root = mcts_search(game, net, sims=sims_per_move)
+            root = mcts_search(game, net, sims=sims_per_move, root=root, cache=cache)
             if not root: break
             
-            # Policy target from visit counts
-            policy_target = np.zeros(4096)
+            # Position and visit counts (the policy target), packed
+            record.add(game, root)
             total_visits = sum(child.visit_count for child in root.children.values())
             
-            if total_visits > 0:
-                for move, child in root.children.items():
-                    idx = move.from_square * 64 + move.to_square
-                    policy_target[idx] = child.visit_count / total_visits
-            
-            history.append((game.to_tensor().flatten(), policy_target))
-            
             # Selection (Exploration/Exploitation)
             if len(game.board.move_stack) < 30:
                 moves = list(root.children.keys())
@@ -39,54 +50,37 @@ def run_self_play(net, num_games=100, sims_per_move=10):
                 move = max(root.children.items(), key=lambda x: x[1].visit_count)[0]
                 
             game.make_move(move)
+            root = root.children[move]
             print(".", end="", flush=True)
 
         result = game.result()
-        print(f" Done. Result: {result}")
+        print(f" Done. Result: {result} (eval cache hit rate {cache.hit_rate:.1%})")
         
-        # Add to buffer with outcome (flipping sign for side-to-move)
-        # In history, white moved at index 0, 2, 4...
-        # Result is from white's perspective.
-        for i, (state, pi) in enumerate(history):
-            turn_result = result if i % 2 == 0 else -result
-            replay_buffer.append((state, pi, turn_result))
+        # Add to buffer with outcome (result is from white's perspective,
+        # finish() flips it for black to move); the oldest samples beyond
+        # replay_capacity drop out
+        ratio = replay_buffer.add(record.finish(result))
+        if dedup:
+            print(f" [Replay] {len(replay_buffer)} rows, {ratio:.1%} of this game merged")
 
-        # Train on recent buffer
+        # Train on recent buffer, expanding only the sampled batch
         if len(replay_buffer) >= 64:
-            batch = random.sample(replay_buffer, 64)
-            states = np.array([x[0] for x in batch])
-            pi_targets = np.array([x[1] for x in batch])
-            v_targets = np.array([x[2] for x in batch]).reshape(-1, 1)
-            
-            loss = net.train_step(states, pi_targets, v_targets)
-            print(f" [Train] Loss: {loss:.4f}")
-            
-            if len(replay_buffer) > 2000:
-                replay_buffer = replay_buffer[-2000:]
+            states, pi_targets, v_targets, weights = replay_buffer.sample(64)
+            policy_loss, value_loss = trainer.step(states, pi_targets, v_targets, weights)
+            print(f" [Train] Loss: {policy_loss + value_loss:.4f}")
 
         if (game_idx + 1) % 5 == 0:
-            weights = {
-                "W1": net.W1.tolist(), "b1": net.b1.tolist(),
-                "Wp": net.Wp.tolist(), "bp": net.bp.tolist(),
-                "Wv": net.Wv.tolist(), "bv": net.bv.tolist()
-            }
-            with open("ai/mcts_weights.json", "w") as f:
-                json.dump(weights, f)
+            save()
             print(f" [Checkpoint] Weights saved at game {game_idx+1}")
 
+    save()
     return net
 
 if __name__ == "__main__":
     net = TinyAlphaZero(input_size=13*8*8, hidden_size=256)
+    net.load(mcts_weights_path())
+    # float32 search; the inference copies follow the trainer's updates
+    net.enable_inference()
     print("🚀 Initializing AlphaZero (CPU) with python-chess...")
-    run_self_play(net, num_games=100, sims_per_move=10)
-    
-    # Final weight save
-    weights = {
-        "W1": net.W1.tolist(), "b1": net.b1.tolist(),
-        "Wp": net.Wp.tolist(), "bp": net.bp.tolist(),
-        "Wv": net.Wv.tolist(), "bv": net.bv.tolist()
-    }
-    with open("ai/mcts_weights.json", "w") as f:
-        json.dump(weights, f)
-    print("\n✅ Training Complete. Weights: ai/mcts_weights.json")
+    run_self_play(net, num_games=100, sims_per_move=10, dedup=True)
+    print(f"\n✅ Training Complete. Weights: {MCTS_WEIGHTS_PATH}")
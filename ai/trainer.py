@@ -0,0 +1,338 @@
+"""
+Training engine for TinyAlphaZero.
+
+Trainer runs the forward and backward pass in float32 with every
+intermediate and gradient buffer allocated once per batch size, and updates
+the weights in place with Adam, SGD with momentum or plain SGD. The optimizer
+state (moments and step count) is saved in the same binary checkpoint as the
+weights (ai.checkpoint), so training resumes where it stopped.
+
+The loss is value MSE plus policy cross-entropy against the visit
+distribution, optionally weighted per sample. It uses a max-shifted
+log-softmax in float32 and sums in float64 (policy_value_loss), so float32
+logits neither overflow nor lose the loss to rounding.
+
+BLAS threads can be capped with threads=N through the optional threadpoolctl
+package; without it, set OMP_NUM_THREADS / OPENBLAS_NUM_THREADS before
+starting Python.
+"""
+import os
+import time
+import numpy as np
+from .checkpoint import read_checkpoint, write_checkpoint
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+OPTIMIZERS = ("adam", "momentum", "sgd")
+TRAINER_STATE_PATH = "ai/mcts_trainer.bin"
+
+def state_is_current(weights_path, path=TRAINER_STATE_PATH):
+    # True if the training state at path may be resumed: it exists and is
+    # at least as new as the published weights (else they were trained
+    # further elsewhere and the state would roll them back)
+    return os.path.exists(path) and (not os.path.exists(weights_path)
+                                     or os.path.getmtime(path) >= os.path.getmtime(weights_path))
+
+def policy_value_loss(logits, values, target_pi, target_v, weights, d_logits=None, d_values=None):
+    """
+    Weighted loss of a batch: sum_i weights[i] * (CE_i + (v_i - z_i)^2), with
+    weights summing to 1. If d_logits / d_values buffers are given they
+    receive the gradients wrt the logits and the pre-tanh value. Returns
+    (policy loss, value loss) as Python floats.
+    """
+    # Stable log-softmax, in place on a copy of the logits
+    logp = logits - logits.max(axis=1, keepdims=True)
+    lse = np.log(np.exp(logp).sum(axis=1, keepdims=True))
+    logp -= lse
+    w = weights[:, None]
+    policy_loss = -np.sum(target_pi * logp * w, dtype=np.float64)
+    err = values - target_v
+    value_loss = np.sum(err * err * w, dtype=np.float64)
+
+    if d_logits is not None:
+        # d CE / d logits = softmax * sum(pi) - pi
+        np.exp(logp, out=d_logits)
+        d_logits *= target_pi.sum(axis=1, keepdims=True)
+        d_logits -= target_pi
+        d_logits *= w
+    if d_values is not None:
+        # d (v - z)^2 / d pre-tanh = 2 (v - z) (1 - v^2)
+        np.multiply(err, 2 * (1 - values * values), out=d_values)
+        d_values *= w
+    return float(policy_loss), float(value_loss)
+
+class Trainer:
+    def __init__(self, net, optimizer="adam", lr=1e-3, momentum=0.9, betas=(0.9, 0.999),
+                 eps=1e-8, weight_decay=0.0, batch_size=256, threads=None):
+        if optimizer not in OPTIMIZERS:
+            raise ValueError(f"Unknown optimizer: {optimizer}")
+        self.net = net
+        self.optimizer = optimizer
+        self.lr = lr
+        self.momentum = momentum
+        self.betas = betas
+        self.eps = eps
+        self.weight_decay = weight_decay
+        self.batch_size = batch_size
+        self.step_count = 0
+
+        # Train the net's own arrays, as writable float32
+        for name in net.WEIGHT_NAMES:
+            setattr(net, name, np.array(getattr(net, name), dtype=np.float32))
+        self.params = {name: getattr(net, name) for name in net.WEIGHT_NAMES}
+        self.grads = {name: np.zeros_like(p) for name, p in self.params.items()}
+        self._scratch = {name: np.zeros_like(p) for name, p in self.params.items()}
+        self.state = {}
+        if optimizer == "adam":
+            self.state["m"] = {name: np.zeros_like(p) for name, p in self.params.items()}
+            self.state["v"] = {name: np.zeros_like(p) for name, p in self.params.items()}
+        elif optimizer == "momentum":
+            self.state["m"] = {name: np.zeros_like(p) for name, p in self.params.items()}
+        self._rows = 0
+
+        self._limits = None
+        if threads:
+            if threadpool_limits is not None:
+                self._limits = threadpool_limits(limits=threads, user_api="blas")
+            else:
+                print(f"⚠️ threadpoolctl not installed; set OMP_NUM_THREADS={threads} before starting to cap BLAS threads")
+
+    def _buffers(self, n):
+        if n > self._rows:
+            rows = max(n, self.batch_size)
+            H = self.params["W1"].shape[1]
+            P = self.params["Wp"].shape[1]
+            f32 = np.float32
+            self._buf = dict(self._input_buffers(rows))
+            self._buf.update({
+                "z1": np.empty((rows, H), f32),
+                "h1": np.empty((rows, H), f32),
+                "logits": np.empty((rows, P), f32),
+                "d_logits": np.empty((rows, P), f32),
+                "v": np.empty((rows, 1), f32),
+                "d_v": np.empty((rows, 1), f32),
+                "d_h1": np.empty((rows, H), f32),
+                "d_h1_v": np.empty((rows, H), f32),
+            })
+            self._rows = rows
+        return {key: buf[:n] for key, buf in self._buf.items()}
+
+    def _input_buffers(self, rows):
+        # Batch inputs: states, policy targets, value targets, sample weights
+        return {
+            "x": np.empty((rows, self.params["W1"].shape[0]), np.float32),
+            "pi": np.empty((rows, self.params["Wp"].shape[1]), np.float32),
+            "z": np.empty((rows, 1), np.float32),
+            "w": np.empty(rows, np.float32),
+        }
+
+    def step(self, states, policies, values, weights=None):
+        """One optimizer step on a batch; returns (policy loss, value loss)."""
+        n = len(states)
+        b = self._buffers(n)
+        b["x"][:] = states.reshape(n, -1)
+        b["pi"][:] = policies
+        b["z"][:] = np.reshape(values, (n, 1))
+        if weights is None:
+            b["w"][:] = 1.0 / n
+        else:
+            b["w"][:] = weights
+            b["w"] /= b["w"].sum()
+        return self._step(b)
+
+    def _step(self, b):
+        losses = self._gradients(b, self.grads)
+        self._apply()
+        return losses
+
+    def _gradients(self, b, g):
+        # Forward and backward on the batch buffers b; gradients go into g.
+        # Sample weights in b["w"] must already be normalized.
+        p = self.params
+        x, z1, h1, logits, v = b["x"], b["z1"], b["h1"], b["logits"], b["v"]
+
+        # Forward
+        np.dot(x, p["W1"], out=z1)
+        z1 += p["b1"]
+        np.maximum(z1, 0, out=h1)
+        np.dot(h1, p["Wp"], out=logits)
+        logits += p["bp"]
+        np.dot(h1, p["Wv"], out=v)
+        v += p["bv"]
+        np.tanh(v, out=v)
+
+        losses = policy_value_loss(logits, v, b["pi"], b["z"], b["w"],
+                                   d_logits=b["d_logits"], d_values=b["d_v"])
+        d_logits, d_v, d_h1 = b["d_logits"], b["d_v"], b["d_h1"]
+
+        # Backward
+        np.dot(h1.T, d_v, out=g["Wv"])
+        g["bv"][:] = d_v.sum(axis=0)
+        np.dot(h1.T, d_logits, out=g["Wp"])
+        d_logits.sum(axis=0, out=g["bp"])
+        np.dot(d_logits, p["Wp"].T, out=d_h1)
+        np.dot(d_v, p["Wv"].T, out=b["d_h1_v"])
+        d_h1 += b["d_h1_v"]
+        d_h1 *= z1 > 0
+        np.dot(x.T, d_h1, out=g["W1"])
+        d_h1.sum(axis=0, out=g["b1"])
+        return losses
+
+    def _apply(self):
+        self.step_count += 1
+        t = self.step_count
+        lr = self.lr
+        for name, param in self.params.items():
+            grad = self.grads[name]
+            tmp = self._scratch[name]
+            if self.weight_decay and param.ndim > 1:
+                grad += self.weight_decay * param
+            if self.optimizer == "adam":
+                b1, b2 = self.betas
+                m, v = self.state["m"][name], self.state["v"][name]
+                m *= b1
+                m += (1 - b1) * grad
+                v *= b2
+                np.multiply(grad, grad, out=tmp)
+                tmp *= 1 - b2
+                v += tmp
+                # param -= lr_t * m / (sqrt(v) + eps_t), bias correction folded in
+                lr_t = lr * np.sqrt(1 - b2 ** t) / (1 - b1 ** t)
+                np.sqrt(v, out=tmp)
+                tmp += self.eps * np.sqrt(1 - b2 ** t)
+                np.divide(m, tmp, out=tmp)
+                tmp *= lr_t
+                param -= tmp
+            elif self.optimizer == "momentum":
+                m = self.state["m"][name]
+                m *= self.momentum
+                m += grad
+                np.multiply(m, lr, out=tmp)
+                param -= tmp
+            else:
+                np.multiply(grad, lr, out=tmp)
+                param -= tmp
+        # Lets inference copies and evaluation caches notice the update
+        self.net.version += 1
+
+    def fit(self, states, policies, values, epochs=1, weights=None, shuffle=True, log=print,
+            seed=None):
+        """Train on whole arrays for some epochs; returns the last epoch's stats."""
+        n = len(states)
+        states = np.asarray(states, dtype=np.float32).reshape(n, -1)
+        policies = np.asarray(policies, dtype=np.float32)
+        values = np.asarray(values, dtype=np.float32).reshape(-1)
+
+        if weights is not None:
+            weights = np.asarray(weights, dtype=np.float32)
+
+        def fill(idx, b):
+            np.take(states, idx, axis=0, out=b["x"])
+            np.take(policies, idx, axis=0, out=b["pi"])
+            np.take(values, idx, out=b["z"][:, 0])
+            if weights is None:
+                b["w"][:] = 1.0
+            else:
+                np.take(weights, idx, out=b["w"])
+        return self._fit(n, fill, epochs, shuffle, log, seed)
+
+    def fit_packed(self, samples, epochs=1, shuffle=True, log=print, seed=None):
+        """
+        As fit, on ai.replay.PackedSamples (or a ReplayBuffer) expanded one
+        batch at a time, weighted by the samples' own weights.
+        """
+        def fill(idx, b):
+            samples.expand(idx, b["x"], b["pi"], b["z"][:, 0], b["w"])
+        return self._fit(len(samples), fill, epochs, shuffle, log, seed)
+
+    def _fit(self, n, fill, epochs, shuffle, log, seed):
+        # fill(idx, b) writes the inputs, targets and (unnormalized) sample
+        # weights of samples idx into b
+        rng = np.random.default_rng(seed)
+        stats = {}
+        for epoch in range(epochs):
+            order = rng.permutation(n) if shuffle else np.arange(n)
+            start = time.perf_counter()
+            policy_sum = value_sum = 0.0
+            for i in range(0, n, self.batch_size):
+                # Ascending within the batch, which keeps reads from mapped
+                # replay shards (ai.replay_store) local
+                idx = np.sort(order[i:i + self.batch_size])
+                b = self._buffers(len(idx))
+                fill(idx, b)
+                total = b["w"].sum()
+                if total <= 0:
+                    # Only rows merged away by dedup (weight 0)
+                    continue
+                b["w"] /= total
+                policy_loss, value_loss = self._step(b)
+                policy_sum += policy_loss * len(idx)
+                value_sum += value_loss * len(idx)
+            stats = self._epoch_stats(epoch, epochs, n, policy_sum, value_sum,
+                                      time.perf_counter() - start, log)
+        return stats
+
+    def fit_stream(self, stream, epochs=1, log=print):
+        """
+        Train on (states, policies, values[, weights]) batches from an
+        iterable that is iterated once per epoch, e.g. ai.data_pipeline.DataPipeline.
+        """
+        stats = {}
+        for epoch in range(epochs):
+            start = time.perf_counter()
+            n = 0
+            policy_sum = value_sum = 0.0
+            for batch in stream:
+                policy_loss, value_loss = self.step(*batch)
+                count = len(batch[0])
+                n += count
+                policy_sum += policy_loss * count
+                value_sum += value_loss * count
+            stats = self._epoch_stats(epoch, epochs, n, policy_sum, value_sum,
+                                      time.perf_counter() - start, log)
+        return stats
+
+    def _epoch_stats(self, epoch, epochs, n, policy_sum, value_sum, elapsed, log):
+        n = max(n, 1)
+        stats = {
+            "epoch": epoch + 1,
+            "policy_loss": policy_sum / n,
+            "value_loss": value_sum / n,
+            "loss": (policy_sum + value_sum) / n,
+            "samples_per_sec": n / elapsed if elapsed > 0 else 0.0,
+        }
+        if log:
+            log(f"Epoch {epoch+1}/{epochs}: Loss = {stats['loss']:.4f} "
+                f"(policy {stats['policy_loss']:.4f}, value {stats['value_loss']:.4f}), "
+                f"{stats['samples_per_sec']:.0f} samples/sec")
+        return stats
+
+    def save(self, path=TRAINER_STATE_PATH):
+        # Weights plus optimizer state; TinyAlphaZero.load reads the weights
+        arrays = dict(self.params)
+        for slot, values in self.state.items():
+            for name, arr in values.items():
+                arrays[f"{slot}.{name}"] = arr
+        write_checkpoint(path, arrays, {
+            "input_size": self.net.input_size, "hidden_size": self.net.hidden_size,
+            "optimizer": self.optimizer, "step": self.step_count,
+        })
+
+    def load(self, path=TRAINER_STATE_PATH):
+        # Restores weights, and the optimizer state if it was saved by the
+        # same kind of optimizer
+        data, meta = read_checkpoint(path, mmap=False)
+        for name, param in self.params.items():
+            if data[name].shape != param.shape:
+                raise ValueError(f"{path}: {name} has shape {data[name].shape}, "
+                                 f"the network has {param.shape}")
+            param[:] = data[name]
+        if meta.get("optimizer") == self.optimizer:
+            for slot, values in self.state.items():
+                for name, arr in values.items():
+                    arr[:] = data[f"{slot}.{name}"]
+            self.step_count = meta.get("step", 0)
+        self.net.version += 1
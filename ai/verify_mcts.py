@@ -1,12 +1,12 @@
 import numpy as np
 import chess
 from ai.mcts import MCTSGame, mcts_search
-from ai.neural_core import TinyAlphaZero
+from ai.neural_core import TinyAlphaZero, mcts_weights_path
 
 def verify():
     net = TinyAlphaZero(input_size=13*8*8, hidden_size=256)
     try:
-        net.load("ai/mcts_weights.json")
+        net.load(mcts_weights_path())
         print("Loaded existing weights.")
     except:
         print("No weights found, using random.")
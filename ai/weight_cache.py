@@ -0,0 +1,112 @@
+"""
+Versioned weights for the weight server, held in memory.
+
+VersionedWeights serves the first existing file of a list of candidates and
+re-reads it only when its path, size or mtime change, so a request costs
+one stat() instead of a file read. Every snapshot has a version, a hash of
+its content, that the server sends as the ETag: a worker that sends it back
+in If-None-Match gets 304 Not Modified and keeps the weights it has.
+
+With binary=True the payload is always an ai.checkpoint file (a legacy
+JSON network is converted to float32 once per change), and the arrays of
+the last few versions are kept so that a worker one or more versions
+behind can download a delta: a checkpoint holding only the arrays that
+changed, meta {"delta_from", "version"}. A delta is only offered when it is
+at most half the size of the full payload.
+
+gzip() compresses a payload once per version, for clients that accept it.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from .checkpoint import MAGIC, decode_checkpoint, encode_checkpoint, resolve_checkpoint
+
+# Versions whose arrays are kept for deltas
+HISTORY = 4
+
+class Snapshot:
+    def __init__(self, body, mimetype, arrays=None):
+        self.body = body
+        self.mimetype = mimetype
+        self.arrays = arrays
+        self.version = hashlib.sha1(body).hexdigest()[:16]
+        self._gzip = None
+
+    def gzip(self):
+        # The compressed body, or None when compression does not pay
+        if self._gzip is None:
+            packed = gzip.compress(self.body, compresslevel=6, mtime=0)
+            self._gzip = packed if len(packed) < len(self.body) else b""
+        return self._gzip or None
+
+class VersionedWeights:
+    def __init__(self, paths, binary=False, history=HISTORY):
+        self.paths = [paths] if isinstance(paths, str) else list(paths)
+        self.binary = binary
+        self.history = history
+        self._lock = threading.Lock()
+        self._stat = None
+        self._current = None
+        self._versions = OrderedDict()  # version -> arrays, oldest first
+        self._deltas = {}
+
+    def current(self):
+        """The latest Snapshot, or None when no candidate file exists."""
+        path = next((p for p in self.paths if os.path.exists(p)), None)
+        if path is None:
+            return None
+        st = os.stat(path)
+        stat = (path, st.st_size, st.st_mtime_ns)
+        if stat != self._stat:
+            with self._lock:
+                if stat != self._stat:
+                    try:
+                        self._reload(path, stat)
+                    except Exception as e:
+                        # Caught mid-write (JSON files are not replaced
+                        # atomically): keep the previous version, retry later
+                        print(f"Error reading weights from {path}: {e}")
+        return self._current
+
+    def _reload(self, path, stat):
+        # A published checkpoint's pointer changes with every version, so
+        # its stat is enough to notice new weights
+        with open(resolve_checkpoint(path), "rb") as f:
+            body = f.read()
+        if not self.binary:
+            snap = Snapshot(body, "application/json")
+        else:
+            if body.startswith(MAGIC):
+                arrays, _ = decode_checkpoint(body)
+            else:
+                arrays = {name: np.asarray(arr, np.float32)
+                          for name, arr in json.loads(body).items()}
+                input_size, hidden_size = arrays["W1"].shape
+                body = encode_checkpoint(arrays, {"input_size": input_size,
+                                                  "hidden_size": hidden_size})
+            snap = Snapshot(body, "application/octet-stream", arrays)
+            self._versions.pop(snap.version, None)
+            self._versions[snap.version] = arrays
+            while len(self._versions) > self.history:
+                self._versions.popitem(last=False)
+            self._deltas = {}
+        self._current, self._stat = snap, stat
+
+    def delta(self, snap, base):
+        """Checkpoint bytes taking version base to snap, or None."""
+        with self._lock:
+            old = self._versions.get(base)
+            if snap.arrays is None or old is None or base == snap.version:
+                return None
+            key = (base, snap.version)
+            if key not in self._deltas:
+                changed = {name: arr for name, arr in snap.arrays.items()
+                           if name not in old or old[name].shape != arr.shape
+                           or not np.array_equal(old[name], arr)}
+                body = encode_checkpoint(changed, {"delta_from": base, "version": snap.version})
+                self._deltas[key] = body if 2 * len(body) <= len(snap.body) else b""
+            return self._deltas[key] or None
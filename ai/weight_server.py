@@ -1,103 +1,143 @@
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, Response, request, jsonify
 import os
 import json
-import threading
+import atexit
+from ai.ingest import IngestQueue
+from ai.replay import PackedSamples, load_samples
+from ai.replay_store import ReplayStore
+from ai.weight_cache import VersionedWeights
 
 app = Flask(__name__)
 
 # Base directory for the project
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 WEIGHTS_PATH = os.path.join(BASE_DIR, "ai", "tuned_weights.json")
-MCTS_WEIGHTS_PATH = os.path.join(BASE_DIR, "ai", "mcts_weights.json")
-RESULTS_PATH = os.path.join(BASE_DIR, "logs", "distributed_results.json")
+MCTS_WEIGHTS_PATH = os.path.join(BASE_DIR, "ai", "mcts_weights.bin")
+LEGACY_MCTS_WEIGHTS_PATH = os.path.join(BASE_DIR, "ai", "mcts_weights.json")
+RESULTS_PATH = os.path.join(BASE_DIR, "logs", "distributed_results.jsonl")
+LEGACY_RESULTS_PATH = os.path.join(BASE_DIR, "logs", "distributed_results.json")
 MCTS_DATA_PATH = os.path.join(BASE_DIR, "logs", "mcts_data.json")
+REPLAY_DIR = os.path.join(BASE_DIR, "logs", "replay")
+# Samples kept in the replay store
+REPLAY_RETENTION = int(os.environ.get("FLAW_REPLAY_RETENTION", 2_000_000))
+# FLAW_INGEST_DEDUP=1 merges repeated positions of each ingest batch into
+# weighted samples (ai.replay.dedup) before they are stored
+INGEST_DEDUP = os.environ.get("FLAW_INGEST_DEDUP", "0") not in ("", "0")
+# Seconds between tuned weight updates
+WEIGHT_INTERVAL = float(os.environ.get("FLAW_WEIGHT_INTERVAL", 10.0))
+# Seconds a worker is asked to wait when the ingest queue is full
+RETRY_AFTER = 5
 
 # Ensure logs directory exists
 os.makedirs(os.path.dirname(RESULTS_PATH), exist_ok=True)
 
-# Lock for thread-safe file updates
-update_lock = threading.Lock()
+# Self-play data goes to the sharded replay store (ai.replay_store); a
+# legacy logs/mcts_data.json is imported once and renamed
+replay_store = ReplayStore(REPLAY_DIR, retention=REPLAY_RETENTION)
+if os.path.exists(MCTS_DATA_PATH):
+    replay_store.append(load_samples(MCTS_DATA_PATH))
+    os.replace(MCTS_DATA_PATH, MCTS_DATA_PATH + ".imported")
+
+# Results are an append-only JSONL log; a legacy JSON list is imported once
+if os.path.exists(LEGACY_RESULTS_PATH):
+    with open(LEGACY_RESULTS_PATH, "r") as f:
+        legacy = json.load(f)
+    with open(RESULTS_PATH, "a") as f:
+        f.write("".join(json.dumps(r) + "\n" for r in legacy))
+    os.replace(LEGACY_RESULTS_PATH, LEGACY_RESULTS_PATH + ".imported")
+
+# Handlers only enqueue; one writer thread owns the files (ai.ingest)
+ingest = IngestQueue(RESULTS_PATH, WEIGHTS_PATH, replay_store, weight_interval=WEIGHT_INTERVAL,
+                     dedup=INGEST_DEDUP).start()
+atexit.register(ingest.stop)
+
+def _queued(kind, payload):
+    if not ingest.submit(kind, payload):
+        return jsonify({"error": "Ingest queue full"}), 503, {"Retry-After": str(RETRY_AFTER)}
+    return jsonify({"status": "queued"}), 202
+
+# Weights are served from memory with their version as the ETag
+# (ai.weight_cache); the files are re-read only when they change
+tuned_weights = VersionedWeights(WEIGHTS_PATH)
+mcts_weights = VersionedWeights([MCTS_WEIGHTS_PATH, LEGACY_MCTS_WEIGHTS_PATH], binary=True)
+
+def _serve_weights(weights):
+    snap = weights.current()
+    if snap is None:
+        return None
+    if snap.version in request.if_none_match:
+        response = Response(status=304)
+    else:
+        body, headers = snap.body, {}
+        # A worker that names the version it holds may get only the arrays
+        # that changed since
+        if request.args.get("delta"):
+            for base in request.if_none_match.as_set():
+                delta = weights.delta(snap, base)
+                if delta is not None:
+                    body, headers = delta, {"X-Delta-From": base}
+                    break
+        if body is snap.body and "gzip" in request.headers.get("Accept-Encoding", ""):
+            packed = snap.gzip()
+            if packed is not None:
+                body, headers = packed, {"Content-Encoding": "gzip"}
+        response = Response(body, mimetype=snap.mimetype, headers=headers)
+    response.set_etag(snap.version)
+    response.headers["X-Weights-Version"] = snap.version
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
 
 @app.route("/get_weights", methods=["GET"])
 def get_weights():
-    if os.path.exists(WEIGHTS_PATH):
-        return send_file(WEIGHTS_PATH)
-    return jsonify({"error": "No weights found"}), 404
+    response = _serve_weights(tuned_weights)
+    if response is None:
+        return jsonify({"error": "No weights found"}), 404
+    return response
 
 @app.route("/get_mcts_weights", methods=["GET"])
 def get_mcts_weights():
-    if os.path.exists(MCTS_WEIGHTS_PATH):
-        return send_file(MCTS_WEIGHTS_PATH)
-    return jsonify({"error": "No MCTS weights found"}), 404
+    # Always a binary checkpoint (legacy JSON weights are converted); add
+    # ?delta=1 and If-None-Match to accept a delta (ai.weight_cache)
+    response = _serve_weights(mcts_weights)
+    if response is None:
+        return jsonify({"error": "No MCTS weights found"}), 404
+    return response
 
 @app.route("/report_result", methods=["POST"])
 def report_result():
-    data = request.get_json()
-    if not data:
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data, dict):
         return jsonify({"error": "No data"}), 400
-        
+
     result = data.get("result") # 1.0 (win), 0.5 (draw), 0.0 (loss)
     if result is None:
         return jsonify({"error": "No result field"}), 400
-    
-    with update_lock:
-        # Update weights based on remote result
-        if os.path.exists(WEIGHTS_PATH):
-            try:
-                with open(WEIGHTS_PATH, "r") as f:
-                    weights = json.load(f)
-                
-                # Stable linear learning rule
-                if result > 0.8:
-                    weights["attack"] += 0.001
-                elif result < 0.2:
-                    weights["defense"] += 0.001
-                
-                with open(WEIGHTS_PATH, "w") as f:
-                    json.dump(weights, f, indent=2)
-            except Exception as e:
-                print(f"Error updating weights: {e}")
-                
-        # Log to results
-        results = []
-        try:
-            if os.path.exists(RESULTS_PATH):
-                with open(RESULTS_PATH, "r") as f:
-                    results = json.load(f)
-            
-            results.append(data)
-            with open(RESULTS_PATH, "w") as f:
-                json.dump(results, f, indent=2)
-        except Exception as e:
-            print(f"Error logging result: {e}")
+    if isinstance(result, bool) or not isinstance(result, (int, float)):
+        return jsonify({"error": "result must be a number"}), 400
+
+    # Logged and folded into the tuned weights by the writer thread
+    return _queued("result", data)
 
 @app.route("/report_mcts_data", methods=["POST"])
 def report_mcts_data():
-    data = request.get_json()
-    if not data:
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data, list):
         return jsonify({"error": "No data"}), 400
-    
-    # data should be a list of triplets: (state, policy, value)
-    with update_lock:
-        all_data = []
-        try:
-            if os.path.exists(MCTS_DATA_PATH):
-                with open(MCTS_DATA_PATH, "r") as f:
-                    all_data = json.load(f)
-            
-            all_data.extend(data)
-            
-            # Limit size to 10k triplets for local performance
-            if len(all_data) > 10000:
-                all_data = all_data[-10000:]
-                
-            with open(MCTS_DATA_PATH, "w") as f:
-                json.dump(all_data, f)
-            print(f"Received {len(data)} training triplets from worker.")
-        except Exception as e:
-            print(f"Error logging MCTS data: {e}")
-            
-    return jsonify({"status": "ok"})
+
+    # data is a list of packed sample records (ai.replay) and/or legacy
+    # [state, policy, value] triplets. A malformed report is rejected here,
+    # before it can reach the replay store. The writer thread merges the
+    # reports of a batch into weighted samples and appends them in one block.
+    try:
+        samples = PackedSamples.from_records(data)
+    except (KeyError, TypeError, ValueError, OverflowError) as e:
+        return jsonify({"error": f"Bad training samples: {e}"}), 400
+    return _queued("samples", samples)
+
+@app.route("/ingest_stats", methods=["GET"])
+def ingest_stats():
+    return jsonify(ingest.stats())
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8000)
+    app.run(host="0.0.0.0", port=8000, threaded=True)
@@ -77,9 +77,24 @@ void Board::loadFEN(const std::string &fen) {
     bitboards[p] |= (1ULL << squareIndex(rank, file));
     file++;
   }
-  std::string stm;
-  ss >> stm;
+  std::string stm, castling, ep;
+  ss >> stm >> castling >> ep;
   sideToMove = (stm == "w") ? WHITE : BLACK;
+
+  castlingRights = 0;
+  for (char c : castling) {
+    if (c == 'K')
+      castlingRights |= 1;
+    else if (c == 'Q')
+      castlingRights |= 2;
+    else if (c == 'k')
+      castlingRights |= 4;
+    else if (c == 'q')
+      castlingRights |= 8;
+  }
+  enPassant = -1;
+  if (ep.size() == 2)
+    enPassant = (ep[1] - '1') * 8 + (ep[0] - 'a');
   recalculateHash();
 }
 
@@ -381,6 +396,8 @@ std::vector<Move> Board::getPseudoLegalMoves() const {
               } else {
                 moves.push_back(Move(from, to_c));
               }
+            } else if (target == EMPTY && to_c == enPassant) {
+              moves.push_back(Move(from, to_c));
             }
           }
         }
@@ -407,6 +424,27 @@ std::vector<Move> Board::getPseudoLegalMoves() const {
               moves.push_back(Move(from, to));
           }
         }
+        // Castling: rook in place, path empty, king not passing through check
+        int home = (p == WK) ? 4 : 60;
+        Color enemy = (p == WK) ? BLACK : WHITE;
+        Piece rook = (p == WK) ? WR : BR;
+        uint8_t kingSide = (p == WK) ? 1 : 4;
+        uint8_t queenSide = (p == WK) ? 2 : 8;
+        if (from == home && !isSquareAttacked(home, enemy)) {
+          if ((castlingRights & kingSide) &&
+              (bitboards[rook] & (1ULL << (home + 3))) &&
+              pieceAt(home + 1) == EMPTY && pieceAt(home + 2) == EMPTY &&
+              !isSquareAttacked(home + 1, enemy) &&
+              !isSquareAttacked(home + 2, enemy))
+            moves.push_back(Move(from, home + 2));
+          if ((castlingRights & queenSide) &&
+              (bitboards[rook] & (1ULL << (home - 4))) &&
+              pieceAt(home - 1) == EMPTY && pieceAt(home - 2) == EMPTY &&
+              pieceAt(home - 3) == EMPTY &&
+              !isSquareAttacked(home - 1, enemy) &&
+              !isSquareAttacked(home - 2, enemy))
+            moves.push_back(Move(from, home - 2));
+        }
       } else {
         // Sliders
         const int *dirs = (p == WR || p == BR)
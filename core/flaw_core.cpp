@@ -1,10 +1,21 @@
 #include "board.h"
 #include "dis.h"
+#include "int8.h"
+#include <pybind11/numpy.h>
 #include <pybind11/pybind11.h>
 #include <pybind11/stl.h>
+#include <stdexcept>
 
 namespace py = pybind11;
 
+template <typename T>
+using Array = py::array_t<T, py::array::c_style | py::array::forcecast>;
+
+static void require(bool ok, const char *what) {
+  if (!ok)
+    throw std::invalid_argument(what);
+}
+
 PYBIND11_MODULE(flaw_core, m) {
   py::class_<Move>(m, "Move")
       .def(py::init<int, int, Piece>())
@@ -37,10 +48,29 @@ PYBIND11_MODULE(flaw_core, m) {
       .def("make_move", &Board::makeMove)
       .def("generate_moves",
            [](const Board &b) { return MoveGen::generateLegalMoves(b); })
+      // Legal moves packed as from | to << 6 | promotion type << 12 (N=2..Q=5)
+      .def("generate_move_codes",
+           [](const Board &b) {
+             std::vector<int> codes;
+             for (const Move &m : MoveGen::generateLegalMoves(b)) {
+               int promo = m.promotion == EMPTY ? 0 : (m.promotion - 1) % 6 + 1;
+               codes.push_back(m.from | (m.to << 6) | (promo << 12));
+             }
+             return codes;
+           })
       .def("is_game_over", &Board::isGameOver)
       .def("get_result", &Board::getResult)
       .def("piece_at", &Board::pieceAt)
-      .def_readwrite("side_to_move", &Board::sideToMove);
+      .def("hash", &Board::hash)
+      .def("is_square_attacked", &Board::isSquareAttacked)
+      .def_property_readonly("bitboards",
+                             [](const Board &b) {
+                               return std::vector<uint64_t>(b.bitboards,
+                                                            b.bitboards + 13);
+                             })
+      .def_readwrite("side_to_move", &Board::sideToMove)
+      .def_readwrite("castling_rights", &Board::castlingRights)
+      .def_readwrite("en_passant", &Board::enPassant);
 
   py::class_<IntentContext>(m, "IntentContext")
       .def(py::init<double, double, double, double, double>(),
@@ -55,4 +85,58 @@ PYBIND11_MODULE(flaw_core, m) {
   m.def("search", &DIS::search, "Run DIS search",
         py::call_guard<py::gil_scoped_release>());
   m.def("Evaluator_evaluate", &Evaluator::evaluate, "Run C++ evaluator");
+
+  // Int8 kernels for ai.quantize.QuantizedAlphaZero; all return int32 sums
+  m.def(
+      "int8_matmul",
+      [](Array<uint8_t> a, Array<int8_t> w) {
+        require(a.ndim() == 2 && w.ndim() == 2 && a.shape(1) == w.shape(0),
+                "int8_matmul: expected a [n, k] and w [k, m]");
+        int n = a.shape(0), k = a.shape(1), m = w.shape(1);
+        py::array_t<int32_t> out({n, m});
+        {
+          py::gil_scoped_release release;
+          Int8::matmul(a.data(), n, k, w.data(), m, out.mutable_data());
+        }
+        return out;
+      },
+      "uint8 a [n, k] x int8 w [k, m], skipping zero activations");
+  m.def(
+      "int8_matmul_t",
+      [](Array<uint8_t> a, Array<int8_t> wt) {
+        require(a.ndim() == 2 && wt.ndim() == 2 && a.shape(1) == wt.shape(1),
+                "int8_matmul_t: expected a [n, h] and wt [m, h]");
+        int n = a.shape(0), h = a.shape(1), m = wt.shape(0);
+        py::array_t<int32_t> out({n, m});
+        {
+          py::gil_scoped_release release;
+          Int8::matmulT(a.data(), n, h, wt.data(), m, out.mutable_data());
+        }
+        return out;
+      },
+      "uint8 a [n, h] x int8 wt [m, h] transposed");
+  m.def(
+      "int8_gather_dot",
+      [](Array<uint8_t> a, Array<int8_t> wt, Array<int64_t> rows,
+         Array<int64_t> cols) {
+        require(a.ndim() == 2 && wt.ndim() == 2 && a.shape(1) == wt.shape(1),
+                "int8_gather_dot: expected a [n, h] and wt [m, h]");
+        require(rows.ndim() == 1 && cols.ndim() == 1 &&
+                    rows.shape(0) == cols.shape(0),
+                "int8_gather_dot: rows and cols must be 1-d and equally long");
+        int count = rows.shape(0);
+        const int64_t *r = rows.data(), *c = cols.data();
+        for (int i = 0; i < count; i++)
+          require(0 <= r[i] && r[i] < a.shape(0) && 0 <= c[i] &&
+                      c[i] < wt.shape(0),
+                  "int8_gather_dot: index out of range");
+        py::array_t<int32_t> out(count);
+        {
+          py::gil_scoped_release release;
+          Int8::gatherDot(a.data(), a.shape(1), wt.data(), r, c, count,
+                          out.mutable_data());
+        }
+        return out;
+      },
+      "a[rows[i]] . wt[cols[i]] for each i (uint8 x int8)");
 }
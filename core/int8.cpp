@@ -0,0 +1,63 @@
+#include "int8.h"
+#include <cstring>
+
+// Plain loops over contiguous int8 / uint8 rows, written so that the
+// compiler vectorizes them (widening multiply-add into int32 lanes).
+
+static inline int32_t dot(const uint8_t *a, const int8_t *w, int h) {
+  int32_t sum = 0;
+  for (int i = 0; i < h; i++)
+    sum += int32_t(a[i]) * int32_t(w[i]);
+  return sum;
+}
+
+void Int8::matmul(const uint8_t *a, int n, int k, const int8_t *w, int m,
+                  int32_t *out) {
+  for (int r = 0; r < n; r++) {
+    int32_t *acc = out + int64_t(r) * m;
+    std::memset(acc, 0, sizeof(int32_t) * m);
+    const uint8_t *row = a + int64_t(r) * k;
+    for (int i = 0; i < k; i++) {
+      int32_t v = row[i];
+      if (!v)
+        continue;
+      const int8_t *wi = w + int64_t(i) * m;
+      for (int j = 0; j < m; j++)
+        acc[j] += v * int32_t(wi[j]);
+    }
+  }
+}
+
+void Int8::matmulT(const uint8_t *a, int n, int h, const int8_t *wt, int m,
+                   int32_t *out) {
+  // Each weight row is loaded once per four activation rows
+  for (int j = 0; j < m; j++) {
+    const int8_t *wj = wt + int64_t(j) * h;
+    int r = 0;
+    for (; r + 4 <= n; r += 4) {
+      const uint8_t *a0 = a + int64_t(r) * h, *a1 = a0 + h, *a2 = a1 + h,
+                    *a3 = a2 + h;
+      int32_t s0 = 0, s1 = 0, s2 = 0, s3 = 0;
+      for (int i = 0; i < h; i++) {
+        int32_t w = wj[i];
+        s0 += int32_t(a0[i]) * w;
+        s1 += int32_t(a1[i]) * w;
+        s2 += int32_t(a2[i]) * w;
+        s3 += int32_t(a3[i]) * w;
+      }
+      out[int64_t(r) * m + j] = s0;
+      out[int64_t(r + 1) * m + j] = s1;
+      out[int64_t(r + 2) * m + j] = s2;
+      out[int64_t(r + 3) * m + j] = s3;
+    }
+    for (; r < n; r++)
+      out[int64_t(r) * m + j] = dot(a + int64_t(r) * h, wj, h);
+  }
+}
+
+void Int8::gatherDot(const uint8_t *a, int h, const int8_t *wt,
+                     const int64_t *rows, const int64_t *cols, int count,
+                     int32_t *out) {
+  for (int i = 0; i < count; i++)
+    out[i] = dot(a + rows[i] * h, wt + cols[i] * h, h);
+}
@@ -0,0 +1,20 @@
+#ifndef INT8_H
+#define INT8_H
+#include <cstdint>
+
+// Integer products for the quantized network (ai/quantize.py): uint8
+// activations times int8 weights, summed in int32. 255 * 127 * hidden stays
+// far below 2^31 for any hidden size the network uses.
+namespace Int8 {
+// out[n, m] = a[n, k] x w[k, m]. Zero activations are skipped, so a mostly
+// zero a (the 0/1 board inputs) costs only its nonzero rows of w.
+void matmul(const uint8_t *a, int n, int k, const int8_t *w, int m,
+            int32_t *out);
+// out[n, m] = a[n, h] x wt[m, h]^T, wt holding one row per output
+void matmulT(const uint8_t *a, int n, int h, const int8_t *wt, int m,
+             int32_t *out);
+// out[i] = a[rows[i]] . wt[cols[i]], for the legal-move logits
+void gatherDot(const uint8_t *a, int h, const int8_t *wt, const int64_t *rows,
+               const int64_t *cols, int count, int32_t *out);
+} // namespace Int8
+#endif